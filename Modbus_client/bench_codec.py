@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+""" Size and speed of packed BLOB blocks against the comma-joined
+text stored before. For each block shape random values are
+encoded and decoded N times, and N history rows of each format
+are written to a SQLite file in a temporary directory to
+compare the file sizes.
+
+~$ python3 bench_codec.py -n 20000"""
+
+import os
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+
+from modbus_codec import pack, unpack
+
+
+#block, number of values
+SHAPES = (("di", 4), ("ir", 8), ("co", 2000), ("hr", 125))
+
+
+#parses the given argument in CLI
+def args_parser():
+    parser = argparse.ArgumentParser(
+        prog="bench_codec.py",
+        description="Packed BLOB vs comma-joined text blocks"
+    )
+    parser.add_argument("-n", "--rows", type=int, default=20000, help="rows per block shape")
+    return parser.parse_args()
+
+
+#the text format before modbus_codec
+def text_encode(block, values):
+    if block in ("di", "co"):
+        return ",".join("1" if b else "0" for b in values)
+    return ",".join(str(r) for r in values)
+
+
+def text_decode(block, text):
+    if block in ("di", "co"):
+        return [v == "1" for v in text.split(",")]
+    return [int(v) for v in text.split(",")]
+
+
+def per_row_us(func, items):
+    start = time.perf_counter()
+    for item in items:
+        func(item)
+    return (time.perf_counter() - start) / len(items) * 1e6
+
+
+def file_size(rows):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "bench.sqlite")
+        conn = sqlite3.connect(db_file)
+        conn.execute("CREATE TABLE history (ts REAL, vals)")
+        with conn:
+            conn.executemany("INSERT INTO history VALUES (?, ?)", enumerate(rows))
+        conn.close()
+        return os.path.getsize(db_file)
+
+
+def main():
+    """"main function"""
+
+    args = args_parser()
+    print(f"{args.rows} rows per shape, times in us per row")
+    print(f"{'block':<9} {'format':<6} {'bytes/row':>9} {'file KiB':>9} {'encode':>8} {'decode':>8}")
+    for block, count in SHAPES:
+        if block in ("di", "co"):
+            rows = [[random.random() < 0.5 for _ in range(count)] for _ in range(args.rows)]
+        else:
+            rows = [[random.randrange(65536) for _ in range(count)] for _ in range(args.rows)]
+        for name, encode, decode in (
+            ("text", text_encode, text_decode),
+            ("packed", pack, unpack),
+        ):
+            encode_us = per_row_us(lambda values: encode(block, values), rows)
+            encoded = [encode(block, values) for values in rows]
+            decode_us = per_row_us(lambda data: decode(block, data), encoded)
+            size = sum(len(data) for data in encoded) / len(encoded)
+            print(
+                f"{block}[{count}]".ljust(9) + f" {name:<6} {size:>9.1f} "
+                f"{file_size(encoded) / 1024:>9.0f} {encode_us:>8.2f} {decode_us:>8.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+""" SQLite throughput with a polling writer and REST readers at
+the same time, connect-per-call vs the shared modbus_db layer.
+The writer saves a changed server state per call, like
+save_modbus_state, and every reader does what one REST request
+does, verify_token and ModbusStatus.get. Each case runs on a
+fresh database file in a temporary directory.
+
+~$ python3 bench_db.py --readers 4 -d 5"""
+
+import os
+import time
+import sqlite3
+import argparse
+import tempfile
+import threading
+
+import modbus_db
+from modbus_auth import TokenCache
+
+
+#parses the given argument in CLI
+def args_parser():
+    parser = argparse.ArgumentParser(
+        prog="bench_db.py",
+        description="Concurrent SQLite writes and reads, per call connections vs modbus_db"
+    )
+    parser.add_argument("-r", "--readers", type=int, default=4, help="REST reader threads")
+    parser.add_argument("-d", "--duration", type=float, default=5.0, help="seconds per case")
+    return parser.parse_args()
+
+
+#the code paths before modbus_db, a connection and schema check per call
+def legacy_save_state(db_file, ip, di, co, ir, hr):
+    conn = sqlite3.connect(db_file)
+    cur = conn.cursor()
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS modbus (
+            ip TEXT PRIMARY KEY,
+            di TEXT,
+            co TEXT,
+            ir TEXT,
+            hr TEXT
+        )
+    """)
+    cur.execute(modbus_db.SAVE_STATE, (ip, di, co, ir, hr))
+    conn.commit()
+    conn.close()
+
+
+def legacy_request(db_file, token):
+    conn = sqlite3.connect(db_file)
+    cur = conn.cursor()
+    cur.execute("SELECT username FROM tokens WHERE password = ?", (token,))
+    cur.fetchone()
+    conn.close()
+    conn = sqlite3.connect(db_file)
+    cur = conn.cursor()
+    cur.execute(modbus_db.FIRST_STATE)
+    cur.fetchone()
+    conn.close()
+
+
+def shared_save_state(db_file, ip, di, co, ir, hr):
+    modbus_db.save_state(ip, di, co, ir, hr, db_file)
+
+
+#like the REST server, the slow token hash runs once and is then cached
+token_cache = TokenCache()
+
+
+def shared_request(db_file, token):
+    token_cache.verify(token, lambda token: modbus_db.token_user(token, db_file))
+    modbus_db.first_state(db_file)
+
+
+def run_case(save, request, readers, duration):
+    """Return writes/s, reads/s, read p99 ms and errors"""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "bench.sqlite")
+        modbus_db.save_user("test", "test", db_file)
+        modbus_db.close()
+        token_cache.invalidate()
+
+        stop = threading.Event()
+        counts = {"writes": 0, "errors": 0}
+        latencies = [[] for _ in range(readers)]
+
+        def writer():
+            n = 0
+            while not stop.is_set():
+                n += 1
+                try:
+                    save(db_file, "127.0.0.1", "1,0,1,0", "0,1,0,1",
+                         ",".join(str((n + i) % 65536) for i in range(8)), "1,2,3,4,5,6,7,8")
+                    counts["writes"] += 1
+                except sqlite3.Error:
+                    counts["errors"] += 1
+            modbus_db.close()
+
+        def reader(times):
+            while not stop.is_set():
+                start = time.perf_counter()
+                try:
+                    request(db_file, "test")
+                    times.append(time.perf_counter() - start)
+                except sqlite3.Error:
+                    counts["errors"] += 1
+            modbus_db.close()
+
+        threads = [threading.Thread(target=writer)]
+        threads += [threading.Thread(target=reader, args=(times,)) for times in latencies]
+        for thread in threads:
+            thread.start()
+        time.sleep(duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    every = sorted(t for times in latencies for t in times)
+    p99 = every[int(len(every) * 0.99)] * 1000 if every else 0.0
+    return counts["writes"] / duration, len(every) / duration, p99, counts["errors"]
+
+
+def main():
+    """"main function"""
+
+    args = args_parser()
+    print(f"1 writer, {args.readers} readers, {args.duration:g}s per case")
+    print(f"{'case':<16} {'writes/s':>9} {'reads/s':>9} {'read p99 ms':>12} {'errors':>7}")
+    cases = (
+        ("connect per call", legacy_save_state, legacy_request),
+        ("modbus_db", shared_save_state, shared_request),
+    )
+    for name, save, request in cases:
+        writes, reads, p99, errors = run_case(save, request, args.readers, args.duration)
+        print(f"{name:<16} {writes:>9.0f} {reads:>9.0f} {p99:>12.2f} {errors:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+""" Latency of a full four block snapshot, sequential vs pipelined.
+A local modbus_server.py is started and reached through a proxy
+that delays every chunk by half the injected round trip time in
+each direction, like a WAN link.
+
+~$ python3 bench_read_all.py --rtt 0 20 100 -n 20"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import threading
+import subprocess
+from pymodbus.client import ModbusTcpClient
+
+from modbus_pipeline import PipelinedReader
+
+HOST = "127.0.0.1"
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER = os.path.join(BASE_DIR, "..", "modbus_server", "modbus_server.py")
+
+
+#parses the given argument in CLI
+def args_parser():
+    parser = argparse.ArgumentParser(
+        prog="bench_read_all.py",
+        description="Sequential vs pipelined read_all latency"
+    )
+    parser.add_argument("--rtt", nargs="+", type=float, default=[0, 20, 100],
+                        help="injected round trip times in ms")
+    parser.add_argument("-n", "--runs", type=int, default=20, help="snapshots per case")
+    parser.add_argument("-p", "--port", type=int, default=5020, help="server port")
+    parser.add_argument("-x", "--proxy-port", type=int, default=5120, help="proxy port")
+    return parser.parse_args()
+
+
+async def pipe(reader, writer, delay):
+    """Forward bytes, each chunk delayed without holding back the next"""
+
+    loop = asyncio.get_running_loop()
+    while data := await reader.read(65536):
+        loop.call_later(delay, writer.write, data)
+    loop.call_later(delay, writer.close)
+
+
+async def proxy(listen_port, port, delay):
+    """TCP proxy adding delay seconds in each direction"""
+
+    async def handle(client_reader, client_writer):
+        server_reader, server_writer = await asyncio.open_connection(HOST, port)
+        await asyncio.gather(
+            pipe(client_reader, server_writer, delay),
+            pipe(server_reader, client_writer, delay),
+        )
+
+    server = await asyncio.start_server(handle, HOST, listen_port)
+    async with server:
+        await server.serve_forever()
+
+
+def start_proxy(listen_port, port, delay):
+    """Run the proxy on a daemon thread"""
+
+    thread = threading.Thread(
+        target=asyncio.run, args=(proxy(listen_port, port, delay),), daemon=True
+    )
+    thread.start()
+    time.sleep(0.2)
+
+
+def sequential(client):
+    """The four reads one after the other, as before"""
+
+    client.read_discrete_inputs(0, 4, slave=1)
+    client.read_coils(0, 4, slave=1)
+    client.read_input_registers(0, 8, slave=1)
+    client.read_holding_registers(0, 8, slave=1)
+
+
+def timed(func, runs):
+    """Return the median and max time of func() in ms"""
+
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    return times[len(times) // 2], times[-1]
+
+
+def main():
+    """"main function"""
+
+    args = args_parser()
+    server = subprocess.Popen(
+        [sys.executable, SERVER, "-H", HOST, "-p", str(args.port), "-q"],
+        cwd=os.path.dirname(SERVER),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        time.sleep(2)
+        print(f"{'rtt ms':>7} {'sequential ms':>14} {'pipelined ms':>13} {'speedup':>8}")
+        for i, rtt in enumerate(args.rtt):
+            proxy_port = args.proxy_port + i
+            start_proxy(proxy_port, args.port, rtt / 2000)
+            client = ModbusTcpClient(host=HOST, port=proxy_port, timeout=10)
+            client.connect()
+            reader = PipelinedReader(HOST, proxy_port, timeout=10)
+            reader.connect()
+            seq, _ = timed(lambda: sequential(client), args.runs)
+            pip, _ = timed(reader.read_all, args.runs)
+            print(f"{rtt:>7g} {seq:>14.1f} {pip:>13.1f} {seq / pip:>7.1f}x")
+            client.close()
+            reader.close()
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
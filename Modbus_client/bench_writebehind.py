@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+""" Time spent in the caller per block write saved to SQLite,
+a synchronous save_field vs the write-behind StateWriter. Every
+case writes N values to a few servers' hr blocks, like repeated
+"Write Holding Registers", on a fresh database file in a
+temporary directory, and checks the last values were stored.
+
+~$ python3 bench_writebehind.py -n 5000 --servers 4"""
+
+import os
+import time
+import argparse
+import tempfile
+
+import modbus_db
+from modbus_codec import pack
+from modbus_stats import percentile
+from modbus_writebehind import StateWriter
+
+
+#parses the given argument in CLI
+def args_parser():
+    parser = argparse.ArgumentParser(
+        prog="bench_writebehind.py",
+        description="Synchronous vs write-behind saving of written blocks"
+    )
+    parser.add_argument("-n", "--writes", type=int, default=5000, help="block writes per case")
+    parser.add_argument("--servers", type=int, default=4, help="distinct server ips")
+    return parser.parse_args()
+
+
+def run_case(name, writes, servers):
+    """Return per-call latencies, seconds until stored and commits"""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "bench.sqlite")
+        modbus_db.connect(db_file)
+        writer = StateWriter(db_file) if name == "write-behind" else None
+        if writer is not None:
+            writer.start()
+        times = []
+        start = time.perf_counter()
+        for n in range(writes):
+            ip = f"10.0.0.{n % servers}"
+            blob = pack("hr", [(n + i) % 10 for i in range(8)])
+            t = time.perf_counter()
+            if writer is None:
+                modbus_db.save_field(ip, "hr", blob, db_file)
+            else:
+                writer.save_field(ip, "hr", blob)
+            times.append(time.perf_counter() - t)
+        if writer is not None:
+            writer.stop()
+        total = time.perf_counter() - start
+        commits = writes if writer is None else writer.commits
+        stored = modbus_db.connect(db_file).execute(
+            "SELECT hr FROM modbus WHERE ip = ?", (ip,)
+        ).fetchone()[0]
+        assert stored == blob, "last write was not stored"
+        modbus_db.close()
+    return sorted(times), total, commits
+
+
+def main():
+    """"main function"""
+
+    args = args_parser()
+    print(f"{args.writes} writes to {args.servers} servers, per call times in us")
+    print(f"{'case':<13} {'p50':>8} {'p99':>8} {'max':>9} {'total s':>8} {'commits':>8}")
+    for name in ("synchronous", "write-behind"):
+        times, total, commits = run_case(name, args.writes, args.servers)
+        print(
+            f"{name:<13} {percentile(times, 50) * 1e6:>8.1f} {percentile(times, 99) * 1e6:>8.1f} "
+            f"{times[-1] * 1e6:>9.1f} {total:>8.2f} {commits:>8}"
+        )
+
+
+if __name__ == "__main__":
+    main()
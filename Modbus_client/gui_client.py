@@ -1,14 +1,14 @@
 #!/usr/bin/env python3
 
 import tkinter as tk
-import os
 import sqlite3
 from getpass import getpass
-from pymodbus.client import ModbusTcpClient
 from pymodbus.mei_message import ReadDeviceInformationRequest
-
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_FILE = os.path.join(BASE_DIR, "modbus_db.sqlite")
+from modbus_pool import get_pool, close_all
+from modbus_cache import TTL
+from modbus_codec import pack
+from modbus_writebehind import StateWriter
+from modbus_db import connect as connect_db, save_user, close as close_db
 
 # Setting up the GUI frames
 root = tk.Tk()
@@ -39,6 +39,9 @@ navbar_frame = tk.Frame(main_frame, width=200, bg="#1a2b4c")
 navbar_frame.pack(side="left", fill="y")
 content_frame = tk.Frame(main_frame, bg="#f0f0f0")
 content_frame.pack(side="right", expand=True, fill="both")
+#written blocks are saved by a writer thread so SQLite never blocks the Tk loop
+state_writer = StateWriter()
+state_writer.start()
 
 
 def save_modbus_field(ip, field, value):
@@ -48,26 +51,7 @@ def save_modbus_field(ip, field, value):
 
     if field not in ["di", "co", "ir", "hr"]:
         return
-    try:
-        conn = sqlite3.connect(DB_FILE)
-        cur = conn.cursor()
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS modbus (
-                ip TEXT PRIMARY KEY,
-                di TEXT,
-                co TEXT,
-                ir TEXT,
-                hr TEXT
-            )
-        """)
-        cur.execute("SELECT ip FROM modbus WHERE ip = ?", (ip,))
-        if cur.fetchone() is None:
-            cur.execute("INSERT INTO modbus (ip) VALUES (?)", (ip,))
-        cur.execute(f"UPDATE modbus SET {field} = ? WHERE ip = ?", (value, ip))
-        conn.commit()
-        conn.close()
-    except sqlite3.Error as e:
-        tk.Label(content_frame, text=f"Database error: {e}", fg="red", bg="#f0f0f0").pack()
+    state_writer.save_field(ip, field, value)
 
 
 #user cretion in sqlite
@@ -97,26 +81,7 @@ def create_user():
             return
 
         try:
-            conn = sqlite3.connect(DB_FILE)
-            cur = conn.cursor()
-
-         
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS tokens (
-                    username TEXT PRIMARY KEY,
-                    password TEXT
-                )
-            """)
-
-           
-            cur.execute("""
-                INSERT INTO tokens (username, password)
-                VALUES (?, ?)
-                ON CONFLICT(username) DO UPDATE SET password=excluded.password
-            """, (username, password))
-
-            conn.commit()
-            conn.close()
+            save_user(username, password)
             tk.Label(content_frame, text=f"User '{username}' added/updated.", fg="green", bg="#f0f0f0").pack()
 
         except sqlite3.Error as e:
@@ -230,10 +195,8 @@ def read_all_blocks():
         return
 
     try:
-        di = client.read_discrete_inputs(0, 4, slave=1)
-        co = client.read_coils(0, 4, slave=1)
-        ir = client.read_input_registers(0, 8, slave=1)
-        hr = client.read_holding_registers(0, 8, slave=1)
+        blocks = client.read_all()
+        di, co, ir, hr = blocks["di"], blocks["co"], blocks["ir"], blocks["hr"]
 
         if not di.isError():
             tk.Label(content_frame, text="Discrete Inputs:", font=("Arial", 12), bg="#f0f0f0").grid(row=2, column=0, sticky="w")
@@ -273,29 +236,14 @@ def connect_to_server():
     current_ip = ip
 
     try:
-        client = ModbusTcpClient(host=ip, port=port)
+        #reconnecting to the same server reuses its pooled connections,
+        #slow reads are hedged so a lagging PLC doesn't freeze the window
+        client = get_pool(ip, port, cache_ttl=TTL, hedge=True).client
         if client.connect():
             status.config(text=f"Connected to {ip}:{port}", fg="green")
 
-            conn = sqlite3.connect(DB_FILE)
-            cur = conn.cursor()
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS modbus (
-                    ip TEXT PRIMARY KEY,
-                    di TEXT,
-                    co TEXT,
-                    ir TEXT,
-                    hr TEXT
-                )
-            """)
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS tokens (
-                    username TEXT PRIMARY KEY,
-                    password TEXT
-                )
-            """)
-            conn.commit()
-            conn.close()
+            #makes sure the database and its tables exist for the REST server
+            connect_db()
 
             try:
                 info_request = ReadDeviceInformationRequest()
@@ -352,7 +300,7 @@ def write_output_coils():
             tk.Label(content_frame, text="Failed to write to coils.", fg="red", bg="#f0f0f0").pack()
         else:
             tk.Label(content_frame, text="Coil values written successfully.", fg="green", bg="#f0f0f0").pack()
-            save_modbus_field(current_ip, "co", ",".join(map(str, map(int, bits))))
+            save_modbus_field(current_ip, "co", pack("co", bits))
 
     for i, bit in enumerate(current_bits):
         var = tk.IntVar(value=int(bit))
@@ -412,7 +360,7 @@ def write_holding_registers():
             tk.Label(content_frame, text="Failed to write to holding registers.", fg="red", bg="#f0f0f0").pack()
         else:
             tk.Label(content_frame, text="Holding register values written successfully.", fg="green", bg="#f0f0f0").pack()
-            save_modbus_field(current_ip, "hr", ",".join(map(str, values)))
+            save_modbus_field(current_ip, "hr", pack("hr", values))
 
     for i, val in enumerate(current_values):
         frame = tk.Frame(content_frame, bg="#f0f0f0")
@@ -427,6 +375,30 @@ def write_holding_registers():
     submit_btn = tk.Button(content_frame, text="Submit", command=submit)
     submit_btn.pack(pady=10)
 
+#shows the server state, read cache counters and the database
+#write queue in the status bar once a second
+def refresh_pool_status():
+    db_info.config(
+        text=f"db queue {state_writer.depth()}"
+        + (f", error: {state_writer.last_error}" if state_writer.last_error else ""),
+        fg="red" if state_writer.last_error else "gray",
+    )
+    if client is not None:
+        pool = client.pool
+        if pool.breaker.state() != "closed":
+            status.config(text=pool.breaker.describe(), fg="red")
+        elif status.cget("text").startswith(pool.breaker.name):
+            status.config(text=f"Connected to {pool.breaker.name}", fg="green")
+        if pool.cache is not None:
+            cache_info.config(text=pool.cache.stats())
+    root.after(1000, refresh_pool_status)
+
+cache_info = tk.Label(connection_frame, text="", fg="gray", bg="#dfe6e9")
+cache_info.pack(side="right", padx=10)
+db_info = tk.Label(connection_frame, text="", fg="gray", bg="#dfe6e9")
+db_info.pack(side="right", padx=10)
+refresh_pool_status()
+
 #used a tuple list to store and loop
 buttons = [
     ("Read Discrete Inputs", read_discrete_inputs),
@@ -448,3 +420,6 @@ connect_btn = tk.Button(connection_frame, text="Connect", command=connect_to_ser
 connect_btn.pack(side="left", padx=10)
 
 root.mainloop()
+state_writer.stop()
+close_all()
+close_db()
@@ -63,8 +63,10 @@ function App() {
     };
   }, []);
 
-  const parseBools = (s) => s?.split(',').map(b => b.trim() === '1') || [];
-  const parseInts = (s) => s?.split(',').map(v => parseInt(v.trim(), 10)) || [];
+  // blocks arrive as JSON arrays, older servers sent comma-joined strings
+  const toList = (v) => Array.isArray(v) ? v : (v ? v.split(',').map(x => x.trim()) : []);
+  const parseBools = (v) => toList(v).map(b => b === true || b === 1 || b === '1');
+  const parseInts = (v) => toList(v).map(r => typeof r === 'number' ? r : parseInt(r, 10));
 
   return (
     <div className='w-screen h-screen flex flex-col py-6 justify-center items-center space-y-5'>
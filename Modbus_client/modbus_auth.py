@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+""" Hashed API tokens and the REST server's verification cache.
+Tokens are stored as salted PBKDF2-SHA256 hashes, slow on
+purpose, so a copied database doesn't give the tokens away. A
+short tag (the first hex digits of the token's SHA-256) picks
+the rows to check without hashing the token against every user.
+Verified tokens are kept in an LRU with a TTL, keyed by their
+SHA-256, so repeated requests don't touch the database or the
+slow hash. Unknown tokens are cached for a shorter time, so a
+client retrying a bad token can't keep the CPU busy hashing."""
+
+import os
+import hmac
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+ITERATIONS = 200_000
+SCHEME = "pbkdf2_sha256"
+TAG_DIGITS = 4
+CACHE_SIZE = 1024
+CACHE_TTL = 300.0
+NEGATIVE_TTL = 5.0
+#seconds between checks of the database's token version
+VERSION_CHECK = 1.0
+
+
+def token_tag(token):
+    return hashlib.sha256(token.encode()).hexdigest()[:TAG_DIGITS]
+
+
+def hash_token(token, iterations=ITERATIONS):
+    """'pbkdf2_sha256$iterations$salt$hash' of a token"""
+
+    salt = os.urandom(16)
+    digest = hashlib.pbkdf2_hmac("sha256", token.encode(), salt, iterations)
+    return f"{SCHEME}${iterations}${salt.hex()}${digest.hex()}"
+
+
+def is_hashed(stored):
+    return stored is not None and stored.startswith(SCHEME + "$")
+
+
+def check_token(token, stored):
+    """True when token matches a hash_token() string"""
+
+    if not is_hashed(stored):
+        return False
+    _, iterations, salt, digest = stored.split("$")
+    candidate = hashlib.pbkdf2_hmac("sha256", token.encode(), bytes.fromhex(salt), int(iterations))
+    return hmac.compare_digest(candidate.hex(), digest)
+
+
+class TokenCache:
+    """LRU of token -> username (None for unknown tokens) with a
+    TTL. version() returns a number that changes whenever the
+    tokens table does, it is checked at most every VERSION_CHECK
+    seconds and a new value empties the cache, so a password
+    changed by another process stops working within that time"""
+
+    def __init__(self, version=None, size=CACHE_SIZE, ttl=CACHE_TTL, negative_ttl=NEGATIVE_TTL):
+        self.version = version
+        self.size = size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.seen_version = None
+        self.checked = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, token):
+        return hashlib.sha256(token.encode()).digest()
+
+    def _sync(self, now):
+        if self.version is None or now - self.checked < VERSION_CHECK:
+            return
+        self.checked = now
+        version = self.version()
+        if version != self.seen_version:
+            self.seen_version = version
+            self.entries.clear()
+
+    def get(self, token):
+        """(True, username or None) when cached, (False, None) when not"""
+
+        now = time.monotonic()
+        key = self._key(token)
+        with self.lock:
+            self._sync(now)
+            entry = self.entries.get(key)
+            if entry is None or entry[1] < now:
+                self.misses += 1
+                return False, None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[0]
+
+    def put(self, token, username):
+        ttl = self.ttl if username is not None else self.negative_ttl
+        with self.lock:
+            self.entries[self._key(token)] = (username, time.monotonic() + ttl)
+            self.entries.move_to_end(self._key(token))
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, username=None):
+        """Forget one user's tokens, or every cached token"""
+
+        with self.lock:
+            if username is None:
+                self.entries.clear()
+                return
+            #unknown tokens go too, one of them may be the new password
+            for key in [k for k, (user, _) in self.entries.items() if user in (username, None)]:
+                del self.entries[key]
+
+    def verify(self, token, lookup):
+        """Username of token, lookup(token) runs only on a miss"""
+
+        cached, username = self.get(token)
+        if not cached:
+            username = lookup(token)
+            self.put(token, username)
+        return username
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+""" Per-server circuit breaker for modbus_pool.
+Closed, requests go through and failures in a row are counted.
+After `threshold` of them the breaker opens and every request
+fails fast for `open_time` seconds, doubled each time the
+server is found still down, up to `open_max`. Then it is
+half-open: a single trial request goes through, success closes
+the breaker again and failure reopens it."""
+
+import time
+import threading
+from pymodbus.exceptions import ConnectionException
+
+
+THRESHOLD = 3
+OPEN_TIME = 0.5
+OPEN_MAX = 30
+
+
+class CircuitOpen(ConnectionException):
+    """Raised instead of sending a request while the breaker is open"""
+
+
+class CircuitBreaker:
+    """Failure bookkeeping of one server, shared by every thread"""
+
+    def __init__(self, name, threshold=THRESHOLD, open_time=OPEN_TIME, open_max=OPEN_MAX):
+        self.name = name
+        self.threshold = threshold
+        self.open_time = open_time
+        self.open_max = open_max
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.trips = 0
+        self.opened = 0
+        self.retry_at = 0.0
+        self.trial = False
+
+    def check(self):
+        """Let a request through or raise CircuitOpen, every request
+        let through must report success(), failure() or release()"""
+
+        with self.lock:
+            if self.failures < self.threshold:
+                return
+            wait = self.retry_at - time.monotonic()
+            if wait > 0 or self.trial:
+                raise CircuitOpen(
+                    f"{self.name} is down, retrying in {max(wait, 0):.1f}s"
+                )
+            self.trial = True
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.trips = 0
+            self.trial = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial = False
+            if self.failures >= self.threshold:
+                #opening again right after the trial backs off further
+                delay = min(self.open_time * 2 ** self.trips, self.open_max)
+                self.trips += 1
+                self.opened += 1
+                self.retry_at = time.monotonic() + delay
+
+    def release(self):
+        """A request let through was never sent, e.g. no connection
+        was free, so it counts neither way and the next one can be
+        the trial"""
+
+        with self.lock:
+            self.trial = False
+
+    def state(self):
+        """'closed', 'open' or 'half-open'"""
+
+        with self.lock:
+            if self.failures < self.threshold:
+                return "closed"
+            return "open" if self.retry_at > time.monotonic() or self.trial else "half-open"
+
+    def describe(self):
+        state = self.state()
+        if state == "open":
+            return f"{self.name} down, retry in {max(self.retry_at - time.monotonic(), 0):.1f}s"
+        return f"{self.name} {state}"
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+""" Streaming bulk writes for modbus_client.py --write.
+Commands are read from a file or stdin, one per line, as CSV
+or NDJSON:
+
+    hr,100,1234
+    co,7,1
+    {"block": "hr", "address": 200, "values": [1, 2, 3]}
+
+Consecutive commands for contiguous addresses of the same
+block are coalesced into one write multiple coils/registers
+request, and up to `window` requests are kept in flight on one
+connection. The server applies them in order, so the result is
+the same as writing the lines one by one. A sampled fraction
+of the requests is verified by a read sent right behind the
+write, so no later write can land in between."""
+
+import sys
+import json
+import time
+import random
+import asyncio
+from pymodbus.client import AsyncModbusTcpClient
+
+
+#largest write multiple requests allowed by the Modbus spec
+MAX_COUNT = {"co": 1968, "hr": 123}
+WINDOW = 16
+
+
+def parse_line(line):
+    """Return (block, address, [values]) for one CSV or NDJSON line,
+    None for blank lines, comments and a CSV header"""
+
+    line = line.strip()
+    if not line or line.startswith("#") or line.startswith("block"):
+        return None
+    if line.startswith("{"):
+        command = json.loads(line)
+        block = command["block"]
+        address = command["address"]
+        values = command["values"] if "values" in command else [command["value"]]
+    else:
+        block, address, *values = [v.strip() for v in line.split(",")]
+    if block not in MAX_COUNT:
+        raise ValueError(f"block must be co or hr, not '{block}'")
+    address = int(address)
+    if block == "co":
+        values = [str(v).lower() in ("1", "true") for v in values]
+    else:
+        values = [int(v) for v in values]
+        if any(not 0 <= v <= 0xFFFF for v in values):
+            raise ValueError("register values must be 0-65535")
+    if not values or not 0 <= address or address + len(values) > 0x10000:
+        raise ValueError("addresses must be 0-65535")
+    return block, address, values
+
+
+def coalesce(lines, stats):
+    """Yield (block, address, values) requests from command lines,
+    merging runs of contiguous addresses"""
+
+    pending = None
+    for number, line in enumerate(lines, 1):
+        try:
+            command = parse_line(line)
+        except (ValueError, KeyError, TypeError) as e:
+            stats["bad"] += 1
+            if stats["bad"] <= 5:
+                print(f"line {number}: {e}")
+            continue
+        if command is None:
+            continue
+        stats["commands"] += 1
+        block, address, values = command
+        while values:
+            if (pending and pending[0] == block
+                    and pending[1] + len(pending[2]) == address
+                    and len(pending[2]) < MAX_COUNT[block]):
+                room = MAX_COUNT[block] - len(pending[2])
+                pending[2].extend(values[:room])
+                address += len(values[:room])
+                values = values[room:]
+            else:
+                if pending:
+                    yield tuple(pending)
+                pending = [block, address, values[:MAX_COUNT[block]]]
+                address += len(pending[2])
+                values = values[MAX_COUNT[block]:]
+    if pending:
+        yield tuple(pending)
+
+
+class BulkWriter:
+    """Writes coalesced requests with a window of requests in flight"""
+
+    def __init__(self, client, unit=1, window=WINDOW, verify=0.0, stats=None):
+        self.client = client
+        self.unit = unit
+        self.window = asyncio.Semaphore(window)
+        self.verify = verify
+        self.rtt = stats
+        self.stats = {"commands": 0, "bad": 0, "requests": 0, "values": 0,
+                      "errors": 0, "verified": 0, "mismatches": 0}
+
+    def timed(self, method, call):
+        return call if self.rtt is None else self.rtt.timed(method, call)
+
+    def request(self, block, address, values):
+        method = "write_coils" if block == "co" else "write_registers"
+        return self.timed(method, getattr(self.client, method)(address, values, slave=self.unit))
+
+    def read_back(self, block, address, count):
+        method = "read_coils" if block == "co" else "read_holding_registers"
+        return self.timed(method, getattr(self.client, method)(address, count, slave=self.unit))
+
+    async def write(self, block, address, values):
+        try:
+            if self.verify and random.random() < self.verify:
+                #gather sends both back to back, pipelined in this order
+                response, check = await asyncio.gather(
+                    self.request(block, address, values),
+                    self.read_back(block, address, len(values)),
+                )
+                self.stats["verified"] += 1
+                actual = None
+                if not check.isError():
+                    actual = check.bits[:len(values)] if block == "co" else check.registers
+                if actual != values:
+                    self.stats["mismatches"] += 1
+            else:
+                response = await self.request(block, address, values)
+            if response.isError():
+                self.stats["errors"] += 1
+            else:
+                self.stats["values"] += len(values)
+        except Exception:
+            self.stats["errors"] += 1
+        finally:
+            self.window.release()
+
+    async def run(self, lines):
+        tasks = set()
+        for block, address, values in coalesce(lines, self.stats):
+            await self.window.acquire()
+            self.stats["requests"] += 1
+            task = asyncio.create_task(self.write(block, address, values))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+
+
+async def _run_bulk_write(host, port, lines, window, verify, stats):
+    client = AsyncModbusTcpClient(host, port=port, reconnect_delay=0)
+    await client.connect()
+    if not client.connected:
+        print(f"Could not connect to {host}:{port}")
+        return None
+    writer = BulkWriter(client, window=window, verify=verify, stats=stats)
+    try:
+        await writer.run(lines)
+    finally:
+        await client.close()
+    return writer.stats
+
+
+def run_bulk_write(host, port, path, window=WINDOW, verify=0.0, stats=None):
+    """Stream the commands of path ('-' for stdin) and print a
+    throughput report"""
+
+    fh = sys.stdin if path == "-" else open(path)
+    start = time.perf_counter()
+    try:
+        stats = asyncio.run(_run_bulk_write(host, port, fh, window, verify, stats))
+    finally:
+        if fh is not sys.stdin:
+            fh.close()
+    elapsed = time.perf_counter() - start
+    if stats is None:
+        return None
+    print(
+        f"{stats['commands']} commands ({stats['bad']} rejected) in "
+        f"{stats['requests']} requests, {stats['values']} values written in {elapsed:.2f}s"
+    )
+    print(
+        f"{stats['values'] / elapsed:.0f} values/s, {stats['requests'] / elapsed:.0f} requests/s, "
+        f"{stats['errors']} errors, {stats['verified']} verified, "
+        f"{stats['mismatches']} mismatches"
+    )
+    return stats
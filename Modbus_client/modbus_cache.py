@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+""" Client-side TTL cache of block values.
+Each address remembers its value and when it was read or
+written. A read is served locally when every address it asks
+for is younger than the TTL. Successful writes store the
+written values, so the read-back after a write is a hit."""
+
+import time
+import threading
+from pymodbus.bit_read_message import ReadCoilsResponse, ReadDiscreteInputsResponse
+from pymodbus.register_read_message import (
+    ReadHoldingRegistersResponse,
+    ReadInputRegistersResponse,
+)
+
+
+TTL = 1.0
+
+#client read method: (block, response class built from cached values)
+READS = {
+    "read_discrete_inputs": ("di", ReadDiscreteInputsResponse),
+    "read_coils": ("co", ReadCoilsResponse),
+    "read_input_registers": ("ir", ReadInputRegistersResponse),
+    "read_holding_registers": ("hr", ReadHoldingRegistersResponse),
+}
+#client write method: (block, single value write)
+WRITES = {
+    "write_coil": ("co", True),
+    "write_coils": ("co", False),
+    "write_register": ("hr", True),
+    "write_registers": ("hr", False),
+}
+
+
+class BlockCache:
+    """Values per (block, slave, address) with their age"""
+
+    def __init__(self, ttl=TTL):
+        self.ttl = ttl
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, block, slave, address, count, oldest):
+        values = []
+        for a in range(address, address + count):
+            entry = self.entries.get((block, slave, a))
+            if entry is None or entry[1] < oldest:
+                return None
+            values.append(entry[0])
+        return values
+
+    def get(self, ranges):
+        """Return the values of every (block, slave, address, count)
+        range, or None (one miss) when any address is missing or stale"""
+
+        oldest = time.monotonic() - self.ttl
+        with self.lock:
+            found = []
+            for block, slave, address, count in ranges:
+                values = self._lookup(block, slave, address, count, oldest)
+                if values is None:
+                    self.misses += 1
+                    return None
+                found.append(values)
+            self.hits += 1
+            return found
+
+    def put(self, block, slave, address, values):
+        now = time.monotonic()
+        with self.lock:
+            for a, value in enumerate(values, address):
+                self.entries[(block, slave, a)] = (value, now)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        rate = 100 * self.hits / total if total else 0
+        return f"cache ttl {self.ttl:g}s: {self.hits} hits, {self.misses} misses ({rate:.0f}% hits)"
@@ -8,19 +8,30 @@ to the modbus server"""
 
 import argparse
 import sys
-import os
 import sqlite3
 from getpass import getpass
-from pymodbus.client import ModbusTcpClient
 from pymodbus.mei_message import ReadDeviceInformationRequest
+from modbus_pool import get_pool, close_all, DEADLINE, RETRIES
+from modbus_cache import TTL
+from modbus_poller import Poller, SampleWriter, BATCH_SIZE
+from modbus_codec import pack
+from modbus_scanner import run_scan, CONCURRENCY, TIMEOUT, MAX_HOSTS
+from modbus_deadband import ChangeFilter, parse_deadbands
+from modbus_scheduler import run_schedule
+from modbus_bulkwrite import run_bulk_write, WINDOW
+from modbus_stats import RttStats
+from modbus_history import HistoryKeeper, RETENTION_HOURS
+from modbus_writebehind import StateWriter
+from modbus_db import DB_FILE, save_user, close as close_db
 
 
 #this is to chnage the output color to green and red
 GREEN = "\033[92m"
 RED = "\033[91m"
 RESET = "\033[0m"
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_FILE = os.path.join(BASE_DIR, "modbus_db.sqlite")
+
+#block values are saved by a writer thread, off the interactive path
+state_writer = StateWriter(DB_FILE)
 
 #Display menus options
 def display_menu():
@@ -44,10 +55,65 @@ def args_parser():
     )
     parser.add_argument("-i", "--ip", metavar="IP", help="Modbus server IP address")
     parser.add_argument("-p", "--port", metavar="PORT", help="Modbus server TCP port", type=int, default=502)
+    parser.add_argument("--cache-ttl", metavar="SEC", type=float, default=TTL,
+                        help="serve menu reads younger than SEC from the client\n"
+                        "cache, 0 to always read the server")
+    parser.add_argument("--deadline", metavar="SEC", type=float, default=DEADLINE,
+                        help="give up on a request after SEC seconds, retries included")
+    parser.add_argument("--retries", metavar="N", type=int, default=RETRIES,
+                        help="resend a request that timed out up to N times")
+    parser.add_argument("--hedge", action="store_true",
+                        help="resend a read on a second connection when it\n"
+                        "takes longer than the recent p95")
+    parser.add_argument("--stats", action="store_true",
+                        help="time every request, print round trip times per\n"
+                        "function code during and at the end of the session")
+    parser.add_argument("--rtt-dump", metavar="FILE",
+                        help="append raw timings to FILE as CSV (time, fc,\n"
+                        "method, rtt_ms, error), implies --stats")
+    parser.add_argument("--poll", metavar="HZ", type=float,
+                        help="headless: read all blocks HZ times a second\n"
+                        "and record the samples, no menu")
+    parser.add_argument("--schedule", metavar="FILE",
+                        help="headless: poll block ranges at their own adaptive\n"
+                        "rates, see poll_schedule.yaml")
+    parser.add_argument("--duration", metavar="SEC", type=float,
+                        help="stop polling after SEC seconds")
+    parser.add_argument("--batch", metavar="N", type=int, default=BATCH_SIZE,
+                        help="samples written per transaction")
+    parser.add_argument("--retention", metavar="HOURS", type=float, default=RETENTION_HOURS,
+                        help="with --poll/--schedule, keep raw samples this long,\n"
+                        "older ones survive as 1 minute and 1 hour rollups")
+    parser.add_argument("--deadband", metavar="BLOCK=N[%]", nargs="+",
+                        help="store ir/hr only once they move more than N\n"
+                        "(or N%% of the stored value), e.g. ir=5 hr=2%%")
+    parser.add_argument("--scan", metavar="TARGET", nargs="+",
+                        help="read all blocks of every target once and save them,\n"
+                        "targets are IPs, names, host:port, [IPv6]:port or CIDR e.g. 10.0.0.0/24")
+    parser.add_argument("--write", metavar="FILE",
+                        help="stream co/hr writes from a CSV or NDJSON FILE ('-' for stdin),\n"
+                        "e.g. 'hr,100,1234' or '{\"block\": \"co\", \"address\": 7, \"value\": 1}'")
+    parser.add_argument("--window", metavar="N", type=int, default=WINDOW,
+                        help="write requests in flight")
+    parser.add_argument("--verify", metavar="FRACTION", type=float, default=0.0,
+                        help="read back this fraction of the write requests")
+    parser.add_argument("--concurrency", metavar="N", type=int, default=CONCURRENCY,
+                        help="hosts scanned at the same time")
+    parser.add_argument("--timeout", metavar="SEC", type=float, default=TIMEOUT,
+                        help="per host scan timeout")
+    parser.add_argument("--max-hosts", metavar="N", type=int, default=MAX_HOSTS,
+                        help="refuse scans whose targets cover more addresses")
 
     args = parser.parse_args()
 
-    if not args.ip:
+    try:
+        args.deadband = parse_deadbands(args.deadband)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.rtt_dump:
+        args.stats = True
+
+    if not args.ip and not args.scan:
         parser.print_help()
         sys.exit(1)
     if not args.port:
@@ -59,34 +125,10 @@ def args_parser():
 
 def save_modbus_state(ip, di, co, ir, hr):
     """This function is called to save the modbus status
-        from server at first session creation"""
+        from server at first session creation, the
+        writer thread commits it"""
 
-    try:
-        
-        conn = sqlite3.connect(DB_FILE)
-        cur = conn.cursor()
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS modbus (
-                ip TEXT PRIMARY KEY,
-                di TEXT,
-                co TEXT,
-                ir TEXT,
-                hr TEXT
-            )
-        """)
-        cur.execute("""
-            INSERT INTO modbus (ip, di, co, ir, hr)
-            VALUES (?, ?, ?, ?, ?)
-            ON CONFLICT(ip) DO UPDATE SET
-                di=excluded.di,
-                co=excluded.co,
-                ir=excluded.ir,
-                hr=excluded.hr
-        """, (ip, di, co, ir, hr))
-        conn.commit()
-        conn.close()
-    except sqlite3.Error as e:
-        print(f"Error saving Modbus state: {e}")
+    state_writer.save_state(ip, di, co, ir, hr)
 
 def save_modbus_field(ip, field, value):
     """Saves the fields and update dabase at
@@ -98,27 +140,7 @@ def save_modbus_field(ip, field, value):
         print(f"Invalid Modbus field: {field}")
         return
 
-    try:
-        conn = sqlite3.connect("modbus_db.sqlite")
-        cur = conn.cursor()
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS modbus (
-                ip TEXT PRIMARY KEY,
-                di TEXT,
-                co TEXT,
-                ir TEXT,
-                hr TEXT
-            )
-        """)
-        cur.execute("SELECT ip FROM modbus WHERE ip = ?", (ip,))
-        if cur.fetchone() is None:
-            cur.execute("INSERT INTO modbus (ip) VALUES (?)", (ip,))
-        cur.execute(f"UPDATE modbus SET {field} = ? WHERE ip = ?", (value, ip))
-        conn.commit()
-        conn.close()
-       
-    except sqlite3.Error as e:
-        print(f"Error updating {field}: {e}")
+    state_writer.save_field(ip, field, value)
 
 def create_user(_):
     """creates user and save it to databse
@@ -135,25 +157,7 @@ def create_user(_):
         return
 
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cur = conn.cursor()
-
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS tokens (
-                username TEXT PRIMARY KEY,
-                password TEXT
-            )
-        """)
-
-        
-        cur.execute("""
-            INSERT INTO tokens (username, password)
-            VALUES (?, ?)
-            ON CONFLICT(username) DO UPDATE SET password=excluded.password
-        """, (username, password))
-
-        conn.commit()
-        conn.close()
+        save_user(username, password)
         print(f"User '{username}' and the associated password added.")
 
     except sqlite3.Error as e:
@@ -163,13 +167,12 @@ def create_user(_):
 def initial_modbus_sync(client, ip):
     """This is the initial function that
     will run ass soon as connected to modbus
-    server to save current seeson of server"""
+    server to save current seeson of server.
+    The four blocks are read in one pipelined round trip"""
 
     try:
-        di = client.read_discrete_inputs(0, 4, slave=1)
-        co = client.read_coils(0, 4, slave=1)
-        ir = client.read_input_registers(0, 8, slave=1)
-        hr = client.read_holding_registers(0, 8, slave=1)
+        blocks = client.read_all()
+        di, co, ir, hr = blocks["di"], blocks["co"], blocks["ir"], blocks["hr"]
 
         if any(block.isError() for block in [di, co, ir, hr]):
             print("Warning: One or more Modbus blocks failed during initial sync.")
@@ -177,10 +180,10 @@ def initial_modbus_sync(client, ip):
 
         save_modbus_state(
             ip=ip,
-            di=",".join(["1" if b else "0" for b in di.bits[:4]]),
-            co=",".join(["1" if b else "0" for b in co.bits[:4]]),
-            ir=",".join(str(r) for r in ir.registers[:8]),
-            hr=",".join(str(r) for r in hr.registers[:8])
+            di=pack("di", di.bits[:4]),
+            co=pack("co", co.bits[:4]),
+            ir=pack("ir", ir.registers[:8]),
+            hr=pack("hr", hr.registers[:8])
         )
     except Exception as e:
         print(f"Modbus sync failed: {e}")
@@ -233,11 +236,17 @@ def read_holding_registers(client):
         for i, val in enumerate(result.registers[:8]):
             print(f"Register {i}: {val}")
 
-#Retrieves all status from modbus server
+#Retrieves all status from modbus server in one pipelined round trip
 def read_all_blocks(client):
 
     print("Display all Discrete and Register values\n")
-    di = client.read_discrete_inputs(0, 4, slave=1)
+    try:
+        blocks = client.read_all()
+    except Exception as e:
+        print(f"Unable to read Modbus blocks: {e}")
+        return
+
+    di = blocks["di"]
     if di.isError():
         print("Discrete Input Contacts Error reading")
     else:
@@ -247,7 +256,7 @@ def read_all_blocks(client):
         ]
         print("Discrete Input Contacts" + ", ".join(contacts))
 
-        co = client.read_coils(0, 4, slave=1)
+    co = blocks["co"]
     if co.isError():
         print("Discrete Output Coils/t Error reading")
     else:
@@ -257,12 +266,13 @@ def read_all_blocks(client):
         ]
         print("Discrete Output Coils/t" + ", ".join(coils))
 
-    ir = client.read_input_registers(0, 8, slave=1)
+    ir = blocks["ir"]
     if ir.isError():
         print("Analogue Input Registers/tError reading")
     else:
         print("Analogue Input Registers/t[ " + ", ".join(str(r) for r in ir.registers[:8]) + " ]")
-        hr = client.read_holding_registers(0, 8, slave=1)
+
+    hr = blocks["hr"]
     if hr.isError():
         print("Analogue Output Holding Registers Error reading")
     else:
@@ -298,7 +308,7 @@ def write_output_coils(client, ip):
         else:
             print("\nPost write, Discrete Output Coil values:")
             print(f"Success: {GREEN}True{RESET}\n")
-            save_modbus_field(ip, "co", ",".join(map(str, map(int, bits))))
+            save_modbus_field(ip, "co", pack("co", bits))
             co = client.read_coils(0, 4, slave=1)
             for i, val in enumerate(co.bits[:4]):
                 status = f"{GREEN}True{RESET}" if val else f"{RED}False{RESET}"
@@ -338,7 +348,7 @@ def write_holding_registers(client,ip):
         else:
             print("\nPost write, Analogue Output Holding Register values:")
             print("Success:", f"{GREEN}True{RESET}\n")
-            save_modbus_field(ip, "hr", ",".join(map(str, values)))
+            save_modbus_field(ip, "hr", pack("hr", values))
             hr = client.read_holding_registers(0, 8, slave=1)
             for i, val in enumerate(hr.registers[:8]):
                 print(f"Register {i}: {val}")
@@ -355,27 +365,86 @@ def display_modbus_info(client):
 
     if not response or not hasattr(response, "information"):
         print("Unable to read Modbus device info.")
-        client.close()
         return None
     #colour will be applied to the output to show what is on and off
     print(f"Vendor Name : {GREEN}{response.information[0].decode()}{RESET}")
     print(f"Product Code: {GREEN}{response.information[1].decode()}{RESET}")
     print(f"Revision    : {GREEN}{response.information[2].decode()}{RESET}\n")
-
-    client.close()
     return True
 
+#prints the session counters, commits the queued block values
+#and closes every connection
+def end_session(pool):
+    state_writer.stop()
+    if pool.cache is not None:
+        print(pool.cache.stats())
+    if pool.stats is not None:
+        print(pool.stats.summary())
+        print(pool.report())
+        print(state_writer.report())
+        pool.stats.close()
+    close_all()
+    close_db()
+
 def main():
     """"main function"""
 
     args = args_parser()
     ip = args.ip
     port = args.port
-    client = ModbusTcpClient(host=ip, port=port)
+    if args.scan:
+        try:
+            run_scan(DB_FILE, args.scan, port, concurrency=args.concurrency,
+                     timeout=args.timeout, max_hosts=args.max_hosts)
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+        return
+    #one shared pool per server, the client stays connected between menus
+    #and only the interactive menus read through the cache
+    headless = args.poll or args.schedule or args.write
+    pool = get_pool(ip, port, cache_ttl=0 if headless else args.cache_ttl,
+                    deadline=args.deadline, retries=args.retries, hedge=args.hedge)
+    client = pool.client
+    if args.stats:
+        pool.stats = RttStats(args.rtt_dump)
+        if headless:
+            pool.stats.start_live()
     if not client.connect():
         print("Could not connect to Modbus server. Check IP/Port.")
         sys.exit(1)
+    state_writer.start()
+    if args.write:
+        run_bulk_write(ip, port, args.write, args.window, args.verify, pool.stats)
+        #one read to bring the saved state up to date
+        initial_modbus_sync(client, args.ip)
+        end_session(pool)
+        return
     initial_modbus_sync(client, args.ip)
+    if args.poll or args.schedule:
+        writer = SampleWriter(DB_FILE, args.batch)
+        writer.start()
+        keeper = HistoryKeeper(DB_FILE, args.retention)
+        keeper.start()
+    if args.poll:
+        print(f"Polling {ip}:{port} at {args.poll:g} Hz, Ctrl-C to stop")
+        change_filter = ChangeFilter(args.deadband)
+        Poller(client, ip, args.poll, writer, change_filter).run(args.duration)
+        keeper.stop()
+        end_session(pool)
+        return
+    if args.schedule:
+
+        def on_change(stamp, item, values):
+            writer.queue.put((stamp, ip, 1, item.block, item.start, pack(item.block, values)))
+
+        print(f"Polling {ip}:{port} on schedule '{args.schedule}', Ctrl-C to stop")
+        run_schedule(ip, port, args.schedule, on_change, args.duration,
+                     ChangeFilter(args.deadband), pool.stats)
+        writer.stop()
+        keeper.stop()
+        end_session(pool)
+        return
     display_modbus_info(client)
     while True:  
         display_menu()  # calls the display funcion
@@ -398,11 +467,14 @@ def main():
             create_user(client)
         elif choice == "9":
             print("\nTerminating client..../n")
+            end_session(pool)
             break
         elif choice not in [str(i) for i in range(1, 10)]:
             print("Not a valid choice, try again\n")
         else:
             print(f"You selected option {choice} n")
+        if pool.stats is not None:
+            print(f"{pool.stats.line()}, db queue {state_writer.depth()}")
         input("Main menu, press Enter: ")
 
 if __name__ == "__main__":
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+""" Packed binary encoding of block values in SQLite BLOBs.
+Registers (ir, hr) are uint16 big-endian, 2 bytes each. Bits
+(di, co) are a uint16 big-endian count, so at most 65535 bits,
+followed by a bitset, bit 0 in the lowest bit of the first
+byte like Modbus itself.
+Rollup averages are float32 big-endian. Registers decode with
+one copy of the blob into an array and an in-place byteswap,
+without parsing values one by one."""
+
+import sys
+from array import array
+from itertools import chain
+
+
+BITS = ("di", "co")
+#hosts that store arrays big-endian need no byteswap
+SWAP = sys.byteorder == "little"
+#the 8 bits of every byte value, lowest first
+BYTE_BITS = [tuple(bool(byte >> i & 1) for i in range(8)) for byte in range(256)]
+#largest bit block the 2-byte count can describe
+MAX_BITS = 0xFFFF
+
+
+def _packed_array(typecode, values):
+    a = array(typecode, values)
+    if SWAP:
+        a.byteswap()
+    return a.tobytes()
+
+
+def _unpacked_array(typecode, blob):
+    a = array(typecode)
+    a.frombytes(memoryview(blob))
+    if SWAP:
+        a.byteswap()
+    return a
+
+
+def pack_registers(values):
+    return _packed_array("H", values)
+
+
+def unpack_registers(blob):
+    """array('H') of the registers, indexable and iterable like a list"""
+
+    return _unpacked_array("H", blob)
+
+
+def pack_bits(values):
+    #bit 0 is the lowest bit of a little-endian integer
+    digits = "".join(["1" if bit else "0" for bit in reversed(list(values))])
+    if len(digits) > MAX_BITS:
+        raise ValueError(f"Cannot store {len(digits)} bits, the count field holds at most {MAX_BITS}")
+    return len(digits).to_bytes(2, "big") + int(digits or "0", 2).to_bytes(
+        (len(digits) + 7) // 8, "little"
+    )
+
+
+def unpack_bits(blob):
+    view = memoryview(blob)
+    count = int.from_bytes(view[:2], "big")
+    bits = list(chain.from_iterable(map(BYTE_BITS.__getitem__, view[2:])))
+    del bits[count:]
+    return bits
+
+
+def pack_floats(values):
+    return _packed_array("f", values)
+
+
+def unpack_floats(blob):
+    return _unpacked_array("f", blob)
+
+
+def pack(block, values):
+    """BLOB of a block's values"""
+
+    return pack_bits(values) if block in BITS else pack_registers(values)
+
+
+def unpack(block, blob):
+    """Values of a block's BLOB, None stays None"""
+
+    if blob is None:
+        return None
+    return unpack_bits(blob) if block in BITS else unpack_registers(blob)
+
+
+def from_text(block, text):
+    """BLOB of the comma-joined text used before, for migrations"""
+
+    if text is None:
+        return None
+    values = [int(float(v)) for v in text.split(",") if v.strip()]
+    return pack(block, values)
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+
+""" Shared SQLite access for the CLI, GUI, poller, scanner and
+REST code. Every thread keeps one connection per database file
+open for its lifetime instead of connecting on each call. The
+file is switched to WAL journaling, so the REST readers and the
+polling writer don't block each other, and the schema is set up
+once per file per process. The statements are fixed strings,
+so sqlite3's per-connection statement cache prepares each one
+only once. Block values are stored as BLOBs, see modbus_codec."""
+
+import os
+import sqlite3
+import threading
+
+from modbus_codec import pack, unpack, from_text, pack_floats
+from modbus_auth import hash_token, check_token, is_hashed, token_tag
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_FILE = os.path.join(BASE_DIR, "modbus_db.sqlite")
+#seconds a writer waits for the lock before "database is locked"
+BUSY_TIMEOUT = 5.0
+STATEMENT_CACHE = 64
+FIELDS = ("di", "co", "ir", "hr")
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS modbus (
+        ip TEXT PRIMARY KEY,
+        di BLOB,
+        co BLOB,
+        ir BLOB,
+        hr BLOB
+    );
+    CREATE TABLE IF NOT EXISTS tokens (
+        username TEXT PRIMARY KEY,
+        password TEXT,
+        tag TEXT
+    );
+    CREATE TABLE IF NOT EXISTS counters (
+        name TEXT PRIMARY KEY,
+        value INTEGER
+    );
+    CREATE TABLE IF NOT EXISTS history (
+        ip TEXT,
+        unit INTEGER,
+        block TEXT,
+        start INTEGER,
+        ts REAL,
+        vals BLOB
+    );
+    CREATE INDEX IF NOT EXISTS history_key_ts ON history (ip, unit, block, ts);
+    CREATE INDEX IF NOT EXISTS history_ts ON history (ts);
+    CREATE TABLE IF NOT EXISTS history_1m (
+        ip TEXT,
+        unit INTEGER,
+        block TEXT,
+        start INTEGER,
+        ts REAL,
+        n INTEGER,
+        min BLOB,
+        max BLOB,
+        avg BLOB,
+        PRIMARY KEY (ip, unit, block, start, ts)
+    );
+    CREATE INDEX IF NOT EXISTS history_1m_ts ON history_1m (ts);
+    CREATE INDEX IF NOT EXISTS history_1m_key_ts ON history_1m (ip, unit, block, ts, start);
+    CREATE TABLE IF NOT EXISTS history_1h (
+        ip TEXT,
+        unit INTEGER,
+        block TEXT,
+        start INTEGER,
+        ts REAL,
+        n INTEGER,
+        min BLOB,
+        max BLOB,
+        avg BLOB,
+        PRIMARY KEY (ip, unit, block, start, ts)
+    );
+    CREATE INDEX IF NOT EXISTS history_1h_key_ts ON history_1h (ip, unit, block, ts, start);
+    CREATE TABLE IF NOT EXISTS rollups (
+        name TEXT PRIMARY KEY,
+        done REAL
+    );
+"""
+#full state of a server, rows that didn't change are not rewritten
+SAVE_STATE = """
+    INSERT INTO modbus (ip, di, co, ir, hr)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(ip) DO UPDATE SET
+        di=excluded.di,
+        co=excluded.co,
+        ir=excluded.ir,
+        hr=excluded.hr
+    WHERE (di, co, ir, hr) IS NOT (excluded.di, excluded.co, excluded.ir, excluded.hr)
+"""
+#latest state where None keeps the stored block
+MERGE_STATE = """
+    INSERT INTO modbus (ip, di, co, ir, hr)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(ip) DO UPDATE SET
+        di=COALESCE(excluded.di, di),
+        co=COALESCE(excluded.co, co),
+        ir=COALESCE(excluded.ir, ir),
+        hr=COALESCE(excluded.hr, hr)
+"""
+SAVE_FIELD = {
+    field: f"""
+        INSERT INTO modbus (ip, {field}) VALUES (?, ?)
+        ON CONFLICT(ip) DO UPDATE SET {field}=excluded.{field}
+        WHERE {field} IS NOT excluded.{field}
+    """
+    for field in FIELDS
+}
+INSERT_HISTORY = "INSERT INTO history (ts, ip, unit, block, start, vals) VALUES (?, ?, ?, ?, ?, ?)"
+SAVE_USER = """
+    INSERT INTO tokens (username, password, tag)
+    VALUES (?, ?, ?)
+    ON CONFLICT(username) DO UPDATE SET password=excluded.password, tag=excluded.tag
+"""
+TAG_USERS = "SELECT username, password FROM tokens WHERE tag = ?"
+TOKENS_VERSION = "SELECT value FROM counters WHERE name = 'tokens'"
+#every change of the tokens table, by any process, bumps the
+#version so token caches know to drop what they remember
+TOKEN_TRIGGERS = tuple(
+    f"""
+    CREATE TRIGGER IF NOT EXISTS tokens_{event.lower()} AFTER {event} ON tokens
+    BEGIN
+        INSERT INTO counters (name, value) VALUES ('tokens', 1)
+        ON CONFLICT(name) DO UPDATE SET value = value + 1;
+    END
+    """
+    for event in ("INSERT", "UPDATE", "DELETE")
+)
+FIRST_STATE = "SELECT ip, di, co, ir, hr FROM modbus LIMIT 1"
+STORED_STATE = "SELECT di, co, ir, hr FROM modbus WHERE ip = ?"
+
+_local = threading.local()
+_ready = set()
+_ready_lock = threading.Lock()
+
+
+def connect(db_file=DB_FILE):
+    """Return this thread's connection to db_file, opening it and
+    setting up the schema on first use"""
+
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(db_file)
+    if conn is None:
+        conn = sqlite3.connect(db_file, timeout=BUSY_TIMEOUT,
+                               cached_statements=STATEMENT_CACHE)
+        conn.execute("PRAGMA journal_mode=WAL")
+        #with WAL a commit is still atomic and only the last
+        #transactions may be lost on power failure
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with _ready_lock:
+            if db_file not in _ready:
+                conn.executescript(SCHEMA)
+                version = conn.execute("PRAGMA user_version").fetchone()[0]
+                for target, migrate in MIGRATIONS:
+                    if version < target:
+                        with conn:
+                            migrate(conn)
+                            conn.execute(f"PRAGMA user_version = {target}")
+                _ready.add(db_file)
+        conns[db_file] = conn
+    return conn
+
+
+def migrate_text(conn):
+    """Repack the comma-joined text blocks of older versions as BLOBs"""
+
+    rows = conn.execute("SELECT ip, di, co, ir, hr FROM modbus").fetchall()
+    conn.executemany("UPDATE modbus SET di = ?, co = ?, ir = ?, hr = ? WHERE ip = ?", [
+        (*(from_text(field, text) if isinstance(text, str) else text
+           for field, text in zip(FIELDS, row[1:])), row[0])
+        for row in rows
+    ])
+    rows = conn.execute(
+        "SELECT rowid, block, vals FROM history WHERE typeof(vals) = 'text'"
+    ).fetchall()
+    conn.executemany("UPDATE history SET vals = ? WHERE rowid = ?", [
+        (from_text(block, vals), rowid) for rowid, block, vals in rows
+    ])
+    for table in ("history_1m", "history_1h"):
+        rows = conn.execute(
+            f"SELECT rowid, block, min, max, avg FROM {table} WHERE typeof(min) = 'text'"
+        ).fetchall()
+        conn.executemany(f"UPDATE {table} SET min = ?, max = ?, avg = ? WHERE rowid = ?", [
+            (from_text(block, low), from_text(block, high),
+             pack_floats(float(v) for v in avg.split(",")), rowid)
+            for rowid, block, low, high, avg in rows
+        ])
+
+
+def migrate_tokens(conn):
+    """Hash the plaintext tokens of older versions"""
+
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(tokens)")]
+    if "tag" not in columns:
+        conn.execute("ALTER TABLE tokens ADD COLUMN tag TEXT")
+    rows = conn.execute("SELECT username, password FROM tokens").fetchall()
+    conn.executemany("UPDATE tokens SET password = ?, tag = ? WHERE username = ?", [
+        (hash_token(password), token_tag(password), username)
+        for username, password in rows
+        if not is_hashed(password)
+    ])
+    conn.execute("CREATE INDEX IF NOT EXISTS tokens_tag ON tokens (tag)")
+    for trigger in TOKEN_TRIGGERS:
+        conn.execute(trigger)
+
+
+#PRAGMA user_version: function bringing the database to it
+MIGRATIONS = (
+    (1, migrate_text),
+    (2, migrate_tokens),
+)
+
+
+def close():
+    """Close this thread's connections, e.g. when it ends"""
+
+    for conn in getattr(_local, "conns", {}).values():
+        conn.close()
+    _local.conns = {}
+
+
+def save_state(ip, di, co, ir, hr, db_file=DB_FILE):
+    conn = connect(db_file)
+    with conn:
+        conn.execute(SAVE_STATE, (ip, di, co, ir, hr))
+
+
+def save_states(rows, db_file=DB_FILE):
+    """save_state for many (ip, di, co, ir, hr) rows in one transaction"""
+
+    conn = connect(db_file)
+    with conn:
+        conn.executemany(SAVE_STATE, rows)
+
+
+def save_field(ip, field, value, db_file=DB_FILE):
+    if field not in FIELDS:
+        raise ValueError(f"Invalid Modbus field: {field}")
+    conn = connect(db_file)
+    with conn:
+        conn.execute(SAVE_FIELD[field], (ip, value))
+
+
+def save_fields(rows, db_file=DB_FILE):
+    """save_field for many (ip, field, value) rows in one transaction"""
+
+    by_field = {}
+    for ip, field, value in rows:
+        if field not in FIELDS:
+            raise ValueError(f"Invalid Modbus field: {field}")
+        by_field.setdefault(field, []).append((ip, value))
+    conn = connect(db_file)
+    with conn:
+        for field, params in by_field.items():
+            conn.executemany(SAVE_FIELD[field], params)
+
+
+def splice(block, stored, ranges):
+    """BLOB of a stored block with the (start, vals) ranges written
+    over it in order. The block keeps its length, parts of a range
+    past its end are dropped. Without a stored block a range at 0
+    becomes the block, None when there is none"""
+
+    values = None if stored is None else list(unpack(block, stored))
+    for start, vals in ranges:
+        new = unpack(block, vals)
+        if values is None:
+            if start == 0:
+                values = list(new)
+            continue
+        values[start:start + len(new)] = new[:max(0, len(values) - start)]
+    return None if values is None else pack(block, values)
+
+
+def save_history(batch, db_file=DB_FILE):
+    """Insert (ts, ip, unit, block, start, vals) samples and splice
+    them into the modbus row of each server, in one transaction.
+    Samples may cover part of a block, see splice()"""
+
+    latest = {}
+    for ts, ip, unit, block, start, vals in batch:
+        latest.setdefault(ip, {}).setdefault(block, []).append((start, vals))
+    conn = connect(db_file)
+    with conn:
+        conn.executemany(INSERT_HISTORY, batch)
+        rows = []
+        for ip, blocks in latest.items():
+            stored = conn.execute(STORED_STATE, (ip,)).fetchone() or (None,) * len(FIELDS)
+            stored = dict(zip(FIELDS, stored))
+            merged = [
+                splice(field, stored[field], blocks[field]) if field in blocks else None
+                for field in FIELDS
+            ]
+            if any(value is not None for value in merged):
+                rows.append((ip, *merged))
+        conn.executemany(MERGE_STATE, rows)
+
+
+def save_user(username, password, db_file=DB_FILE):
+    """Create a user or change its password, stored hashed"""
+
+    conn = connect(db_file)
+    with conn:
+        conn.execute(SAVE_USER, (username, hash_token(password), token_tag(password)))
+
+
+def token_user(token, db_file=DB_FILE):
+    """Return the username of a token or None, this runs the slow
+    hash for every user whose tag matches, usually one"""
+
+    rows = connect(db_file).execute(TAG_USERS, (token_tag(token),)).fetchall()
+    for username, stored in rows:
+        if check_token(token, stored):
+            return username
+    return None
+
+
+def tokens_version(db_file=DB_FILE):
+    """Number that changes whenever the tokens table does"""
+
+    row = connect(db_file).execute(TOKENS_VERSION).fetchone()
+    return row[0] if row else 0
+
+
+def iter_states(after=None, fields=FIELDS, limit=None, db_file=DB_FILE):
+    """Yield (ip, *fields) rows in ip order, starting after the ip
+    after, with the blocks as packed BLOBs. Rows are fetched as
+    they are consumed, so a caller can stream any number of them"""
+
+    for field in fields:
+        if field not in FIELDS:
+            raise ValueError(f"Invalid Modbus field: {field}")
+    columns = ", ".join(("ip", *fields))
+    cursor = connect(db_file).execute(
+        f"SELECT {columns} FROM modbus WHERE ip > ? ORDER BY ip LIMIT ?",
+        (after or "", -1 if limit is None else limit),
+    )
+    yield from cursor
+
+
+def get_state(ip, fields=FIELDS, db_file=DB_FILE):
+    """(ip, *fields) of one server or None"""
+
+    for field in fields:
+        if field not in FIELDS:
+            raise ValueError(f"Invalid Modbus field: {field}")
+    columns = ", ".join(("ip", *fields))
+    return connect(db_file).execute(
+        f"SELECT {columns} FROM modbus WHERE ip = ?", (ip,)
+    ).fetchone()
+
+
+def first_state(db_file=DB_FILE):
+    """Return (ip, di, co, ir, hr) of the first saved server, with
+    the blocks as packed BLOBs, or None"""
+
+    return connect(db_file).execute(FIRST_STATE).fetchone()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+""" Change detection between reads and what was last stored.
+Bits must match exactly. A register only counts as changed
+when it moved more than its block's deadband away from the
+last value that was reported, so slow drift is still caught
+once it adds up. The deadband is the larger of an absolute
+value and a percentage of the last reported value:
+
+    ir=5     ir moves by more than 5
+    hr=2%    hr moves by more than 2% of its last value"""
+
+
+BLOCKS = ("di", "co", "ir", "hr")
+
+
+def parse_deadbands(specs):
+    """Turn ["ir=5", "ir=1%", "hr=2%"] into
+    {"ir": {"abs": 5.0, "pct": 1.0}, "hr": {"abs": 0.0, "pct": 2.0}}"""
+
+    deadbands = {}
+    for spec in specs or ():
+        block, _, value = spec.partition("=")
+        if block not in ("ir", "hr") or not value:
+            raise ValueError(f"Invalid deadband '{spec}', use ir=N, hr=N or hr=N%")
+        band = deadbands.setdefault(block, {"abs": 0.0, "pct": 0.0})
+        if value.endswith("%"):
+            band["pct"] = float(value[:-1])
+        else:
+            band["abs"] = float(value)
+    return deadbands
+
+
+class ChangeFilter:
+    """Keeps the last reported values per (key, block), the key
+    is usually the server ip"""
+
+    def __init__(self, deadbands=None):
+        self.deadbands = deadbands or {}
+        self.last = {}
+        self.checked = 0
+        self.changed = 0
+
+    def block_changed(self, block, old, new):
+        if old is None or len(old) != len(new):
+            return True
+        band = self.deadbands.get(block)
+        if block in ("di", "co") or band is None:
+            return old != new
+        for a, b in zip(old, new):
+            if abs(b - a) > max(band["abs"], band["pct"] / 100 * abs(a)):
+                return True
+        return False
+
+    def filter(self, key, blocks):
+        """Return the {block: values} that changed since they were
+        last reported and remember them as reported"""
+
+        changes = {}
+        for block, values in blocks.items():
+            self.checked += 1
+            if self.block_changed(block, self.last.get((key, block)), values):
+                self.last[(key, block)] = values
+                changes[block] = values
+        self.changed += len(changes)
+        return changes
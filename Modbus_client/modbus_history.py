@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+""" Retention and downsampling of the history table.
+Raw samples are kept for `retention` hours. Every complete
+minute is rolled up into history_1m and every complete hour of
+those into history_1h: the sample count and, per address, the
+min, max and average (for bits the average is the fraction of
+the time the bit was on). Minute rollups are kept for
+ROLLUP_DAYS, hour rollups for good. pick_table() picks the
+finest table that covers the asked range in at most MAX_POINTS
+buckets, so a query over weeks reads hour rows instead of every
+sample. maintain() records how far it deleted each table in the
+rollups table, so the pick holds for any --retention."""
+
+import time
+import sqlite3
+import threading
+
+from modbus_db import DB_FILE, connect, close as close_db
+from modbus_codec import pack, unpack, pack_floats, unpack_floats
+
+
+RETENTION_HOURS = 24
+ROLLUP_DAYS = 30
+INTERVAL = 60.0
+#samples can sit in the writer's queue this long before they are stored
+GRACE = 10.0
+RAW_SPAN = 3600
+MAX_POINTS = 2000
+
+#rollup table, bucket width, source table, source (n, min, max, avg)
+#columns and seconds of source rows read per transaction
+LEVELS = (
+    ("history_1m", 60, "history", "1, vals, NULL, NULL", 3600),
+    ("history_1h", 3600, "history_1m", "n, min, max, avg", 86400),
+)
+#table: bucket width, None for raw samples
+TABLES = {"history": None, "history_1m": 60, "history_1h": 3600}
+#value columns of each kind of table and how they are decoded
+RAW_COLUMNS = {"vals": unpack}
+ROLLUP_COLUMNS = {
+    "n": lambda block, n: n,
+    "min": unpack,
+    "max": unpack,
+    "avg": lambda block, avg: unpack_floats(avg),
+}
+
+
+def bucket_rows(rows, width):
+    """Combine (ip, unit, block, start, ts, n, min, max, avg) rows
+    into one rollup row per key and bucket of width seconds. Raw
+    samples come as (..., 1, vals, None, None)"""
+
+    buckets = {}
+    for ip, unit, block, start, ts, n, low, high, avg in rows:
+        key = (ip, unit, block, start, ts - ts % width)
+        if high is None:
+            low = high = unpack(block, low)
+            avg = [float(v) for v in low]
+        else:
+            low, high, avg = unpack(block, low), unpack(block, high), unpack_floats(avg)
+        acc = buckets.get(key)
+        if acc is None:
+            buckets[key] = [n, low, high, [v * n for v in avg]]
+        else:
+            acc[0] += n
+            acc[1] = [min(a, b) for a, b in zip(acc[1], low)]
+            acc[2] = [max(a, b) for a, b in zip(acc[2], high)]
+            acc[3] = [a + b * n for a, b in zip(acc[3], avg)]
+    return [
+        (*key, n, pack(key[2], low), pack(key[2], high), pack_floats(s / n for s in sums))
+        for key, (n, low, high, sums) in buckets.items()
+    ]
+
+
+def done_until(conn, table):
+    row = conn.execute("SELECT done FROM rollups WHERE name = ?", (table,)).fetchone()
+    return row[0] if row else None
+
+
+def rollup(conn, table, width, source, columns, chunk, until):
+    """Roll up the complete buckets of source before until,
+    returns the number of rollup rows written"""
+
+    end = until - until % width
+    done = done_until(conn, table)
+    written = 0
+    while True:
+        #skip stretches without samples, e.g. while nothing polled
+        first = conn.execute(
+            f"SELECT MIN(ts) FROM {source} WHERE ts >= ?", (done or 0,)
+        ).fetchone()[0]
+        if first is None or first >= end:
+            break
+        start = max(done or 0, first - first % width)
+        stop = min(start + chunk, end)
+        rows = conn.execute(
+            f"SELECT ip, unit, block, start, ts, {columns} FROM {source} "
+            f"WHERE ts >= ? AND ts < ?", (start, stop)
+        ).fetchall()
+        buckets = bucket_rows(rows, width)
+        with conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO {table} (ip, unit, block, start, ts, n, min, max, avg) "
+                f"VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", buckets
+            )
+            conn.execute(
+                "INSERT INTO rollups (name, done) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET done=excluded.done", (table, stop)
+            )
+        written += len(buckets)
+        done = stop
+    return written
+
+
+def maintain(retention_hours=RETENTION_HOURS, db_file=DB_FILE, now=None):
+    """Bring the rollups up to date and delete what is past its
+    retention and already rolled up. Returns
+    (rollup rows written, raw rows deleted, minute rows deleted)"""
+
+    conn = connect(db_file)
+    now = time.time() if now is None else now
+    written = rollup(conn, *LEVELS[0], now - GRACE)
+    written += rollup(conn, *LEVELS[1], done_until(conn, "history_1m") or 0)
+    raw_cut = min(now - retention_hours * 3600, done_until(conn, "history_1m") or 0)
+    minute_cut = min(now - ROLLUP_DAYS * 86400, done_until(conn, "history_1h") or 0)
+    with conn:
+        raw = conn.execute("DELETE FROM history WHERE ts < ?", (raw_cut,)).rowcount
+        minutes = conn.execute("DELETE FROM history_1m WHERE ts < ?", (minute_cut,)).rowcount
+        #rows named <table>_deleted: that table has no rows before done
+        conn.executemany(
+            "INSERT INTO rollups (name, done) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET done=MAX(done, excluded.done)",
+            (("history_deleted", raw_cut), ("history_1m_deleted", minute_cut)),
+        )
+    return written, raw, minutes
+
+
+def pick_table(since, until, db_file=DB_FILE):
+    """The finest table that is still kept for since, as far as
+    maintain() deleted it, and gives at most MAX_POINTS buckets
+    between since and until"""
+
+    conn = connect(db_file)
+    if since >= (done_until(conn, "history_deleted") or 0) and until - since <= RAW_SPAN:
+        return "history"
+    if since >= (done_until(conn, "history_1m_deleted") or 0) and until - since <= MAX_POINTS * 60:
+        return "history_1m"
+    return "history_1h"
+
+
+def table_columns(table):
+    """{column: decoder} of the value columns of a history table"""
+
+    if table not in TABLES:
+        raise ValueError(f"Unknown history table '{table}'")
+    return RAW_COLUMNS if TABLES[table] is None else ROLLUP_COLUMNS
+
+
+def iter_history(ip, block, since, until, unit=1, table="history", fields=None,
+                 after=None, limit=None, db_file=DB_FILE):
+    """Yield (ts, start, *fields) rows of one block between since
+    and until in (ts, start) order, with decoded values. fields
+    defaults to every value column of the table, after is the
+    (ts, start) of the last row already seen. Rows are fetched as
+    they are consumed"""
+
+    decoders = table_columns(table)
+    fields = tuple(decoders) if fields is None else tuple(fields)
+    for field in fields:
+        if field not in decoders:
+            raise ValueError(f"Unknown column '{field}' of {table}")
+    after_ts, after_start = after if after is not None else (since, -1)
+    cursor = connect(db_file).execute(
+        f"SELECT {', '.join(('ts', 'start', *fields))} FROM {table} "
+        f"WHERE ip = ? AND unit = ? AND block = ? AND (ts, start) > (?, ?) "
+        f"AND ts >= ? AND ts < ? ORDER BY ts, start LIMIT ?",
+        (ip, unit, block, after_ts, after_start, since, until, -1 if limit is None else limit),
+    )
+    for ts, start, *values in cursor:
+        yield (ts, start, *(decoders[f](block, v) for f, v in zip(fields, values)))
+
+
+def history_range(ip, block, since, until, unit=1, table=None, db_file=DB_FILE):
+    """Return (table, rows) of one block between since and until.
+    Raw rows are (ts, start, values), rollup rows (ts, start, n,
+    min, max, avg) with decoded value lists. Without a table the
+    one from pick_table() is used"""
+
+    table = pick_table(since, until, db_file) if table is None else table
+    return table, list(iter_history(ip, block, since, until, unit, table, db_file=db_file))
+
+
+class HistoryKeeper(threading.Thread):
+    """Runs maintain() every interval seconds next to a poller"""
+
+    def __init__(self, db_file=DB_FILE, retention_hours=RETENTION_HOURS, interval=INTERVAL):
+        super().__init__(daemon=True)
+        self.db_file = db_file
+        self.retention_hours = retention_hours
+        self.interval = interval
+        self.stopping = threading.Event()
+        self.written = 0
+        self.deleted = 0
+
+    def run(self):
+        while True:
+            try:
+                written, raw, minutes = maintain(self.retention_hours, self.db_file)
+                self.written += written
+                self.deleted += raw + minutes
+            except sqlite3.Error as e:
+                print(f"Error maintaining history: {e}")
+            if self.stopping.wait(self.interval):
+                break
+        close_db()
+
+    def stop(self):
+        self.stopping.set()
+        self.join()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+""" Pipelined reads of all four Modbus blocks.
+The four requests are written back to back with their own
+transaction IDs and the responses are gathered as they
+arrive, so a full snapshot costs about one round trip
+instead of four."""
+
+import asyncio
+import threading
+from pymodbus.client import AsyncModbusTcpClient
+
+
+#(block, client method, count) read for a full snapshot
+BLOCKS = (
+    ("di", "read_discrete_inputs", 4),
+    ("co", "read_coils", 4),
+    ("ir", "read_input_registers", 8),
+    ("hr", "read_holding_registers", 8),
+)
+
+
+async def read_all(client, unit=1, stats=None):
+    """Send the four block reads at once on an async client
+    and return {block: response}, each request is timed into
+    stats when given"""
+
+    calls = [getattr(client, method)(0, count, slave=unit) for _, method, count in BLOCKS]
+    if stats is not None:
+        calls = [stats.timed(method, call) for (_, method, _), call in zip(BLOCKS, calls)]
+    responses = await asyncio.gather(*calls)
+    return {block: response for (block, _, _), response in zip(BLOCKS, responses)}
+
+
+class PipelinedReader:
+    """Keeps an async client connected on a background event
+    loop so the blocking CLI and GUI code can use read_all"""
+
+    def __init__(self, host, port, timeout=3):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.client = None
+        self.lock = threading.Lock()
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+
+    def _run(self, coro):
+        """Run a coroutine on the background loop and wait for it"""
+
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    async def _connect(self):
+        #reconnects are left to the caller, see modbus_pool
+        self.client = AsyncModbusTcpClient(
+            self.host, port=self.port, timeout=self.timeout, reconnect_delay=0
+        )
+        await self.client.connect()
+        return self.client.connected
+
+    def connect(self):
+        """Open the connection, returns True when connected"""
+
+        return self._run(self._connect())
+
+    def read_all(self, unit=1, stats=None, deadline=None):
+        """Blocking read_all on the kept connection, raises
+        TimeoutError when it takes longer than deadline seconds"""
+
+        with self.lock:
+            if self.client is None or not self.client.connected:
+                if not self.connect():
+                    raise ConnectionError(f"Could not connect to {self.host}:{self.port}")
+        return self._run(asyncio.wait_for(read_all(self.client, unit, stats), deadline))
+
+    def close(self):
+        """Close the connection and stop the loop"""
+
+        if self.client is not None:
+            self._run(self.client.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
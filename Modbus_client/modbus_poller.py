@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+""" Headless polling daemon for modbus_client.py --poll.
+Reads all four blocks at a fixed rate and records them as
+timestamped rows of the `history` table, one per block. Ticks
+are scheduled on absolute deadlines so the rate does not drift,
+ticks that could not be kept are counted as missed and a
+writer thread stores the samples in batches, so SQLite
+never holds up the poll loop. Only blocks that changed, see
+modbus_deadband, are stored. Retention and rollups of the
+history are up to modbus_history."""
+
+import time
+import queue
+import sqlite3
+import threading
+
+from modbus_deadband import BLOCKS, ChangeFilter
+from modbus_db import save_history, close as close_db
+from modbus_codec import pack
+
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 1.0
+REPORT_INTERVAL = 10.0
+
+
+def block_values(blocks):
+    """Plain lists of the values of each read_all response"""
+
+    return {
+        "di": blocks["di"].bits[:4],
+        "co": blocks["co"].bits[:4],
+        "ir": blocks["ir"].registers[:8],
+        "hr": blocks["hr"].registers[:8],
+    }
+
+
+def block_packed(blocks):
+    """(di, co, ir, hr) BLOBs of read_all responses"""
+
+    values = block_values(blocks)
+    return tuple(pack(block, values[block]) for block in BLOCKS)
+
+
+class SampleWriter(threading.Thread):
+    """Stores queued (ts, ip, unit, block, start, vals) samples
+    with one executemany per batch and keeps the modbus table row
+    at the latest value of each block"""
+
+    def __init__(self, db_file, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        super().__init__(daemon=True)
+        self.db_file = db_file
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue()
+        self.written = 0
+        self.batches = 0
+
+    def run(self):
+        done = False
+        while not done:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    sample = self.queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if sample is None:
+                    done = True
+                    break
+                batch.append(sample)
+            if batch:
+                self.store(batch)
+        close_db()
+
+    def store(self, batch):
+        try:
+            save_history(batch, self.db_file)
+            self.written += len(batch)
+            self.batches += 1
+        except sqlite3.Error as e:
+            print(f"Error saving samples: {e}")
+
+    def stop(self):
+        """Write what is queued and wait for the thread"""
+
+        self.queue.put(None)
+        self.join()
+
+
+class Poller:
+    """Fixed-rate read_all loop on a pooled client"""
+
+    def __init__(self, client, ip, rate, writer, change_filter=None, unit=1):
+        self.client = client
+        self.ip = ip
+        self.unit = unit
+        self.period = 1.0 / rate
+        self.writer = writer
+        self.change_filter = change_filter or ChangeFilter()
+        self.samples = 0
+        self.stored = 0
+        self.errors = 0
+        self.missed = 0
+        self.late_max = 0.0
+
+    def poll_once(self):
+        """Read all blocks and queue one sample"""
+
+        stamp = time.time()
+        try:
+            blocks = self.client.read_all(self.unit)
+        except Exception:
+            self.errors += 1
+            return
+        if any(block.isError() for block in blocks.values()):
+            self.errors += 1
+            return
+        self.samples += 1
+        changes = self.change_filter.filter(self.ip, block_values(blocks))
+        if not changes:
+            return
+        for block, values in changes.items():
+            self.writer.queue.put((stamp, self.ip, self.unit, block, 0, pack(block, values)))
+        self.stored += 1
+
+    def report(self, elapsed):
+        print(
+            f"{self.samples} samples ({self.samples / elapsed:.1f}/s), "
+            f"{self.stored} with changes, "
+            f"{self.errors} errors, {self.missed} missed, "
+            f"max late {self.late_max * 1000:.1f} ms, "
+            f"{self.writer.written} written in {self.writer.batches} batches, "
+            f"queue {self.writer.queue.qsize()}"
+        )
+
+    def run(self, duration=None, report_interval=REPORT_INTERVAL):
+        """Poll until duration seconds have passed (forever when None)"""
+
+        start = deadline = time.monotonic()
+        next_report = start + report_interval
+        try:
+            while duration is None or deadline - start < duration:
+                now = time.monotonic()
+                if now < deadline:
+                    time.sleep(deadline - now)
+                    now = time.monotonic()
+                late = now - deadline
+                self.late_max = max(self.late_max, late)
+                if late >= self.period:
+                    #behind by whole ticks, skip them rather than burst
+                    skipped = int(late / self.period)
+                    self.missed += skipped
+                    deadline += skipped * self.period
+                self.poll_once()
+                deadline += self.period
+                if time.monotonic() >= next_report:
+                    self.report(time.monotonic() - start)
+                    next_report += report_interval
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.writer.stop()
+            self.report(time.monotonic() - start)
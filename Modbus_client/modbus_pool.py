@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+
+""" Shared Modbus TCP connections for the CLI, GUI and REST code.
+There is one pool per (host, port). A pool keeps up to `size`
+connected ModbusTcpClients and hands each one to a single caller
+at a time. Idle connections are health checked before reuse.
+Every request has a deadline and bounded retries, reads can be
+hedged, and a per-server circuit breaker (modbus_breaker) fails
+fast while the server is down instead of hammering it. With a
+cache_ttl the pool's client serves repeated reads from
+modbus_cache. At most MAX_POOLS pools are kept, pools that were
+not used for IDLE_CLOSE seconds are closed to make room."""
+
+import time
+import select
+import socket
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+from pymodbus.client import ModbusTcpClient
+from pymodbus.exceptions import ConnectionException, ModbusIOException
+
+from modbus_pipeline import BLOCKS, PipelinedReader
+from modbus_cache import BlockCache, READS, WRITES
+from modbus_breaker import CircuitBreaker, CircuitOpen, THRESHOLD
+from modbus_stats import LatencyWindow
+
+
+POOL_SIZE = 4
+TIMEOUT = 3
+BACKOFF = 0.5
+BACKOFF_MAX = 30
+DEADLINE = 2.0
+RETRIES = 1
+RETRY_DELAY = 0.05
+MAX_POOLS = 64
+IDLE_CLOSE = 300.0
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class TooManyPools(ConnectionException):
+    """MAX_POOLS pools are open and none of them is idle"""
+
+
+def get_pool(host, port, **kwargs):
+    """Return the shared pool for (host, port), creating it once.
+    Raises TooManyPools when MAX_POOLS are open and none can be closed"""
+
+    key = (host, int(port))
+    evicted = []
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            if len(_pools) >= MAX_POOLS:
+                evicted = _evict_idle()
+            if len(_pools) >= MAX_POOLS:
+                raise TooManyPools(f"{MAX_POOLS} Modbus servers in use, none idle")
+            pool = _pools[key] = ConnectionPool(host, int(port), **kwargs)
+        pool.used = time.monotonic()
+    for old in evicted:
+        old.close()
+    return pool
+
+
+def _evict_idle():
+    """Remove the pools idle for IDLE_CLOSE seconds, least recently
+    used first, and return them to be closed outside the lock"""
+
+    now = time.monotonic()
+    idle = sorted(
+        (pool for pool in _pools.values() if now - pool.used >= IDLE_CLOSE),
+        key=lambda pool: pool.used,
+    )
+    for pool in idle:
+        del _pools[(pool.host, pool.port)]
+    return idle
+
+
+def close_all():
+    """Close every pool, e.g. at exit"""
+
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+def is_alive(client):
+    """Cheap health check without a round trip: an idle socket
+    only becomes readable when the server has closed it"""
+
+    sock = client.socket
+    if sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        return not readable or sock.recv(1, socket.MSG_PEEK) != b""
+    except OSError:
+        return False
+
+
+class PoolBusy(ConnectionException):
+    """All connections stayed in use until the deadline"""
+
+
+class ConnectionPool:
+    """Bounded set of connections to one Modbus server"""
+
+    def __init__(self, host, port, size=POOL_SIZE, timeout=TIMEOUT,
+                 backoff=BACKOFF, backoff_max=BACKOFF_MAX, cache_ttl=0,
+                 deadline=DEADLINE, retries=RETRIES, hedge=False, threshold=THRESHOLD):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.timeout = timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.hedge = hedge
+        self.slots = threading.BoundedSemaphore(size)
+        self.idle = []
+        self.lock = threading.Lock()
+        self.breaker = CircuitBreaker(f"{host}:{port}", threshold, backoff, backoff_max)
+        self.latency = LatencyWindow()
+        self.executor = None
+        self.counters = {"retries": 0, "hedges": 0, "hedge_wins": 0, "fast_fails": 0}
+        self.reader = None
+        self.cache = BlockCache(cache_ttl) if cache_ttl else None
+        #RttStats timing every request, see modbus_stats
+        self.stats = None
+        self.used = time.monotonic()
+        self.client = PooledClient(self)
+
+    def _connect(self, timeout):
+        client = ModbusTcpClient(host=self.host, port=self.port, timeout=min(self.timeout, timeout))
+        if not client.connect():
+            raise ConnectionException(f"Could not connect to {self.host}:{self.port}")
+        return client
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Borrow a healthy connected client, waits up to timeout
+        seconds while all `size` connections are in use"""
+
+        timeout = self.timeout if timeout is None else timeout
+        if not self.slots.acquire(timeout=timeout):
+            raise PoolBusy(f"All {self.size} connections to {self.host}:{self.port} busy")
+        try:
+            client = None
+            with self.lock:
+                while self.idle and client is None:
+                    client = self.idle.pop()
+                    if not is_alive(client):
+                        client.close()
+                        client = None
+            if client is None:
+                client = self._connect(timeout)
+            try:
+                yield client
+            except (ConnectionException, OSError):
+                client.close()
+                client = None
+                raise
+            finally:
+                if client is not None:
+                    if client.socket is None:
+                        client.close()
+                    else:
+                        with self.lock:
+                            self.idle.append(client)
+        finally:
+            self.slots.release()
+
+    def _attempt(self, method, timeout, args, kwargs):
+        """One request on a pooled connection, its outcome goes to
+        the breaker and, when it succeeded, to the latency window"""
+
+        start = time.monotonic()
+        try:
+            with self.connection(timeout) as client:
+                #pymodbus reads its timeout on every request
+                client.params.timeout = timeout
+                call = getattr(client, method)
+                if self.stats is not None:
+                    result = self.stats.call(method, call, *args, **kwargs)
+                else:
+                    result = call(*args, **kwargs)
+                if isinstance(result, ModbusIOException):
+                    #a late response would be taken for the next one
+                    client.close()
+        except PoolBusy as e:
+            self.breaker.release()
+            return ModbusIOException(str(e))
+        except (ConnectionException, OSError) as e:
+            result = ModbusIOException(str(e))
+        if isinstance(result, ModbusIOException):
+            self.breaker.failure()
+        else:
+            self.breaker.success()
+            self.latency.add(time.monotonic() - start)
+        return result
+
+    def _hedged(self, method, timeout, args, kwargs):
+        """Send a read and, when it is still outstanding after the
+        recent p95, the same read on a second connection. The first
+        good response wins"""
+
+        delay = self.latency.p95()
+        if delay is None or delay >= timeout:
+            return self._attempt(method, timeout, args, kwargs)
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(self.size, thread_name_prefix="hedge")
+        end = time.monotonic() + timeout
+        first = self.executor.submit(self._attempt, method, timeout, args, kwargs)
+        try:
+            return first.result(delay)
+        except FutureTimeout:
+            pass
+        self.counters["hedges"] += 1
+        second = self.executor.submit(self._attempt, method, end - time.monotonic(), args, kwargs)
+        pending = {first, second}
+        result = None
+        while pending:
+            done, pending = wait(pending, max(end - time.monotonic(), 0), FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                result = future.result()
+                if not isinstance(result, ModbusIOException):
+                    if future is second:
+                        self.counters["hedge_wins"] += 1
+                    return result
+        return result
+
+    def execute(self, method, *args, deadline=None, retries=None, hedge=None, **kwargs):
+        """Run one client method within deadline seconds. Requests
+        that time out or lose their connection are retried up to
+        `retries` times, reads are hedged when `hedge` is set, and
+        while the breaker is open the call fails fast. Failures are
+        returned as a ModbusIOException, like pymodbus timeouts"""
+
+        self.used = time.monotonic()
+        end = self.used + (self.deadline if deadline is None else deadline)
+        retries = self.retries if retries is None else retries
+        hedge = self.hedge if hedge is None else hedge
+        result = ModbusIOException(f"{self.host}:{self.port} deadline exceeded")
+        for attempt in range(retries + 1):
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                break
+            if attempt:
+                self.counters["retries"] += 1
+            try:
+                self.breaker.check()
+            except CircuitOpen as e:
+                self.counters["fast_fails"] += 1
+                return ModbusIOException(str(e))
+            if hedge and method.startswith("read_"):
+                result = self._hedged(method, remaining, args, kwargs)
+            else:
+                result = self._attempt(method, remaining, args, kwargs)
+            if not isinstance(result, ModbusIOException):
+                return result
+            if attempt < retries:
+                #only back off when another attempt follows
+                time.sleep(min(RETRY_DELAY * 2 ** attempt, max(end - time.monotonic(), 0)))
+        return result
+
+    def read_all(self, unit=1):
+        """Pipelined read of all four blocks within the deadline, see
+        modbus_pipeline. Raises ConnectionException or OSError"""
+
+        self.used = time.monotonic()
+        with self.lock:
+            if self.reader is None:
+                self.reader = PipelinedReader(self.host, self.port, self.timeout)
+            reader = self.reader
+        if not self.slots.acquire(timeout=self.deadline):
+            raise PoolBusy(f"All {self.size} connections to {self.host}:{self.port} busy")
+        try:
+            try:
+                self.breaker.check()
+            except CircuitOpen:
+                self.counters["fast_fails"] += 1
+                raise
+            try:
+                blocks = reader.read_all(unit, self.stats, self.deadline)
+            except BaseException:
+                self.breaker.failure()
+                raise
+            if any(isinstance(b, ModbusIOException) for b in blocks.values()):
+                self.breaker.failure()
+            else:
+                self.breaker.success()
+            return blocks
+        finally:
+            self.slots.release()
+
+    def report(self):
+        """Retry, hedge and breaker counters"""
+
+        c = self.counters
+        return (
+            f"{c['retries']} retries, {c['hedges']} hedged reads ({c['hedge_wins']} won), "
+            f"{c['fast_fails']} fast fails, breaker opened {self.breaker.opened} times, "
+            f"now {self.breaker.state()}"
+        )
+
+    def close(self):
+        """Close every idle connection and the pipelined reader"""
+
+        with self.lock:
+            idle, self.idle = self.idle, []
+            reader, self.reader = self.reader, None
+            executor, self.executor = self.executor, None
+        for client in idle:
+            client.close()
+        if reader is not None:
+            reader.close()
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+class PooledClient:
+    """Drop-in stand-in for ModbusTcpClient where every call
+    runs on a connection borrowed from the pool"""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def __getattr__(self, method):
+        def call(*args, **kwargs):
+            if self.pool.cache is not None:
+                if method in READS:
+                    return self.cached_read(method, *args, **kwargs)
+                if method in WRITES:
+                    return self.write_through(method, *args, **kwargs)
+            return self.pool.execute(method, *args, **kwargs)
+        return call
+
+    def cached_read(self, method, address, count=1, slave=0, **kwargs):
+        block, response_class = READS[method]
+        cached = self.pool.cache.get([(block, slave, address, count)])
+        if cached is not None:
+            return response_class(cached[0])
+        response = self.pool.execute(method, address, count, slave=slave, **kwargs)
+        if not response.isError():
+            values = response.bits if block in ("di", "co") else response.registers
+            self.pool.cache.put(block, slave, address, values[:count])
+        return response
+
+    def write_through(self, method, address, values, slave=0, **kwargs):
+        response = self.pool.execute(method, address, values, slave=slave, **kwargs)
+        if not response.isError():
+            block, single = WRITES[method]
+            self.pool.cache.put(block, slave, address, [values] if single else list(values))
+        return response
+
+    def read_all(self, unit=1):
+        cache = self.pool.cache
+        if cache is None:
+            return self.pool.read_all(unit)
+        cached = cache.get([(block, unit, 0, count) for block, _, count in BLOCKS])
+        if cached is not None:
+            return {
+                block: READS[method][1](values)
+                for (block, method, _), values in zip(BLOCKS, cached)
+            }
+        blocks = self.pool.read_all(unit)
+        for block, _, count in BLOCKS:
+            response = blocks[block]
+            if not response.isError():
+                values = response.bits if block in ("di", "co") else response.registers
+                cache.put(block, unit, 0, values[:count])
+        return blocks
+
+    def connect(self):
+        """Check the server is reachable"""
+
+        breaker = self.pool.breaker
+        try:
+            breaker.check()
+            with self.pool.connection(self.pool.deadline):
+                breaker.success()
+                return True
+        except CircuitOpen:
+            return False
+        except PoolBusy:
+            breaker.release()
+            return True
+        except (ConnectionException, OSError):
+            breaker.failure()
+            return False
+
+    def close(self):
+        """Connections stay in the pool, see close_all"""
@@ -1,21 +1,90 @@
 #!/usr/bin/env python3
 
-from flask import Flask, g
+import json
+import time
+from itertools import chain
+
+from flask import Flask, Response, g, request
 from flask_restful import Api, Resource
 from flask_httpauth import HTTPTokenAuth
-import sqlite3
-import os
 from flask_cors import CORS
+from modbus_pool import get_pool
+from modbus_db import FIELDS, token_user, tokens_version, first_state, get_state, iter_states
+from modbus_history import TABLES, pick_table, table_columns, iter_history
+from modbus_codec import unpack
+from modbus_auth import TokenCache
 
 
 app = Flask(__name__)
 CORS(app)
 api = Api(app)
 auth = HTTPTokenAuth(scheme='Token')
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_FILE = os.path.join(BASE_DIR, "modbus_db.sqlite")
+#tokens are stored hashed with a slow hash, verified ones are remembered
+token_cache = TokenCache(tokens_version)
+#rows per page of the list resources, ?limit= goes up to MAX_PAGE
+PAGE_SIZE = 100
+MAX_PAGE = 5000
+
+
+
+
+def block_list(block, blob):
+    """JSON array of a stored block, null when it was never saved"""
+
+    values = unpack(block, blob)
+    return None if values is None else list(values)
+
+
+def device_json(row, fields):
+    """{"ip": ..., field: values} of an (ip, *fields) row"""
+
+    return {"ip": row[0], **{field: block_list(field, blob) for field, blob in zip(fields, row[1:])}}
+
+
+def field_args(allowed):
+    """Fields asked for with ?fields=a,b, all of allowed by default"""
+
+    fields = request.args.get("fields")
+    if not fields:
+        return tuple(allowed)
+    fields = tuple(field.strip() for field in fields.split(","))
+    for field in fields:
+        if field not in allowed:
+            raise ValueError(f"Unknown field '{field}', expected some of {', '.join(allowed)}")
+    return fields
 
 
+def limit_arg():
+    limit = request.args.get("limit", PAGE_SIZE, type=int)
+    if not 1 <= limit <= MAX_PAGE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE}")
+    return limit
+
+
+def stream_page(head, key, rows, limit, to_json, cursor_of):
+    """Stream {**head, key: [...], "next": cursor} as JSON while
+    rows are read. rows must yield up to limit + 1 items, the extra
+    one only tells there is a next page, whose cursor is
+    cursor_of(last row sent), else next is null. The first row is
+    read before answering, so query errors still get a status"""
+
+    rows = iter(rows)
+    first = next(rows, None)
+    rows = chain([first], rows) if first is not None else iter(())
+
+    def generate():
+        yield json.dumps(head)[:-1] + f', "{key}": ['
+        cursor = None
+        last = None
+        for n, row in enumerate(rows):
+            if n == limit:
+                cursor = cursor_of(last)
+                break
+            yield ("," if n else "") + json.dumps(to_json(row))
+            last = row
+        yield f'], "next": {json.dumps(cursor)}}}'
+
+    return Response(generate(), mimetype="application/json")
 
 
 @auth.verify_token
@@ -25,13 +94,9 @@ def verify_token(token):
     connect to the sqlite info"""
 
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cur = conn.cursor()
-        cur.execute("SELECT username FROM tokens WHERE password = ?", (token,))
-        row = cur.fetchone()
-        conn.close()
-        if row:
-            g.current_user = row[0]
+        user = token_cache.verify(token, token_user)
+        if user:
+            g.current_user = user
             return True
     except Exception as e:
         print(f"DB error in token verification: {e}")
@@ -45,20 +110,19 @@ class ModbusStatus(Resource):
     @auth.login_required
     def get(self):
         try:
-            conn = sqlite3.connect(DB_FILE)
-            cur = conn.cursor()
-            cur.execute("SELECT ip, di, co, ir, hr FROM modbus LIMIT 1")
-            row = cur.fetchone()
-            conn.close()
+            #without ?ip= the first saved server, as before /devices
+            ip = request.args.get("ip")
+            row = get_state(ip) if ip else first_state()
 
             if row:
+                #blocks are stored packed, JSON gets plain arrays
                 return {
                     "user": g.current_user,
                     "ip": row[0],
-                    "di": row[1],
-                    "co": row[2],
-                    "ir": row[3],
-                    "hr": row[4]
+                    "di": block_list("di", row[1]),
+                    "co": block_list("co", row[2]),
+                    "ir": block_list("ir", row[3]),
+                    "hr": block_list("hr", row[4])
                 }
             else:
                 return {"error": "No modbus data found"}, 404
@@ -67,7 +131,131 @@ class ModbusStatus(Resource):
             return {"error": str(e)}, 500
 
 
+class ModbusLive(Resource):
+    """Reads the current values straight from a modbus
+    server, through the shared connection pool, instead
+    of the values last saved by a client. Only servers
+    a client already saved, the ips of the modbus table,
+    can be read, so callers can't make the server connect
+    to any host"""
+
+    @auth.login_required
+    def get(self):
+        ip = request.args.get("ip", "127.0.0.1")
+        port = request.args.get("port", 502, type=int)
+        if not 0 < port < 65536:
+            return {"error": f"Invalid port {port}"}, 400
+        try:
+            if get_state(ip, ()) is None:
+                return {"error": f"Unknown modbus server {ip}"}, 404
+            blocks = get_pool(ip, port).read_all()
+        except Exception as e:
+            return {"error": str(e)}, 503
+
+        if any(block.isError() for block in blocks.values()):
+            return {"error": "Modbus read failed"}, 502
+        return {
+            "user": g.current_user,
+            "ip": ip,
+            "di": blocks["di"].bits[:4],
+            "co": blocks["co"].bits[:4],
+            "ir": blocks["ir"].registers[:8],
+            "hr": blocks["hr"].registers[:8]
+        }
+
+
+class DeviceList(Resource):
+    """Saved state of every server, a page at a time in ip order.
+    ?limit= rows per page, ?cursor= the next value of the
+    previous page, ?fields=di,hr only those blocks"""
+
+    @auth.login_required
+    def get(self):
+        try:
+            fields = field_args(FIELDS)
+            limit = limit_arg()
+            rows = iter_states(request.args.get("cursor"), fields, limit + 1)
+            return stream_page(
+                {"user": g.current_user}, "devices", rows, limit,
+                lambda row: device_json(row, fields), lambda row: row[0],
+            )
+        except ValueError as e:
+            return {"error": str(e)}, 400
+        except Exception as e:
+            return {"error": str(e)}, 500
+
+
+class Device(Resource):
+    """Saved state of one server, ?fields= like DeviceList"""
+
+    @auth.login_required
+    def get(self, ip):
+        try:
+            fields = field_args(FIELDS)
+            row = get_state(ip, fields)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+        except Exception as e:
+            return {"error": str(e)}, 500
+        if row is None:
+            return {"error": f"No modbus data for {ip}"}, 404
+        return {"user": g.current_user, **device_json(row, fields)}
+
+
+class DeviceHistory(Resource):
+    """Samples or rollups of one block of a server, a page at a
+    time in time order. ?block= (required), ?since= and ?until=
+    in epoch seconds (the last hour by default), ?unit=, ?table=
+    (history, history_1m or history_1h, picked from the range by
+    default), ?fields= value columns, ?limit= and ?cursor="""
+
+    @auth.login_required
+    def get(self, ip):
+        args = request.args
+        try:
+            block = args.get("block")
+            if block not in FIELDS:
+                raise ValueError(f"block must be one of {', '.join(FIELDS)}")
+            until = args.get("until", time.time(), type=float)
+            since = args.get("since", until - 3600, type=float)
+            unit = args.get("unit", 1, type=int)
+            limit = limit_arg()
+            after = None
+            table = args.get("table")
+            cursor = args.get("cursor")
+            if cursor:
+                #the table is part of the cursor so every page of a
+                #range comes from the same one
+                try:
+                    table, ts, start = cursor.split(",")
+                    after = (float(ts), int(start))
+                except ValueError:
+                    raise ValueError(f"Invalid cursor '{cursor}'")
+            if table is None:
+                table = pick_table(since, until)
+            fields = field_args(table_columns(table))
+            rows = iter_history(ip, block, since, until, unit, table, fields, after, limit + 1)
+            head = {"user": g.current_user, "ip": ip, "unit": unit, "block": block,
+                    "table": table, "width": TABLES[table], "since": since, "until": until}
+            return stream_page(
+                head, "rows", rows, limit,
+                lambda row: {
+                    "ts": row[0], "start": row[1],
+                    **{f: v if isinstance(v, int) else list(v) for f, v in zip(fields, row[2:])},
+                },
+                lambda row: f"{table},{row[0]!r},{row[1]}",
+            )
+        except ValueError as e:
+            return {"error": str(e)}, 400
+        except Exception as e:
+            return {"error": str(e)}, 500
+
+
 api.add_resource(ModbusStatus, "/")
+api.add_resource(ModbusLive, "/live")
+api.add_resource(DeviceList, "/devices")
+api.add_resource(Device, "/devices/<string:ip>")
+api.add_resource(DeviceHistory, "/devices/<string:ip>/history")
 
 #as i wil be using waitress i dont need this to be main
 # if __name__ == "__main__":
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+""" Concurrent scanner for modbus_client.py --scan.
+Targets are host names, IPs, host:port (or [IPv6]:port) pairs
+or CIDR networks, up to MAX_HOSTS addresses in all. Each one is
+read with one pipelined read_all on asyncio, at most
+`concurrency` hosts at a time and each within its own timeout.
+The blocks of every host that answered are saved to the modbus
+table in a single transaction."""
+
+import time
+import asyncio
+import sqlite3
+import ipaddress
+from pymodbus.client import AsyncModbusTcpClient
+
+from modbus_pipeline import read_all
+from modbus_poller import block_packed
+from modbus_db import save_states
+
+
+CONCURRENCY = 100
+TIMEOUT = 1.0
+#largest number of addresses the targets may cover, a /20
+MAX_HOSTS = 4096
+
+
+def split_target(spec):
+    """(host, port text) of a target, the port is "" when not given.
+    IPv6 addresses take a port in the [addr]:port form"""
+
+    if spec.startswith("["):
+        host, bracket, rest = spec[1:].partition("]")
+        if not bracket or (rest and not rest.startswith(":")):
+            raise ValueError(f"Invalid target '{spec}', expected [addr] or [addr]:port")
+        return host, rest[1:]
+    if spec.count(":") == 1:
+        host, _, port = spec.partition(":")
+        return host, port
+    return spec, ""
+
+
+def expand_targets(specs, port, max_hosts=MAX_HOSTS):
+    """Return [(key, host, port)] for hosts, host:port pairs and
+    CIDR networks. key is the modbus table ip, it carries the
+    port when one was given with the target. Raises ValueError
+    when the targets add up to more than max_hosts hosts, before
+    any network is expanded"""
+
+    parsed = []
+    total = 0
+    for spec in specs:
+        host, host_port = split_target(spec)
+        if host_port:
+            if not host_port.isdigit() or not 0 < int(host_port) < 65536:
+                raise ValueError(f"Invalid port in target '{spec}'")
+            host_port = int(host_port)
+        try:
+            network = ipaddress.ip_network(host, strict=False)
+        except ValueError:
+            network = None
+        total += network.num_addresses if network else 1
+        if total > max_hosts:
+            raise ValueError(
+                f"Targets cover more than {max_hosts} hosts, "
+                f"narrow the networks or raise --max-hosts"
+            )
+        parsed.append((host, host_port, network))
+
+    targets = []
+    for host, host_port, network in parsed:
+        if network is None:
+            hosts = [host]
+        else:
+            hosts = [str(a) for a in (network.hosts() if network.num_addresses > 1 else network)]
+        for h in hosts:
+            if host_port:
+                #IPv6 keys keep the brackets so the port stays readable
+                key = f"[{h}]:{host_port}" if ":" in h else f"{h}:{host_port}"
+                targets.append((key, h, host_port))
+            else:
+                targets.append((h, h, port))
+    return targets
+
+
+async def scan_host(key, host, port, unit, timeout, slots):
+    """Read one host, return (key, blocks) or (key, error)"""
+
+    async with slots:
+        client = AsyncModbusTcpClient(host, port=port, timeout=timeout, reconnect_delay=0)
+        try:
+            async def read():
+                await client.connect()
+                if not client.connected:
+                    raise ConnectionError("connection refused")
+                return await read_all(client, unit)
+
+            blocks = await asyncio.wait_for(read(), timeout)
+            if any(block.isError() for block in blocks.values()):
+                return key, "Modbus error response"
+            return key, blocks
+        except asyncio.TimeoutError:
+            return key, "timeout"
+        except Exception as e:
+            return key, str(e) or type(e).__name__
+        finally:
+            if client.connected:
+                client.protocol.transport.close()
+
+
+async def scan(targets, unit=1, concurrency=CONCURRENCY, timeout=TIMEOUT):
+    """Scan every target, return {key: blocks or error text}"""
+
+    slots = asyncio.Semaphore(concurrency)
+    results = await asyncio.gather(
+        *(scan_host(key, host, port, unit, timeout, slots) for key, host, port in targets)
+    )
+    return dict(results)
+
+
+def save_results(db_file, results):
+    """Upsert every answering host with one executemany"""
+
+    rows = [
+        (key, *block_packed(blocks))
+        for key, blocks in results.items()
+        if not isinstance(blocks, str)
+    ]
+    try:
+        save_states(rows, db_file)
+    except sqlite3.Error as e:
+        print(f"Error saving scan results: {e}")
+    return len(rows)
+
+
+def run_scan(db_file, specs, port, unit=1, concurrency=CONCURRENCY, timeout=TIMEOUT,
+             max_hosts=MAX_HOSTS):
+    """Scan, save and print a summary. Raises ValueError for bad targets"""
+
+    targets = expand_targets(specs, port, max_hosts)
+    start = time.perf_counter()
+    results = asyncio.run(scan(targets, unit, concurrency, timeout))
+    elapsed = time.perf_counter() - start
+    saved = save_results(db_file, results)
+    errors = {}
+    for result in results.values():
+        if isinstance(result, str):
+            errors[result] = errors.get(result, 0) + 1
+    print(f"Scanned {len(targets)} targets in {elapsed:.2f}s, {saved} answered and saved")
+    for error, count in sorted(errors.items(), key=lambda e: -e[1]):
+        print(f"  {count} x {error}")
+    return results
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+
+""" Per-range adaptive polling for modbus_client.py --schedule.
+Every item of the schedule file is a block address range with
+its own period and priority:
+
+    merge_gap: 8            # unread addresses bridged to merge two ranges
+    merge_window: 0.01      # seconds, items due this close are read together
+    items:
+      - {block: di, period: 0.05, priority: 9, adaptive: false}
+      - {block: ir, start: 0, count: 8, period: 0.5, min: 0.1, max: 5}
+      - {block: hr, period: 60}
+
+Items due at the same time are merged, per block, into as few
+read requests as possible and the requests are pipelined in
+priority order. An adaptive item halves its period when its
+values changed and stretches it by a quarter when they did not,
+within [min, max] (default period/4 to period*16). Changed
+values, after the optional deadbands, go to on_change."""
+
+import time
+import asyncio
+import yaml
+from pymodbus.client import AsyncModbusTcpClient
+
+from modbus_deadband import ChangeFilter
+
+
+BLOCK_METHODS = {
+    "di": "read_discrete_inputs",
+    "co": "read_coils",
+    "ir": "read_input_registers",
+    "hr": "read_holding_registers",
+}
+#largest read allowed by the Modbus spec
+MAX_COUNT = {"di": 2000, "co": 2000, "ir": 125, "hr": 125}
+DEFAULT_COUNT = {"di": 4, "co": 4, "ir": 8, "hr": 8}
+MERGE_GAP = 8
+MERGE_WINDOW = 0.01
+SLOWDOWN = 1.25
+
+
+class PollItem:
+    """One scheduled address range"""
+
+    def __init__(self, block, start=0, count=None, period=1.0, priority=0,
+                 adaptive=True, min=None, max=None):
+        if block not in BLOCK_METHODS:
+            raise ValueError(f"Unknown block '{block}' in schedule")
+        self.block = block
+        self.start = int(start)
+        self.count = int(count or DEFAULT_COUNT[block])
+        self.period = float(period)
+        self.priority = priority
+        self.adaptive = adaptive
+        self.min_period = float(min or self.period / 4)
+        self.max_period = float(max or self.period * 16)
+        self.name = f"{block}:{self.start}-{self.start + self.count - 1}"
+        self.due = 0.0
+        self.reads = 0
+        self.changes = 0
+        self.missed = 0
+
+    def adapt(self, changed):
+        if not self.adaptive:
+            return
+        if changed:
+            self.period = max(self.min_period, self.period / 2)
+        else:
+            self.period = min(self.max_period, self.period * SLOWDOWN)
+
+
+def load_schedule(path):
+    """Return (items, merge_gap, merge_window) from a schedule file"""
+
+    with open(path) as fh:
+        spec = yaml.safe_load(fh) or {}
+    items = [PollItem(**entry) for entry in spec.get("items", ())]
+    if not items:
+        raise ValueError(f"No items in schedule '{path}'")
+    return items, spec.get("merge_gap", MERGE_GAP), spec.get("merge_window", MERGE_WINDOW)
+
+
+def merge(items, merge_gap=MERGE_GAP):
+    """Group items into [(block, start, count, priority, items)]
+    read requests, one per run of close ranges of a block"""
+
+    requests = []
+    for block in BLOCK_METHODS:
+        ranges = sorted((i for i in items if i.block == block), key=lambda i: i.start)
+        current = None
+        for item in ranges:
+            end = item.start + item.count
+            if (current and item.start <= current[1] + merge_gap
+                    and max(end, current[1]) - current[0] <= MAX_COUNT[block]):
+                current[1] = max(current[1], end)
+                current[2].append(item)
+            else:
+                current = [item.start, end, [item]]
+                requests.append((block, current))
+    merged = [
+        (block, start, end - start, max(i.priority for i in group), group)
+        for block, (start, end, group) in requests
+    ]
+    merged.sort(key=lambda r: -r[3])
+    return merged
+
+
+class Scheduler:
+    """Reads the due items of a schedule on an async client"""
+
+    def __init__(self, client, items, on_change, unit=1, merge_gap=MERGE_GAP,
+                 merge_window=MERGE_WINDOW, change_filter=None, stats=None):
+        self.client = client
+        self.items = items
+        self.on_change = on_change
+        self.unit = unit
+        self.merge_gap = merge_gap
+        self.merge_window = merge_window
+        self.change_filter = change_filter or ChangeFilter()
+        self.stats = stats
+        self.requests = 0
+        self.errors = 0
+
+    async def read(self, block, start, count):
+        method = BLOCK_METHODS[block]
+        call = getattr(self.client, method)(start, count, slave=self.unit)
+        if self.stats is not None:
+            call = self.stats.timed(method, call)
+        response = await call
+        if response.isError():
+            raise IOError(f"{block} read failed: {response}")
+        if block in ("di", "co"):
+            return response.bits[:count]
+        return response.registers[:count]
+
+    async def poll(self, due):
+        """Read the due items with merged, pipelined requests"""
+
+        requests = merge(due, self.merge_gap)
+        stamp = time.time()
+        results = await asyncio.gather(
+            *(self.read(block, start, count) for block, start, count, _, _ in requests),
+            return_exceptions=True,
+        )
+        self.requests += len(requests)
+        for (block, start, _, _, group), values in zip(requests, results):
+            if isinstance(values, Exception):
+                self.errors += 1
+                continue
+            for item in group:
+                offset = item.start - start
+                item_values = values[offset:offset + item.count]
+                changed = bool(self.change_filter.filter(item.name, {block: item_values}))
+                if item.reads:
+                    item.adapt(changed)
+                item.reads += 1
+                if changed:
+                    item.changes += 1
+                    self.on_change(stamp, item, item_values)
+
+    def report(self):
+        print(f"{self.requests} requests, {self.errors} errors")
+        for item in self.items:
+            print(
+                f"  {item.name:<14} period {item.period * 1000:>9.1f} ms  "
+                f"{item.reads:>6} reads  {item.changes:>6} changes  {item.missed:>4} missed"
+            )
+
+    async def run(self, duration=None, report_interval=10.0):
+        """Poll until duration seconds have passed (forever when None)"""
+
+        start = time.monotonic()
+        next_report = start + report_interval
+        for item in self.items:
+            item.due = start
+        while duration is None or time.monotonic() - start < duration:
+            now = time.monotonic()
+            next_due = min(item.due for item in self.items)
+            if next_due > now:
+                await asyncio.sleep(next_due - now)
+                now = time.monotonic()
+            due = [item for item in self.items if item.due <= now + self.merge_window]
+            await self.poll(due)
+            for item in due:
+                item.due += item.period
+                if item.due <= now:
+                    #a whole period late, restart its cadence from now
+                    item.missed += 1
+                    item.due = now + item.period
+            if time.monotonic() >= next_report:
+                self.report()
+                next_report += report_interval
+
+
+async def _run_schedule(host, port, scheduler, duration):
+    #its own async connection, pipelining needs it, so the pool's
+    #deadlines, retries and breaker don't apply to scheduled reads
+    client = AsyncModbusTcpClient(host, port=port)
+    await client.connect()
+    if not client.connected:
+        print(f"Could not connect to {host}:{port}")
+        return
+    scheduler.client = client
+    try:
+        await scheduler.run(duration)
+    finally:
+        await client.close()
+
+
+def run_schedule(host, port, path, on_change, duration=None, change_filter=None,
+                 stats=None):
+    """Run a schedule file against host:port until duration or Ctrl-C"""
+
+    items, merge_gap, merge_window = load_schedule(path)
+    scheduler = Scheduler(None, items, on_change, merge_gap=merge_gap,
+                          merge_window=merge_window, change_filter=change_filter,
+                          stats=stats)
+    try:
+        asyncio.run(_run_schedule(host, port, scheduler, duration))
+    except KeyboardInterrupt:
+        pass
+    scheduler.report()
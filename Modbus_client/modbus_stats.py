@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+
+""" Round trip times of Modbus requests for modbus_client.py --stats.
+Every request is timed from send to response and counted per
+function code, errors included. Timings are not kept: each
+function code has streaming counters and a log-scale histogram
+(buckets GROWTH apart), so memory stays flat on runs of any
+length and percentiles are read from the histogram, within half
+a bucket. The report shows count, errors, min, mean, p50, p95
+and p99 in milliseconds and a histogram of all requests. Raw
+timings can be appended to a CSV file (wall clock, fc, method,
+rtt_ms, error) for offline analysis."""
+
+import sys
+import math
+import time
+import bisect
+import collections
+import threading
+
+
+#client method: Modbus function code
+FUNCTION_CODES = {
+    "read_coils": 1,
+    "read_discrete_inputs": 2,
+    "read_holding_registers": 3,
+    "read_input_registers": 4,
+    "write_coil": 5,
+    "write_register": 6,
+    "write_coils": 15,
+    "write_registers": 16,
+}
+#histogram bucket upper bounds in ms, the last bucket is open
+BUCKETS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+BAR_WIDTH = 40
+REPORT_INTERVAL = 10.0
+#ratio between the percentile buckets, estimates are within 2.5 %
+GROWTH = 1.05
+LOG_GROWTH = math.log(GROWTH)
+#RTTs below this many ms share the first bucket
+MIN_MS = 0.001
+
+
+def percentile(ordered, p):
+    """Nearest-rank percentile of a sorted list"""
+
+    if not ordered:
+        return 0.0
+    rank = math.ceil(p / 100 * len(ordered)) - 1
+    return ordered[max(0, min(len(ordered) - 1, rank))]
+
+
+def is_error(response):
+    return response is None or (hasattr(response, "isError") and response.isError())
+
+
+class LatencyWindow:
+    """Times of the recent successful requests, e.g. for the
+    hedge delay of modbus_pool"""
+
+    def __init__(self, size=200, min_samples=20):
+        self.times = collections.deque(maxlen=size)
+        self.min_samples = min_samples
+        self.lock = threading.Lock()
+
+    def add(self, seconds):
+        with self.lock:
+            self.times.append(seconds)
+
+    def p95(self):
+        """None until min_samples requests were seen"""
+
+        with self.lock:
+            if len(self.times) < self.min_samples:
+                return None
+            ordered = sorted(self.times)
+        return percentile(ordered, 95)
+
+
+class RttSeries:
+    """Count, errors, min, max, sum and histograms of the RTTs of
+    one function code, in constant memory"""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.min = math.inf
+        self.max = 0.0
+        self.total = 0.0
+        #log bucket: requests, for the percentiles
+        self.buckets = collections.Counter()
+        #requests per BUCKETS bound, for the report's histogram
+        self.coarse = [0] * (len(BUCKETS) + 1)
+
+    def add(self, ms, error=False):
+        self.count += 1
+        self.errors += bool(error)
+        self.min = min(self.min, ms)
+        self.max = max(self.max, ms)
+        self.total += ms
+        self.buckets[math.floor(math.log(max(ms, MIN_MS)) / LOG_GROWTH)] += 1
+        self.coarse[bisect.bisect_left(BUCKETS, ms)] += 1
+
+    def merge(self, other):
+        """Add the requests of another series to this one"""
+
+        self.count += other.count
+        self.errors += other.errors
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.total += other.total
+        self.buckets.update(other.buckets)
+        self.coarse = [a + b for a, b in zip(self.coarse, other.coarse)]
+        return self
+
+    def copy(self):
+        return RttSeries().merge(self)
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, p):
+        """Nearest-rank percentile, the middle of its bucket"""
+
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(p / 100 * self.count))
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(self.max, max(self.min, GROWTH ** (index + 0.5)))
+        return self.max
+
+
+class RttStats:
+    """Timings per function code, shared by every thread"""
+
+    def __init__(self, dump=None):
+        self.series = {}
+        self.lock = threading.Lock()
+        self.dump = open(dump, "a") if dump else None
+
+    def label(self, method, request=None):
+        if request is not None:
+            return f"fc{request.function_code:<3} {type(request).__name__}"
+        return f"fc{FUNCTION_CODES.get(method, 0):<3} {method}"
+
+    def record(self, name, seconds, error=False):
+        ms = seconds * 1000
+        with self.lock:
+            series = self.series.get(name)
+            if series is None:
+                series = self.series[name] = RttSeries()
+            series.add(ms, error)
+            if self.dump:
+                fc, method = name.split(None, 1)
+                self.dump.write(f"{time.time():.6f},{fc[2:]},{method},{ms:.3f},{int(bool(error))}\n")
+
+    def call(self, method, func, *args, **kwargs):
+        """Run a blocking client call and record how long it took"""
+
+        request = args[0] if method == "execute" and args else None
+        start = time.perf_counter()
+        try:
+            response = func(*args, **kwargs)
+        except Exception:
+            self.record(self.label(method, request), time.perf_counter() - start, True)
+            raise
+        self.record(self.label(method, request), time.perf_counter() - start, is_error(response))
+        return response
+
+    async def timed(self, method, coro):
+        """Await an async client call and record how long it took"""
+
+        start = time.perf_counter()
+        try:
+            response = await coro
+        except Exception:
+            self.record(self.label(method), time.perf_counter() - start, True)
+            raise
+        self.record(self.label(method), time.perf_counter() - start, is_error(response))
+        return response
+
+    def line(self):
+        """One line summary for after a menu action"""
+
+        every = RttSeries()
+        with self.lock:
+            for series in self.series.values():
+                every.merge(series)
+        if not every.count:
+            return "rtt: no requests yet"
+        return (
+            f"rtt: {every.count} requests, {every.errors} errors, "
+            f"p50 {every.percentile(50):.2f} ms, p95 {every.percentile(95):.2f} ms, "
+            f"max {every.max:.2f} ms"
+        )
+
+    def summary(self):
+        """Table per function code and a histogram of every request"""
+
+        with self.lock:
+            samples = {name: series.copy() for name, series in self.series.items()}
+        if not samples:
+            return "rtt: no requests"
+        lines = [
+            f"{'function':<34}{'count':>7}{'errors':>7}{'min':>9}{'mean':>9}"
+            f"{'p50':>9}{'p95':>9}{'p99':>9}   (ms)"
+        ]
+        for name in sorted(samples, key=lambda n: int(n.split()[0][2:])):
+            series = samples[name]
+            lines.append(
+                f"{name:<34}{series.count:>7}{series.errors:>7}{series.min:>9.2f}"
+                f"{series.mean():>9.2f}{series.percentile(50):>9.2f}"
+                f"{series.percentile(95):>9.2f}{series.percentile(99):>9.2f}"
+            )
+        counts = [0] * (len(BUCKETS) + 1)
+        for series in samples.values():
+            counts = [a + b for a, b in zip(counts, series.coarse)]
+        peak = max(counts)
+        lines.append("")
+        bounds = [f"<= {b:g}" for b in BUCKETS] + [f"> {BUCKETS[-1]:g}"]
+        for bound, count in zip(bounds, counts):
+            bar = "#" * round(BAR_WIDTH * count / peak)
+            lines.append(f"{bound:>9} ms {count:>7} {bar}")
+        return "\n".join(lines)
+
+    def start_live(self, interval=REPORT_INTERVAL):
+        """Print the summary every interval seconds from a daemon thread"""
+
+        def report():
+            while True:
+                time.sleep(interval)
+                print(self.summary(), file=sys.stderr)
+
+        threading.Thread(target=report, daemon=True).start()
+
+    def close(self):
+        with self.lock:
+            if self.dump:
+                self.dump.close()
+                self.dump = None
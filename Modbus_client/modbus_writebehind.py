@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+""" Write-behind persistence of the blocks the CLI and GUI write.
+save_field() and save_state() only queue the new values and
+return; a writer thread commits them. While a value waits, a
+newer one for the same (ip, field) replaces it, so only the last
+write of a burst reaches SQLite, and everything queued by the
+time the thread wakes up goes into one transaction. The queue
+holds at most MAX_PENDING keys, beyond that callers wait for
+the thread. flush() waits until what was queued is committed,
+stop() flushes and ends the thread. It also runs at interpreter
+exit, so values queued just before an error or Ctrl-C are kept."""
+
+import time
+import atexit
+import sqlite3
+import threading
+
+from modbus_db import DB_FILE, FIELDS, save_fields, close as close_db
+
+
+MAX_PENDING = 1000
+#seconds the thread waits after the first queued value for more
+GROUP_DELAY = 0.05
+
+
+class StateWriter(threading.Thread):
+    """Coalescing (ip, field) -> value queue with a writer thread"""
+
+    def __init__(self, db_file=DB_FILE, max_pending=MAX_PENDING, group_delay=GROUP_DELAY):
+        super().__init__(daemon=True)
+        self.db_file = db_file
+        self.max_pending = max_pending
+        self.group_delay = group_delay
+        self.pending = {}
+        self.cond = threading.Condition()
+        self.stopping = False
+        #sequence numbers of the last queued and last committed value
+        self.queued = 0
+        self.done = 0
+        self.coalesced = 0
+        self.written = 0
+        self.commits = 0
+        self.errors = 0
+        self.last_error = None
+
+    def save_field(self, ip, field, value):
+        if field not in FIELDS:
+            raise ValueError(f"Invalid Modbus field: {field}")
+        self.put({(ip, field): value})
+
+    def save_state(self, ip, di, co, ir, hr):
+        self.put({(ip, field): value for field, value in zip(FIELDS, (di, co, ir, hr))})
+
+    def put(self, values):
+        """Queue {(ip, field): value}, waits while the queue is full"""
+
+        with self.cond:
+            if self.stopping:
+                raise RuntimeError("StateWriter is stopped")
+            new = [key for key in values if key not in self.pending]
+            while self.pending and len(self.pending) + len(new) > self.max_pending:
+                self.cond.wait()
+                new = [key for key in values if key not in self.pending]
+            self.coalesced += len(values) - len(new)
+            self.pending.update(values)
+            self.queued += 1
+            self.cond.notify_all()
+
+    def start(self):
+        super().start()
+        atexit.register(self.stop)
+
+    def depth(self):
+        """Number of (ip, field) values waiting to be committed"""
+
+        with self.cond:
+            return len(self.pending)
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.pending and not self.stopping:
+                    self.cond.wait()
+                if not self.pending:
+                    break
+            if not self.stopping:
+                time.sleep(self.group_delay)
+            with self.cond:
+                batch, self.pending = self.pending, {}
+                seq = self.queued
+                self.cond.notify_all()
+            self.store(batch)
+            with self.cond:
+                self.done = seq
+                self.cond.notify_all()
+        close_db()
+
+    def store(self, batch):
+        try:
+            save_fields([(ip, field, value) for (ip, field), value in batch.items()], self.db_file)
+            self.written += len(batch)
+            self.commits += 1
+        except sqlite3.Error as e:
+            self.errors += 1
+            self.last_error = e
+            print(f"Error saving Modbus state: {e}")
+
+    def flush(self, timeout=None):
+        """Wait until everything queued so far is committed, returns
+        False when timeout seconds passed first"""
+
+        with self.cond:
+            seq = self.queued
+            return self.cond.wait_for(lambda: self.done >= seq, timeout)
+
+    def stop(self):
+        """Commit what is queued and wait for the thread"""
+
+        with self.cond:
+            self.stopping = True
+            self.cond.notify_all()
+        if self.is_alive():
+            self.join()
+
+    def report(self):
+        return (
+            f"db writes: {self.depth()} queued, {self.written} written in "
+            f"{self.commits} commits, {self.coalesced} coalesced, {self.errors} errors"
+        )
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+""" Memory and throughput of list-based vs compact datablocks """
+
+# ~$ python3 bench_datablock.py -n 65536
+
+import time
+import argparse
+import tracemalloc
+from pymodbus.datastore import ModbusSequentialDataBlock
+
+from datablock import BitBlock, RegisterBlock
+
+
+def args_parser():
+    """Parse the command line arguments"""
+
+    parser = argparse.ArgumentParser(
+        prog="bench_datablock.py",
+        description="Datablock memory and throughput comparison",
+    )
+    parser.add_argument(
+        "-n", "--size", type=int, default=65536, help="addresses per block"
+    )
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=20000, help="operations per test"
+    )
+    return parser.parse_args()
+
+
+def measure_memory(factory):
+    """Bytes allocated while building one block"""
+
+    tracemalloc.start()
+    block = factory()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return block, size
+
+
+def measure_ops(block, size, count, write_values, repeat):
+    """Range reads and writes per second, spread over the block"""
+
+    stride = max(1, (size - count) // repeat)
+    addresses = [(i * stride) % (size - count) for i in range(repeat)]
+
+    start = time.perf_counter()
+    for address in addresses:
+        block.getValues(address, count)
+    reads = repeat / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for address in addresses:
+        block.setValues(address, write_values)
+    writes = repeat / (time.perf_counter() - start)
+    return reads, writes
+
+
+def main():
+    """main function"""
+
+    args = args_parser()
+    size = args.size
+    cases = [
+        # // (label, factory, request count, write values) //
+        ("list registers", lambda: ModbusSequentialDataBlock(0, [0] * size), 125, list(range(123))),
+        ("array('H')", lambda: RegisterBlock(0, [0] * size), 125, list(range(123))),
+        ("list bits", lambda: ModbusSequentialDataBlock(0, [False] * size), 2000, [True, False] * 984),
+        ("bitset", lambda: BitBlock(0, [False] * size), 2000, [True, False] * 984),
+    ]
+    print(f"  {size} addresses per block, {args.repeat} operations per test\n")
+    print(f"  {'block':<16} {'memory KiB':>11} {'reads/s':>10} {'writes/s':>10}")
+    for label, factory, count, write_values in cases:
+        block, memory = measure_memory(factory)
+        reads, writes = measure_ops(block, size, count, write_values, args.repeat)
+        print(f"  {label:<16} {memory / 1024:>11.1f} {reads:>10.0f} {writes:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
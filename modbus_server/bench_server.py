@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+""" Concurrent-client benchmark for the Modbus server modes """
+
+# Starts modbus_server in each mode in a child process, opens N
+# simultaneous TCP connections and drives read holding register
+# requests on every one for a fixed duration.
+#
+# ~$ python3 bench_server.py -c 1 50 200 500 -d 5
+
+import os
+import sys
+import time
+import struct
+import asyncio
+import argparse
+import multiprocessing
+
+import metrics
+import modbus_server
+
+host = "127.0.0.1"
+port = 5020
+
+
+def args_parser():
+    """Parse the command line arguments"""
+
+    parser = argparse.ArgumentParser(
+        prog="bench_server.py",
+        description="Modbus server concurrency benchmark",
+    )
+    parser.add_argument(
+        "-m",
+        "--modes",
+        nargs="+",
+        choices=("sync", "async"),
+        default=["sync", "async"],
+        help="server modes to benchmark",
+    )
+    parser.add_argument(
+        "-c",
+        "--clients",
+        nargs="+",
+        type=int,
+        default=[1, 50, 200, 500],
+        help="numbers of simultaneous connections",
+    )
+    parser.add_argument(
+        "-d", "--duration", type=float, default=5.0, help="seconds per run"
+    )
+    parser.add_argument("-p", "--port", type=int, default=port, help="TCP port")
+    parser.add_argument(
+        "-M",
+        "--metrics",
+        action="store_true",
+        help="also run each mode with request instrumentation",
+    )
+    return parser.parse_args()
+
+
+def serve(mode, port, instrument=False):
+    """Child process entry point, serve the YAML block data quietly"""
+
+    sys.stdout = open(os.devnull, "w")
+    _, addr = modbus_server.get_blockdata()
+    context = modbus_server.build_context(addr)
+    identity = modbus_server.build_identity()
+    handler = metrics.make_handler(metrics.Metrics()) if instrument else None
+    modbus_server.start_server(
+        context, identity, (host, port), mode, handler=handler
+    )
+
+
+def read_request(tid):
+    """Build a Modbus TCP read holding registers frame (unit 1, 0..7)"""
+
+    return struct.pack(">HHHBBHH", tid & 0xFFFF, 0, 6, 1, 3, 0, 8)
+
+
+async def wait_for_server(port, timeout=10.0):
+    """Poll the port until the server accepts connections"""
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return True
+        except OSError:
+            await asyncio.sleep(0.05)
+    return False
+
+
+async def client_loop(port, stop_at, latencies, errors):
+    """One connection: request, await the response, repeat until stop_at"""
+
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+    except OSError:
+        errors.append(1)
+        return
+    tid = 0
+    try:
+        while time.monotonic() < stop_at:
+            tid += 1
+            start = time.perf_counter()
+            writer.write(read_request(tid))
+            header = await reader.readexactly(7)
+            length = struct.unpack(">H", header[4:6])[0]
+            await reader.readexactly(length - 1)
+            latencies.append(time.perf_counter() - start)
+    except (OSError, asyncio.IncompleteReadError):
+        errors.append(1)
+    finally:
+        writer.close()
+
+
+async def run_clients(port, clients, duration):
+    """Drive `clients` connections at once and collect latencies"""
+
+    latencies = []
+    errors = []
+    stop_at = time.monotonic() + duration
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(client_loop(port, stop_at, latencies, errors) for _ in range(clients))
+    )
+    elapsed = time.perf_counter() - start
+    return latencies, len(errors), elapsed
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def bench_mode(mode, clients_list, duration, port, instrument=False):
+    """Benchmark one server mode over every client count"""
+
+    proc = multiprocessing.Process(
+        target=serve, args=(mode, port, instrument), daemon=True
+    )
+    label = f"{mode}+m" if instrument else mode
+    proc.start()
+    rows = []
+    try:
+        if not asyncio.run(wait_for_server(port)):
+            print(f"  {label}: server did not start on port {port}")
+            return rows
+        for clients in clients_list:
+            latencies, errors, elapsed = asyncio.run(
+                run_clients(port, clients, duration)
+            )
+            latencies.sort()
+            rows.append(
+                (
+                    label,
+                    clients,
+                    len(latencies) / elapsed,
+                    percentile(latencies, 50) * 1000,
+                    percentile(latencies, 99) * 1000,
+                    errors,
+                )
+            )
+    finally:
+        proc.terminate()
+        proc.join()
+    return rows
+
+
+def main():
+    """main function"""
+
+    args = args_parser()
+    print(f"  {'mode':<8} {'clients':>7} {'req/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'errors':>6}")
+    runs = [(mode, False) for mode in args.modes]
+    if args.metrics:
+        runs += [(mode, True) for mode in args.modes]
+    for mode, instrument in runs:
+        for row in bench_mode(mode, args.clients, args.duration, args.port, instrument):
+            print(f"  {row[0]:<8} {row[1]:>7} {row[2]:>10.0f} {row[3]:>8.2f} {row[4]:>8.2f} {row[5]:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+""" Simulation tick cost versus register count """
+
+# ~$ python3 bench_simulation.py -n 1000 10000 65535
+
+import time
+import argparse
+
+import modbus_server
+from simulation import Simulation
+
+
+def args_parser():
+    """Parse the command line arguments"""
+
+    parser = argparse.ArgumentParser(
+        prog="bench_simulation.py",
+        description="Simulation tick cost benchmark",
+    )
+    parser.add_argument(
+        "-n",
+        "--sizes",
+        nargs="+",
+        type=int,
+        default=[100, 1000, 10000, 65535],
+        help="simulated addresses per block (ir and di)",
+    )
+    parser.add_argument(
+        "-t", "--ticks", type=int, default=50, help="ticks per measurement"
+    )
+    return parser.parse_args()
+
+
+def build_spec(size):
+    """One range per waveform, splitting `size` addresses per block"""
+
+    quarter = size // 4
+    entries = [
+        {"start": i * quarter, "count": quarter if i < 3 else size - 3 * quarter,
+         "wave": wave, "period": 10, "spread": 0.01}
+        for i, wave in enumerate(("sine", "ramp", "step", "noise"))
+    ]
+    return {"rate": 10, "ir": entries, "di": entries}
+
+
+def measure(size, ticks):
+    """Return (mean tick ms, longest step between yields ms)"""
+
+    addr = {
+        "di": (0, [0], size + 1),
+        "co": (0, [0], 2),
+        "ir": (0, [0], size + 1),
+        "hr": (0, [0], 2),
+    }
+    context = modbus_server.build_context(addr)
+    simulation = Simulation(context, build_spec(size), seed=1)
+
+    start = time.perf_counter()
+    for n in range(ticks):
+        simulation.tick(n * 0.1)
+    mean = (time.perf_counter() - start) / ticks
+
+    # // Time each step the event loop would run without yielding //
+    stall = 0.0
+    step = time.perf_counter()
+    for unit, fc, address, values in simulation.updates(ticks * 0.1):
+        context[unit].setValues(fc, address, values)
+        now = time.perf_counter()
+        stall = max(stall, now - step)
+        step = now
+    return mean * 1000, stall * 1000
+
+
+def main():
+    """main function"""
+
+    args = args_parser()
+    print(f"  {'inputs':>8} {'tick ms':>9} {'max Hz':>8} {'inputs/s':>12} {'stall ms':>9}")
+    for size in args.sizes:
+        tick_ms, stall_ms = measure(size, args.ticks)
+        inputs = 2 * size
+        print(
+            f"  {inputs:>8} {tick_ms:>9.3f} {1000 / tick_ms:>8.0f}"
+            f" {inputs / tick_ms * 1000:>12.0f} {stall_ms:>9.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
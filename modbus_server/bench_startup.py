@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+""" Startup-time benchmark for the Modbus server """
+
+# Launches modbus_server.py as a fresh process and measures the time
+# from process start to the first served read holding registers
+# request, for each mode with and without the initial state banner.
+#
+# ~$ python3 bench_startup.py -n 10
+
+import os
+import sys
+import time
+import socket
+import struct
+import argparse
+import subprocess
+
+from bench_server import host, read_request
+
+port = 5020
+server = os.path.join(os.path.dirname(os.path.abspath(__file__)), "modbus_server.py")
+
+variants = {
+    "sync": ["-m", "sync"],
+    "sync -q": ["-m", "sync", "-q"],
+    "async": ["-m", "async"],
+    "async -q": ["-m", "async", "-q"],
+}
+
+
+def args_parser():
+    """Parse the command line arguments"""
+
+    parser = argparse.ArgumentParser(
+        prog="bench_startup.py",
+        description="Modbus server startup benchmark",
+    )
+    parser.add_argument(
+        "-n", "--runs", type=int, default=10, help="server starts per variant"
+    )
+    parser.add_argument("-p", "--port", type=int, default=port, help="TCP port")
+    parser.add_argument(
+        "-t", "--timeout", type=float, default=10.0, help="seconds to wait per start"
+    )
+    return parser.parse_args()
+
+
+def first_response(port, timeout):
+    """Poll until a read request is answered, return the time it was"""
+
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=1.0) as sock:
+                sock.sendall(read_request(1))
+                header = sock.recv(7)
+                if len(header) == 7 and struct.unpack(">H", header[:2])[0] == 1:
+                    return time.perf_counter()
+        except OSError:
+            pass
+        time.sleep(0.001)
+    return None
+
+
+def start_time(options, port, timeout):
+    """Start one server, return seconds to the first response or None"""
+
+    command = [sys.executable, server, "-H", host, "-p", str(port), *options]
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        command,
+        cwd=os.path.dirname(server),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        served = first_response(port, timeout)
+    finally:
+        proc.terminate()
+        proc.wait()
+    return served - start if served else None
+
+
+def main():
+    """main function"""
+
+    args = args_parser()
+    print(f"  {'variant':<10} {'min ms':>8} {'median ms':>10} {'max ms':>8} {'failed':>6}")
+    for label, options in variants.items():
+        times = []
+        failed = 0
+        for _ in range(args.runs):
+            elapsed = start_time(options, args.port, args.timeout)
+            if elapsed is None:
+                failed += 1
+            else:
+                times.append(elapsed * 1000)
+        times.sort()
+        if not times:
+            print(f"  {label:<10} {'-':>8} {'-':>10} {'-':>8} {failed:>6}")
+            continue
+        median = times[len(times) // 2]
+        print(f"  {label:<10} {times[0]:>8.1f} {median:>10.1f} {times[-1]:>8.1f} {failed:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+""" Change log and push channel for datastore writes """
+
+# Every write to the datastore, from a client or from the simulation,
+# is compared with the values it replaces and only the changed address
+# ranges are logged and pushed to subscribers as NDJSON lines over a
+# local TCP side channel:
+#
+#   {"seq": 42, "unit": 1, "block": "hr", "address": 0, "values": [9, 8]}
+#
+# A subscriber sends one JSON line after connecting, all keys optional:
+#
+#   {"since": 41, "units": [1], "blocks": ["hr", "co"]}
+#
+# and first receives the logged changes after 'since', then the live
+# stream. When 'since' has already left the log it gets {"reset": true}
+# and should re-read the blocks once. Subscribers that fall behind by
+# more than queue_size changes are disconnected and may resume with
+# 'since'.
+#
+# ~$ python3 changefeed.py -p 9503          # print the live changes
+
+import json
+import asyncio
+import argparse
+import threading
+from collections import deque
+
+feed_host = "127.0.0.1"
+log_size = 10000
+queue_size = 1000
+
+# // Unchanged runs shorter than this are sent rather than split on //
+merge_gap = 8
+
+block_names = {"d": "di", "c": "co", "i": "ir", "h": "hr"}
+
+
+def changed_runs(old, new, gap=merge_gap):
+    """Return [(start, end)] index ranges where new differs from old"""
+
+    runs = []
+    start = last = None
+    for i, (a, b) in enumerate(zip(old, new)):
+        if a != b:
+            if start is None:
+                start = i
+            elif i - last > gap:
+                runs.append((start, last + 1))
+                start = i
+            last = i
+    if start is not None:
+        runs.append((start, last + 1))
+    return runs
+
+
+class Subscriber:
+    """One connected subscriber and its pending events"""
+
+    def __init__(self, units=None, blocks=None):
+        """Initialise the subscriber
+
+        :param units: Unit IDs to receive, all when empty
+        :param blocks: Block names to receive, all when empty
+        """
+        self.queue = asyncio.Queue()
+        self.units = set(units or ())
+        self.blocks = set(blocks or ())
+
+    def wants(self, event):
+        """Check the event passes the subscriber's filters"""
+
+        if self.units and event["unit"] not in self.units:
+            return False
+        return not self.blocks or event["block"] in self.blocks
+
+
+class ChangeFeed:
+    """Change log with push delivery to subscribers"""
+
+    def __init__(self, size=log_size):
+        """Initialise an empty log
+
+        :param size: Changes kept for subscribers resuming with 'since'
+        """
+        self.log = deque(maxlen=size)
+        self.seq = 0
+        self.subscribers = set()
+        self.loop = None
+        self.loop_thread = None
+        self.lock = threading.Lock()
+
+    def observe(self, unit, fx, address, old, new):
+        """Observer for ObservedSlaveContext, log the changed ranges"""
+
+        if old == new:
+            return
+        block = block_names[fx]
+        cast = int if block[1] == "r" else bool
+        events = []
+        with self.lock:
+            for start, end in changed_runs(old, new):
+                self.seq += 1
+                event = {
+                    "seq": self.seq,
+                    "unit": unit,
+                    "block": block,
+                    "address": address + start,
+                    "values": list(map(cast, new[start:end])),
+                }
+                self.log.append(event)
+                events.append(event)
+        if self.loop is None or not self.subscribers:
+            return
+        if threading.get_ident() == self.loop_thread:
+            self.publish(events)
+        else:
+            self.loop.call_soon_threadsafe(self.publish, events)
+
+    def publish(self, events):
+        """Queue events for every matching subscriber, on the feed loop"""
+
+        for subscriber in list(self.subscribers):
+            queue = subscriber.queue
+            for event in events:
+                if not subscriber.wants(event):
+                    continue
+                if queue.qsize() >= queue_size:
+                    # // Too slow, drop it; it can resume with 'since' //
+                    self.subscribers.discard(subscriber)
+                    queue.put_nowait(None)
+                    break
+                queue.put_nowait(event)
+
+    async def handle_subscriber(self, reader, writer):
+        """Replay the log after 'since', then stream changes"""
+
+        subscriber = None
+        try:
+            request = json.loads(await reader.readline() or b"{}")
+            subscriber = Subscriber(request.get("units"), request.get("blocks"))
+            since = request.get("since")
+            with self.lock:
+                backlog = list(self.log)
+                seq = self.seq
+                self.subscribers.add(subscriber)
+            if since is not None:
+                lost = since < seq and (not backlog or backlog[0]["seq"] > since + 1)
+                if since > seq or lost:
+                    writer.write(b'{"reset": true}\n')
+                else:
+                    for event in backlog:
+                        if event["seq"] > since and subscriber.wants(event):
+                            writer.write(json.dumps(event).encode() + b"\n")
+                await writer.drain()
+            while (event := await subscriber.queue.get()) is not None:
+                if event["seq"] <= seq:
+                    # // Logged before subscribing, already replayed //
+                    continue
+                writer.write(json.dumps(event).encode() + b"\n")
+                if subscriber.queue.empty():
+                    await writer.drain()
+        except (ConnectionError, ValueError, AttributeError):
+            pass
+        finally:
+            self.subscribers.discard(subscriber)
+            writer.close()
+
+    async def serve(self, host, port):
+        """Accept subscribers on host:port"""
+
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        server = await asyncio.start_server(self.handle_subscriber, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+async def subscribe(host, port, request):
+    """Print the changes pushed by a server"""
+
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(json.dumps(request).encode() + b"\n")
+    while line := await reader.readline():
+        print(line.decode().rstrip())
+
+
+def args_parser():
+    """Parse the command line arguments"""
+
+    parser = argparse.ArgumentParser(
+        prog="changefeed.py",
+        description="Print the changes pushed by modbus_server.py --feed-port",
+    )
+    parser.add_argument("-H", "--host", default=feed_host, help="feed host")
+    parser.add_argument("-p", "--port", type=int, required=True, help="feed port")
+    parser.add_argument("-s", "--since", type=int, help="replay changes after SEQ")
+    parser.add_argument("-u", "--units", type=int, nargs="+", help="unit IDs")
+    parser.add_argument(
+        "-b", "--blocks", nargs="+", choices=("di", "co", "ir", "hr"), help="blocks"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = args_parser()
+    request = {"since": args.since, "units": args.units, "blocks": args.blocks}
+    try:
+        asyncio.run(subscribe(args.host, args.port, request))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+""" Multi-unit Modbus server context """
+
+# Each unit ID declared in blockdata_init.yaml gets its own slave
+# context, but the context and its blocks are only built on the first
+# request addressed to that unit. Blocks are sparse, so declaring a
+# full 65,536 address space per unit costs nothing until it is written.
+#
+# ObservedSlaveContext reports every write, from clients or from the
+# simulation, to an observer such as the change feed.
+
+from pymodbus.datastore import ModbusSlaveContext, ModbusServerContext
+from pymodbus.exceptions import NoSuchSlaveException
+
+from datablock import SparseBitBlock, SparseRegisterBlock
+
+# // Undeclared blocks span the whole address space (+1 for zero_mode) //
+full_block = (0, [0], 65537)
+
+
+class ObservedSlaveContext(ModbusSlaveContext):
+    """Slave context passing each write to observer(unit, fx, address, old, new)"""
+
+    unit = 1
+    observer = None
+
+    def setValues(self, fc_as_hex, address, values):
+        """Set the values and report them with the values they replace"""
+
+        if self.observer is None:
+            return super().setValues(fc_as_hex, address, values)
+        if not isinstance(values, (list, tuple)):
+            values = list(values)
+        old = self.getValues(fc_as_hex, address, len(values))
+        super().setValues(fc_as_hex, address, values)
+        self.observer(self.unit, self.decode(fc_as_hex), address, old, values)
+
+
+def observe(context, observer):
+    """Report writes to every current and future slave of the context"""
+
+    if isinstance(context, LazyServerContext):
+        context.observer = observer
+        slaves = context._slaves.values()
+    else:
+        slaves = [context[0]]
+    for slave in slaves:
+        slave.observer = observer
+
+
+def declared_units(addr):
+    """Return the units of the block data, top-level blocks as unit 1"""
+
+    units = dict(addr["units"])
+    units.setdefault(1, {k: addr[k] for k in ("di", "co", "ir", "hr") if k in addr})
+    return units
+
+
+def build_slave(blocks):
+    """Build a slave context of sparse blocks from (address, values, count)"""
+
+    return ObservedSlaveContext(
+        di=SparseBitBlock(*blocks.get("di", full_block)),
+        co=SparseBitBlock(*blocks.get("co", full_block)),
+        ir=SparseRegisterBlock(*blocks.get("ir", full_block)),
+        hr=SparseRegisterBlock(*blocks.get("hr", full_block)),
+    )
+
+
+class LazyServerContext(ModbusServerContext):
+    """Server context that builds a unit's slave context on first access"""
+
+    def __init__(self, units, build=build_slave):
+        """Initialise the context
+
+        :param units: {unit_id: {block: (address, values, count)}}
+        :param build: Builds a slave context from a units entry
+        """
+        super().__init__(slaves=dict(), single=False)
+        self.units = units
+        self.unit_ids = sorted(units)
+        self.build = build
+        self.observer = None
+
+    def __contains__(self, slave):
+        """Check if the unit is declared"""
+
+        return slave in self.units
+
+    def __getitem__(self, slave):
+        """Return the unit's slave context, building it if needed"""
+
+        context = self._slaves.get(slave)
+        if context is None:
+            if slave not in self.units:
+                raise NoSuchSlaveException(f"slave - {slave} is not declared")
+            context = self._slaves[slave] = self.build(self.units[slave])
+            context.unit = slave
+            context.observer = self.observer
+        return context
+
+    def peek(self, slave):
+        """Return the unit's slave context without keeping a new one"""
+
+        context = self._slaves.get(slave)
+        return context if context is not None else self.build(self.units[slave])
+
+    def slaves(self):
+        """Return the declared unit IDs"""
+
+        return self.unit_ids
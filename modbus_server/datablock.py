@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+""" Compact Modbus datablocks """
+
+# RegisterBlock keeps 16-bit registers in an array('H') and BitBlock
+# keeps coils and discrete inputs in a packed bitset, so a full 65,536
+# address space costs 128 KiB and 8 KiB instead of a list of Python ints.
+# Range reads and writes are slice operations on the underlying buffer.
+#
+# Python lists stay faster per request: a list range is a copy of
+# pointers, while these blocks convert every value between Python
+# objects and the packed buffer. The conversions run in C (struct and
+# int <-> binary string) rather than per value in Python.
+
+import struct
+from array import array
+from pymodbus.datastore.store import BaseModbusDataBlock
+
+# // b"0"/b"1" digits <-> b"\x00"/b"\x01" struct '?' bytes //
+TO_DIGITS = bytes.maketrans(b"\x00\x01", b"01")
+FROM_DIGITS = bytes.maketrans(b"01", b"\x00\x01")
+
+
+def bits_to_int(values):
+    """Pack bools (or 0/1) into an int, values[0] is bit 0"""
+
+    if not len(values):
+        return 0
+    flags = struct.pack(f"{len(values)}?", *values)
+    return int(flags.translate(TO_DIGITS)[::-1], 2)
+
+
+def pack_bits(values):
+    """Pack bools (or 0/1) into bytes, LSB first"""
+
+    return bits_to_int(values).to_bytes((len(values) + 7) // 8, "little")
+
+
+def unpack_bits(data, count, shift=0):
+    """Unpack `count` bits from bytes, LSB first, skipping `shift` bits"""
+
+    if count <= 0:
+        return []
+    digits = format(int.from_bytes(data, "little") >> shift, f"0{count}b").encode()
+    flags = digits[: -count - 1 : -1].translate(FROM_DIGITS)
+    return list(struct.unpack(f"{count}?", flags))
+
+
+class RegisterBlock(BaseModbusDataBlock):
+    """Sequential register block backed by array('H')"""
+
+    def __init__(self, address, values, count=None):
+        """Initialise the block
+
+        :param address: The starting address of the block
+        :param values: The initial register values
+        :param count: The block size, padded with 0 past the values
+        """
+        self.address = address
+        self.values = array("H", values)
+        if count is not None and count > len(self.values):
+            self.values.extend(array("H", bytes(2 * (count - len(self.values)))))
+        self.default_value = 0
+
+    @classmethod
+    def from_buffer(cls, address, buffer):
+        """Wrap a writable buffer of native 16-bit registers without copying"""
+
+        block = cls(address, [])
+        block.values = memoryview(buffer).cast("B").cast("H")
+        return block
+
+    def reset(self):
+        """Reset every register to 0"""
+
+        self.values = array("H", bytes(2 * len(self.values)))
+
+    def validate(self, address, count=1):
+        """Check the request is in range"""
+
+        start = address - self.address
+        return start >= 0 and start + count <= len(self.values)
+
+    def getValues(self, address, count=1):
+        """Return the registers in address:address+count"""
+
+        start = address - self.address
+        return self.values[start : start + count].tolist()
+
+    def setValues(self, address, values):
+        """Store the registers starting at address"""
+
+        start = address - self.address
+        if not isinstance(values, (list, tuple, array)):
+            values = [values]
+        # // Never resize, slice assignment would grow the array and //
+        # // pack_into counts a negative offset from the end        //
+        if start < 0 or start + len(values) > len(self.values):
+            raise ValueError(f"{len(values)} registers at {address} are outside the block")
+        if isinstance(values, array):
+            self.values[start : start + len(values)] = values
+            return
+        # // Packed straight into the buffer, no intermediate array //
+        struct.pack_into(f"{len(values)}H", self.values, 2 * start, *values)
+
+
+class BitBlock(BaseModbusDataBlock):
+    """Sequential coil/discrete input block backed by a packed bitset"""
+
+    def __init__(self, address, values, count=None):
+        """Initialise the block
+
+        :param address: The starting address of the block
+        :param values: The initial bit values
+        :param count: The block size, padded with False past the values
+        """
+        self.address = address
+        self.count = max(len(values), count or 0)
+        self.values = bytearray(pack_bits(values))
+        self.values.extend(bytes((self.count + 7) // 8 - len(self.values)))
+        self.default_value = False
+
+    @classmethod
+    def from_buffer(cls, address, buffer, count):
+        """Wrap a writable packed bitset of `count` bits without copying"""
+
+        block = cls(address, [])
+        block.count = count
+        block.values = memoryview(buffer).cast("B")
+        return block
+
+    def __iter__(self):
+        """Iterate over (address, bit)"""
+
+        return enumerate(unpack_bits(self.values, self.count), self.address)
+
+    def __str__(self):
+        """Describe the block"""
+
+        return f"BitBlock({self.count})"
+
+    def reset(self):
+        """Reset every bit to False"""
+
+        self.values = bytearray(len(self.values))
+
+    def validate(self, address, count=1):
+        """Check the request is in range"""
+
+        start = address - self.address
+        return start >= 0 and start + count <= self.count
+
+    def getValues(self, address, count=1):
+        """Return the bits in address:address+count"""
+
+        start = address - self.address
+        first, shift = divmod(start, 8)
+        last = (start + count + 7) // 8
+        return unpack_bits(memoryview(self.values)[first:last], count, shift)
+
+    def setValues(self, address, values):
+        """Store the bits starting at address"""
+
+        if not isinstance(values, (list, tuple)):
+            values = [values]
+        count = len(values)
+        start = address - self.address
+        first, shift = divmod(start, 8)
+        last = (start + count + 7) // 8
+        if not shift and not count % 8:
+            self.values[first:last] = pack_bits(values)
+            return
+        mask = ((1 << count) - 1) << shift
+        current = int.from_bytes(self.values[first:last], "little")
+        current = (current & ~mask) | (bits_to_int(values) << shift)
+        self.values[first:last] = current.to_bytes(last - first, "little")
+
+
+class SparseBlock(BaseModbusDataBlock):
+    """Block split into fixed-size pages allocated on first write
+
+    Unwritten pages read as the default value, so a full address
+    space costs nothing until clients (or the YAML) put data in it.
+    """
+
+    page_class = None
+    page_size = 0
+    default_value = None
+
+    def __init__(self, address, values, count=None):
+        """Initialise the block
+
+        :param address: The starting address of the block
+        :param values: The initial values, all-default pages stay unallocated
+        :param count: The block size
+        """
+        self.address = address
+        self.count = max(len(values), count or 0)
+        self.pages = dict()
+        self.setValues(address, list(values))
+
+    def __iter__(self):
+        """Iterate over (address, value)"""
+
+        return enumerate(self.getValues(self.address, self.count), self.address)
+
+    def __str__(self):
+        """Describe the block"""
+
+        return f"{self.__class__.__name__}({self.count}, pages={len(self.pages)})"
+
+    def reset(self):
+        """Drop every page"""
+
+        self.pages.clear()
+
+    def validate(self, address, count=1):
+        """Check the request is in range"""
+
+        start = address - self.address
+        return start >= 0 and start + count <= self.count
+
+    def _chunks(self, start, count):
+        """Yield (page, offset, length, position) covering start:start+count"""
+
+        position = 0
+        while position < count:
+            page, offset = divmod(start + position, self.page_size)
+            length = min(count - position, self.page_size - offset)
+            yield page, offset, length, position
+            position += length
+
+    def getValues(self, address, count=1):
+        """Return the values in address:address+count"""
+
+        values = []
+        for page, offset, length, _ in self._chunks(address - self.address, count):
+            data = self.pages.get(page)
+            if data is None:
+                values.extend([self.default_value] * length)
+            else:
+                values.extend(data.getValues(offset, length))
+        return values
+
+    def setValues(self, address, values):
+        """Store the values starting at address"""
+
+        if not isinstance(values, (list, tuple, array)):
+            values = [values]
+        for page, offset, length, position in self._chunks(
+            address - self.address, len(values)
+        ):
+            chunk = values[position : position + length]
+            data = self.pages.get(page)
+            if data is None:
+                if not any(chunk):
+                    continue
+                data = self.pages[page] = self.page_class(
+                    0, [], self.page_size
+                )
+            data.setValues(offset, chunk)
+
+
+class SparseRegisterBlock(SparseBlock):
+    """Sparse register block with array('H') pages"""
+
+    page_class = RegisterBlock
+    page_size = 256
+    default_value = 0
+
+
+class SparseBitBlock(SparseBlock):
+    """Sparse coil/discrete input block with bitset pages"""
+
+    page_class = BitBlock
+    page_size = 2048
+    default_value = False
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+""" Hot reload of blockdata_init.yaml """
+
+# ConfigWatcher polls the YAML file and, when it changes, diffs the new
+# block data against the previous version of the file. Only the address
+# ranges that differ are written to the live datastore, so values that
+# clients wrote elsewhere survive and connections are never dropped.
+# Resized blocks are swapped for resized copies, added or removed unit
+# IDs are declared or dropped and the 'simulation' entry is handed to
+# the running engine. The whole new file, simulation included, is
+# checked against the new blocks before anything is applied, so a bad
+# edit is rejected as a whole and the watcher keeps running.
+
+import os
+import asyncio
+
+from changefeed import changed_runs
+from context import LazyServerContext, build_slave, declared_units, full_block
+from datablock import SparseBlock
+
+block_fc = {"di": 2, "co": 1, "ir": 4, "hr": 3}
+block_fx = {"di": "d", "co": "c", "ir": "i", "hr": "h"}
+
+
+def block_changes(old, new):
+    """Return [(index, values)] where new block data differs from old"""
+
+    old_values = list(old[1]) if old else []
+    new_values = list(new[1])
+    size = max(len(old_values), len(new_values))
+    old_values += [0] * (size - len(old_values))
+    new_values += [0] * (size - len(new_values))
+    # // Exact runs, unchanged addresses in between may hold client writes //
+    runs = changed_runs(old_values, new_values, gap=1)
+    return [(start, new_values[start:end]) for start, end in runs]
+
+
+def resize(slave, k, count):
+    """Resize a block in place (sparse) or swap in a resized copy"""
+
+    block = slave.store[block_fx[k]]
+    if isinstance(block, SparseBlock):
+        block.count = count
+        return
+    current = getattr(block, "count", None) or len(block.values)
+    values = block.getValues(0, min(count, current))
+    slave.store[block_fx[k]] = block.__class__(0, values, count)
+
+
+def apply_blocks(slave, old_blocks, new_blocks):
+    """Apply the changed ranges of one unit, return the number of ranges"""
+
+    ranges = 0
+    for k, fc in block_fc.items():
+        new = new_blocks.get(k)
+        if new is None:
+            continue
+        old = old_blocks.get(k)
+        if old is None or old[2] != new[2]:
+            resize(slave, k, new[2])
+        for index, values in block_changes(old, new):
+            if k[1] != "r":
+                values = [bool(v) for v in values]
+            # // index 0 is the zero_mode pad, client address = index - 1 //
+            slave.setValues(fc, index - 1, values)
+            ranges += 1
+    return ranges
+
+
+class ConfigWatcher:
+    """Watch the YAML file and apply its changes to the live datastore"""
+
+    def __init__(self, path, context, load, addr, interval, simulation=None):
+        """Initialise the watcher
+
+        :param path: The YAML file to watch
+        :param context: The live ModbusServerContext
+        :param load: Returns (err, addr) for the file, like get_blockdata
+        :param addr: The block data the datastore was built from
+        :param interval: Seconds between checks of the file
+        :param simulation: The running Simulation, if any
+        """
+        self.path = path
+        self.context = context
+        self.load = load
+        self.addr = addr
+        self.interval = interval
+        self.simulation = simulation
+        self.stamp = self.file_stamp()
+        self.reloads = 0
+
+    def file_stamp(self):
+        """Return (mtime, size) of the file, None when missing"""
+
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def fits(self, addr):
+        """Return a simulation range check against the blocks of addr"""
+
+        names = {fc: k for k, fc in block_fc.items()}
+        lazy = isinstance(self.context, LazyServerContext)
+        if not lazy and "units" in addr:
+            # // Blocks are not reloaded, check the live datastore //
+            return None
+        units = declared_units(addr) if "units" in addr else {}
+
+        def check(unit, fc, start, count):
+            blocks = units.get(unit) if lazy else addr
+            if blocks is None:
+                return False
+            # // index 0 is the zero_mode pad, client address = index - 1 //
+            address, _, size = blocks.get(names[fc], full_block)
+            index = start + 1 - address
+            return start >= 0 and count >= 0 and index >= 0 and index + count <= size
+
+        return check
+
+    def apply(self, addr):
+        """Apply the differences between self.addr and addr
+
+        :raises ValueError: When the new simulation is invalid or no
+            longer fits the new blocks, before anything is changed
+        """
+        built = None
+        if self.simulation:
+            # // Checked on every reload, resized blocks can drop ranges //
+            # // of an unchanged 'simulation' entry                       //
+            built = self.simulation.build(addr.get("simulation") or {}, self.fits(addr))
+        ranges = 0
+        if isinstance(self.context, LazyServerContext):
+            ranges = self.apply_units(addr)
+        elif "units" in addr:
+            print(f"  '{self.path}': switching to 'units' needs a restart")
+        else:
+            ranges = apply_blocks(self.context[0], self.addr, addr)
+        if built is not None:
+            self.simulation.use(built)
+        self.addr = addr
+        return ranges
+
+    def apply_units(self, addr):
+        """Apply unit declarations and their changed ranges"""
+
+        context = self.context
+        old_units = declared_units(self.addr) if "units" in self.addr else {}
+        new_units = declared_units(addr) if "units" in addr else {}
+        ranges = 0
+        for unit in set(old_units) - set(new_units):
+            context.units.pop(unit, None)
+            context._slaves.pop(unit, None)
+        for unit, blocks in new_units.items():
+            old_blocks = old_units.get(unit)
+            if blocks == old_blocks:
+                continue
+            slave = context._slaves.get(unit)
+            if slave is None and context.build is build_slave:
+                # // Not built yet, it will be built from the new map //
+                context.units[unit] = blocks
+                continue
+            if slave is None and unit not in context.units:
+                print(f"  '{self.path}': unit {unit} is not in the snapshot")
+                continue
+            ranges += apply_blocks(context[unit], old_blocks or {}, blocks)
+        context.unit_ids = sorted(context.units)
+        return ranges
+
+    def check(self):
+        """Return True when the file changed since the last check"""
+
+        stamp = self.file_stamp()
+        if stamp is None or stamp == self.stamp:
+            return False
+        self.stamp = stamp
+        return True
+
+    async def run(self):
+        """Poll the file, parse off the loop and apply on it"""
+
+        while True:
+            await asyncio.sleep(self.interval)
+            if not self.check():
+                continue
+            err, addr = await asyncio.to_thread(self.load)
+            if err:
+                # // Missing or half-written, keep the current data //
+                continue
+            try:
+                ranges = self.apply(addr)
+            except Exception as e:
+                # // Keep serving the current data and watching the file //
+                print(f"  '{self.path}' not reloaded: {e}")
+                continue
+            self.reloads += 1
+            print(f"  Reloaded '{self.path}': {ranges} range(s) updated")
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+""" Request instrumentation and Prometheus metrics endpoint """
+
+# InstrumentedHandler wraps pymodbus' TCP request handler and records,
+# per function code and per client IP, the request and error counts,
+# bytes in/out and a latency histogram of the time spent executing the
+# request and sending the response. Metrics.serve exposes them in the
+# Prometheus text format on a local HTTP port:
+#
+# ~$ curl http://127.0.0.1:9502/metrics
+
+import time
+import asyncio
+from bisect import bisect_left
+
+from pymodbus.server.async_io import ModbusConnectedRequestHandler
+
+metrics_host = "127.0.0.1"
+
+# // Histogram upper bounds in seconds, +Inf is implied //
+buckets = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1)
+
+fc_names = {
+    1: "read_coils",
+    2: "read_discrete_inputs",
+    3: "read_holding_registers",
+    4: "read_input_registers",
+    5: "write_coil",
+    6: "write_register",
+    15: "write_coils",
+    16: "write_registers",
+    43: "read_device_information",
+}
+
+# // Stats list layout: counters, then one slot per bucket and +Inf //
+REQUESTS, ERRORS, BYTES_IN, BYTES_OUT, SECONDS, BUCKETS = range(6)
+stats_size = BUCKETS + len(buckets) + 1
+
+
+class Metrics:
+    """Per function code and per client request statistics"""
+
+    def __init__(self):
+        """Initialise empty statistics"""
+
+        self.functions = dict()
+        self.clients = dict()
+
+    def observe(self, fc, client, seconds, error, bytes_in, bytes_out):
+        """Record one request"""
+
+        slot = BUCKETS + bisect_left(buckets, seconds)
+        for table, key in ((self.functions, fc), (self.clients, client)):
+            stats = table.get(key)
+            if stats is None:
+                stats = table[key] = [0] * stats_size
+            stats[REQUESTS] += 1
+            stats[ERRORS] += error
+            stats[BYTES_IN] += bytes_in
+            stats[BYTES_OUT] += bytes_out
+            stats[SECONDS] += seconds
+            stats[slot] += 1
+
+    def render(self):
+        """Return the statistics in the Prometheus text format"""
+
+        functions = [
+            (f'function="{fc_names.get(fc, fc)}"', stats)
+            for fc, stats in sorted(self.functions.items())
+        ]
+        clients = [(f'client="{ip}"', stats) for ip, stats in sorted(self.clients.items())]
+        lines = []
+        for prefix, rows in (("modbus", functions), ("modbus_client", clients)):
+            for name, index, kind, text in (
+                ("requests_total", REQUESTS, "counter", "Requests handled"),
+                ("errors_total", ERRORS, "counter", "Exception responses sent"),
+                ("received_bytes_total", BYTES_IN, "counter", "Request bytes received"),
+                ("sent_bytes_total", BYTES_OUT, "counter", "Response bytes sent"),
+            ):
+                lines.append(f"# HELP {prefix}_{name} {text}")
+                lines.append(f"# TYPE {prefix}_{name} {kind}")
+                lines.extend(f"{prefix}_{name}{{{label}}} {stats[index]}" for label, stats in rows)
+
+            name = f"{prefix}_request_duration_seconds"
+            lines.append(f"# HELP {name} Time to execute and answer a request")
+            lines.append(f"# TYPE {name} histogram")
+            for label, stats in rows:
+                total = 0
+                for bound, count in zip((*buckets, "+Inf"), stats[BUCKETS:]):
+                    total += count
+                    lines.append(f'{name}_bucket{{{label},le="{bound}"}} {total}')
+                lines.append(f"{name}_sum{{{label}}} {stats[SECONDS]:.6f}")
+                lines.append(f"{name}_count{{{label}}} {stats[REQUESTS]}")
+        return "\n".join(lines) + "\n"
+
+    async def handle_http(self, reader, writer):
+        """Answer one HTTP request with the metrics"""
+
+        try:
+            request = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request.split()
+            if len(parts) > 1 and parts[0] == b"GET" and parts[1] in (b"/", b"/metrics"):
+                status, body = "200 OK", self.render().encode()
+            else:
+                status, body = "404 Not Found", b"Not Found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        """Serve /metrics over HTTP"""
+
+        server = await asyncio.start_server(self.handle_http, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+def make_handler(metrics):
+    """Return a TCP request handler class recording into metrics"""
+
+    class InstrumentedHandler(ModbusConnectedRequestHandler):
+        """Connected request handler with per-request instrumentation"""
+
+        def connection_made(self, transport):
+            """Track the client IP and per-request byte counts"""
+
+            super().connection_made(transport)
+            self.client_ip = self.client_address[0]
+            self.bytes_in = 0
+            self.bytes_out = 0
+            self.error = False
+
+        async def _recv_(self):
+            """Count received bytes, charged to the next request"""
+
+            data = await super()._recv_()
+            if data:
+                self.bytes_in += len(data)
+            return data
+
+        def _send_(self, data):
+            """Count sent bytes"""
+
+            self.bytes_out += len(data)
+            super()._send_(data)
+
+        def send(self, message, *addr, **kwargs):
+            """Note exception responses"""
+
+            self.error = message.isError()
+            super().send(message, *addr, **kwargs)
+
+        def execute(self, request, *addr):
+            """Time the request and record it"""
+
+            start = time.perf_counter()
+            super().execute(request, *addr)
+            metrics.observe(
+                request.function_code,
+                self.client_ip,
+                time.perf_counter() - start,
+                self.error,
+                self.bytes_in,
+                self.bytes_out,
+            )
+            self.bytes_in = 0
+            self.bytes_out = 0
+            self.error = False
+
+    return InstrumentedHandler
@@ -15,17 +15,29 @@ import os
 import sys
 import yaml
 import socket
+import asyncio
+import argparse
+import threading
 from pymodbus.version import version
-from pymodbus.server import StartTcpServer
+from pymodbus.server import StartTcpServer, StartAsyncTcpServer
 from pymodbus.device import ModbusDeviceIdentification
-from pymodbus.datastore import ModbusSequentialDataBlock
-from pymodbus.datastore import ModbusSlaveContext, ModbusServerContext
+from pymodbus.datastore import ModbusServerContext
+from datablock import BitBlock, RegisterBlock
+from context import LazyServerContext, ObservedSlaveContext, declared_units, observe
+from hotreload import ConfigWatcher
+import snapshot
+import metrics
+import changefeed
 
 remote_ip = "0.0.0.0"
 port = 502
+privileged_ports = 1024
 euid = os.geteuid()
 addr = dict()
 file = "blockdata_init.yaml"
+backlog = 1024
+snapshot_interval = 10.0
+watch_interval = 0.25
 
 label_dict = {
     "di": "Discrete Input Contacts",
@@ -34,33 +46,70 @@ label_dict = {
     "hr": "Analogue Output Holding Register"
 }
 
-block_count = {"di": 4, "co": 4, "ir": 8, "hr": 8}
+display_count = 8
 
-# // Get the local IP address //
-hostname = socket.gethostname()
-local_ip = socket.gethostbyname(hostname)
 
+def parse_block(v):
+    """Return (address, values, count) for one YAML block
 
-def get_blockdata():
+    A block is a list of values, or a mapping with 'size' and
+    'values' for register maps larger than the listed values.
+    """
+    if isinstance(v, dict):
+        values = v.get("values", [])
+        count = max(v.get("size", 0), len(values))
+    else:
+        values, count = v, len(v)
+    # // zero_mode is off, so address 0 is index 1 //
+    return (0, [0, *values], count + 1)
+
+
+def parse_units(yaml_units):
+    """Return {unit_id: {block: (address, values, count)}}
+
+    Keys are unit IDs or 'first-last' ranges sharing one register map.
+    """
+    units = dict()
+    for key, blocks in yaml_units.items():
+        first, _, last = str(key).partition("-")
+        map_ = {k: parse_block(v) for k, v in (blocks or {}).items()}
+        for unit in range(int(first), int(last or first) + 1):
+            units[unit] = map_
+    return units
+
+
+def get_blockdata(path=file, verbose=True):
+    """Load the block data, each entry is (address, values, count)
+
+    An optional 'units' entry declares further unit IDs, see parse_units.
+    err is 1 when the file is missing and 2 when it cannot be parsed.
+    """
     dict_ = dict()
 
-    if not os.path.exists(file):
+    if not os.path.exists(path):
         err = 1
-        dict_["di"] = (0, [0] * 5)  # (0-False, 1-True)
-        dict_["co"] = (0, [0] * 5)  # (0-False, 1-True)
-        dict_["ir"] = (0, [0] * 9)
-        dict_["hr"] = (0, [0] * 9)
+        dict_["di"] = (0, [0] * 5, 5)  # (0-False, 1-True)
+        dict_["co"] = (0, [0] * 5, 5)  # (0-False, 1-True)
+        dict_["ir"] = (0, [0] * 9, 9)
+        dict_["hr"] = (0, [0] * 9, 9)
     else:
         # // De-serialise data from the file (read it) //
         err = 0
-        print(f"De-serialising data from '{file}'")
+        if verbose:
+            print(f"De-serialising data from '{path}'")
         try:
-            with open(file, mode="r") as fh:
+            with open(path, mode="r") as fh:
                 yaml_in = yaml.load(fh, Loader=yaml.FullLoader)
                 for k, v in yaml_in.items():
-                    dict_[k] = (0, [0, *v])
+                    if k == "units":
+                        dict_[k] = parse_units(v)
+                    elif k == "simulation":
+                        dict_[k] = v
+                    else:
+                        dict_[k] = parse_block(v)
         except:
-            print(f"ERROR: YAML file format error in {file}")
+            err = 2
+            print(f"ERROR: YAML file format error in {path}")
 
     return err, dict_
 
@@ -73,6 +122,15 @@ def clear_shell():
     return 0
 
 
+def get_local_ip():
+    """Resolve the local IP address, may block on a slow resolver"""
+
+    try:
+        return socket.gethostbyname(socket.gethostname())
+    except OSError:
+        return "127.0.0.1"
+
+
 def sudo_switch():
     """Make Server run as sudo"""
     args = ["sudo", sys.executable] + sys.argv + [os.environ]
@@ -82,18 +140,117 @@ def sudo_switch():
     return 0
 
 
-def run_pymodbus_server(err, addr):
-    """Run the pyModbus Server"""
+def args_parser():
+    """Parse the command line arguments"""
+
+    parser = argparse.ArgumentParser(
+        prog="modbus_server.py",
+        description="Modbus server",
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument(
+        "-m",
+        "--mode",
+        choices=("sync", "async"),
+        default="sync",
+        help="sync : blocking StartTcpServer (default)\n"
+        "async: server task on an event loop owned by this process",
+    )
+    parser.add_argument(
+        "-H", "--host", metavar="HOST", default=remote_ip, help="address to bind"
+    )
+    parser.add_argument(
+        "-p",
+        "--port",
+        metavar="PORT",
+        type=int,
+        default=port,
+        help=f"TCP port, root privileges are only requested below {privileged_ports}",
+    )
+    parser.add_argument(
+        "-b",
+        "--backlog",
+        metavar="N",
+        type=int,
+        default=backlog,
+        help="listen() backlog in async mode",
+    )
+    parser.add_argument(
+        "-s",
+        "--snapshot",
+        metavar="FILE",
+        help="restore from FILE if it exists (the YAML is then not read)\n"
+        "and save the datastore to it periodically and on exit",
+    )
+    parser.add_argument(
+        "-i",
+        "--snapshot-interval",
+        metavar="SEC",
+        type=float,
+        default=snapshot_interval,
+        help="seconds between snapshots",
+    )
+    parser.add_argument(
+        "-M",
+        "--metrics-port",
+        metavar="PORT",
+        type=int,
+        help="record per function code/client metrics and serve them\n"
+        f"at http://{metrics.metrics_host}:PORT/metrics",
+    )
+    parser.add_argument(
+        "-f",
+        "--feed-port",
+        metavar="PORT",
+        type=int,
+        help="push datastore changes to subscribers on\n"
+        f"{changefeed.feed_host}:PORT, see changefeed.py",
+    )
+    parser.add_argument(
+        "-w",
+        "--watch",
+        action="store_true",
+        help=f"apply edits of '{file}' to the running server",
+    )
+    parser.add_argument(
+        "--watch-interval",
+        metavar="SEC",
+        type=float,
+        default=watch_interval,
+        help="seconds between checks of the YAML file",
+    )
+    parser.add_argument(
+        "-q",
+        "--quiet",
+        action="store_true",
+        help="no screen clear or initial state banner",
+    )
+    return parser.parse_args()
+
+
+def build_context(addr):
+    """Build the server context from the block data
+
+    Without 'units' every unit ID answers from one dense datastore,
+    otherwise each declared unit gets a lazily built sparse one and
+    the top-level blocks are unit 1 unless 'units' redefines it.
+    """
+    if "units" in addr:
+        return LazyServerContext(declared_units(addr))
 
     # // Create a datastore and populate it with test data //
-    store = ModbusSlaveContext(
-        di=ModbusSequentialDataBlock(*addr["di"]),
-        co=ModbusSequentialDataBlock(*addr["co"]),
-        ir=ModbusSequentialDataBlock(*addr["ir"]),
-        hr=ModbusSequentialDataBlock(*addr["hr"]),
+    store = ObservedSlaveContext(
+        di=BitBlock(*addr["di"]),
+        co=BitBlock(*addr["co"]),
+        ir=RegisterBlock(*addr["ir"]),
+        hr=RegisterBlock(*addr["hr"]),
     )
 
-    context = ModbusServerContext(slaves=store, single=True)
+    return ModbusServerContext(slaves=store, single=True)
+
+
+def build_identity():
+    """Build the device identification"""
 
     # // Populate the Modbus server information fields //
     # // these return as response to identity queries  //
@@ -104,46 +261,210 @@ def run_pymodbus_server(err, addr):
     identity.ProductName = "Modbus Server"
     identity.ModelName = "Python Modbus"
     identity.MajorMinorRevision = "2.0"
+    return identity
+
+
+async def run_async_server(
+    context, identity, address, backlog=backlog, jobs=(), handler=None
+):
+    """Serve Modbus TCP on the running event loop
 
-    # // Print the initial State //
-    clear_shell()
-    print()
-    print(
-        f"  Vendor Name : {identity.VendorName}\n",
-        f" Vendor URL  : {identity.VendorUrl}\n",
-        f" Product Name: {identity.ProductName}\n",
-        f" Model Name  : {identity.ModelName}\n",
-        f" Revision    : {identity.MajorMinorRevision}",
+    Each job is a coroutine function run as a task beside the server,
+    started once the socket is listening.
+    """
+
+    # // defer_start hands back the server object so that other tasks //
+    # // can share the loop; a deep backlog absorbs connection bursts  //
+    server = await StartAsyncTcpServer(
+        context=context,
+        identity=identity,
+        address=address,
+        defer_start=True,
+        allow_reuse_address=True,
+        backlog=backlog,
+        handler=handler,
     )
-    print()
-    print(f"  Initial State\n  {'-' * 13}\n")
-    msg = f"  ERROR: There is no '{file}' file, using default blockdata\n"
-    if err == 1:
-        print(msg)
-    buf = len(max(list(label_dict.values()), key=len)) + 2
-    for k, v in label_dict.items():
-        if k[1] != "r":
-            count = block_count[k] + 1
-            list_ = [str(bool(x)) for x in addr[k][1][1:count]]
-            print(f"  {v:<{buf}}: ", f"{', '.join(list_)}")
-        else:
-            count = block_count[k] + 1
-            list_ = [str(x) for x in addr[k][1][1:count]]
-            print(f"  {v:<{buf}}:", f"[ {', '.join(list_)} ]")
-    print()
+    serving = asyncio.create_task(server.serve_forever())
+    await server.serving
+    tasks = [asyncio.create_task(job()) for job in jobs]
+    await serving
+    for task in tasks:
+        task.cancel()
+
+
+def start_server(
+    context, identity, address, mode="sync", backlog=backlog, jobs=(), handler=None
+):
+    """Start the Modbus server in the selected mode
+
+    In sync mode each job gets its own event loop on a daemon thread.
+    """
+    if mode == "async":
+        asyncio.run(
+            run_async_server(context, identity, address, backlog, jobs, handler)
+        )
+    else:
+        for job in jobs:
+            threading.Thread(target=asyncio.run, args=(job(),), daemon=True).start()
+        StartTcpServer(
+            context=context, identity=identity, address=address, handler=handler
+        )
+
+
+def run_pymodbus_server(
+    err,
+    addr,
+    mode="sync",
+    port=port,
+    backlog=backlog,
+    context=None,
+    snapshot_file=None,
+    interval=snapshot_interval,
+    metrics_port=None,
+    feed_port=None,
+    watch=None,
+    watch_interval=watch_interval,
+    host=remote_ip,
+    quiet=False,
+):
+    """Run the pyModbus Server
+
+    context is a datastore restored from snapshot_file, when None it
+    is built from addr. watch is the block data of the YAML file to
+    hot-reload from, or None. The initial state banner is a job, so it
+    is printed off the startup path.
+    """
+    if context is None:
+        context = build_context(addr)
+    identity = build_identity()
+    jobs = []
+    simulation = None
+    if addr.get("simulation") or watch is not None:
+        # // An idle engine when watching, the YAML may add waveforms //
+        # // NumPy is only imported when there is something to simulate //
+        from simulation import Simulation
+
+        simulation = Simulation(context, addr.get("simulation") or {})
+        jobs.append(simulation.run)
+    if snapshot_file:
+        extra = {"simulation": addr.get("simulation")}
+        snapshots = snapshot.Snapshot(snapshot_file, context, interval, extra)
+        jobs.append(snapshots.run)
+    handler = None
+    if metrics_port:
+        stats = metrics.Metrics()
+        handler = metrics.make_handler(stats)
+        jobs.append(lambda: stats.serve(metrics.metrics_host, metrics_port))
+    if feed_port:
+        feed = changefeed.ChangeFeed()
+        observe(context, feed.observe)
+        jobs.append(lambda: feed.serve(changefeed.feed_host, feed_port))
+    if watch is not None:
+        load = lambda: get_blockdata(file, verbose=False)
+        watcher = ConfigWatcher(
+            file, context, load, watch, watch_interval, simulation
+        )
+        jobs.append(watcher.run)
+
+    def banner():
+        """Print the initial State"""
+
+        clear_shell()
+        print()
+        print(
+            f"  Vendor Name : {identity.VendorName}\n",
+            f" Vendor URL  : {identity.VendorUrl}\n",
+            f" Product Name: {identity.ProductName}\n",
+            f" Model Name  : {identity.ModelName}\n",
+            f" Revision    : {identity.MajorMinorRevision}",
+        )
+        print()
+        print(f"  Initial State\n  {'-' * 13}\n")
+        msg = f"  ERROR: There is no '{file}' file, using default blockdata\n"
+        if err == 1:
+            print(msg)
+        buf = len(max(list(label_dict.values()), key=len)) + 2
+        for k, v in label_dict.items():
+            if k not in addr:
+                continue
+            size = addr[k][2] - 1
+            count = min(size, display_count) + 1
+            more = f" ... ({size} total)" if size > display_count else ""
+            if k[1] != "r":
+                list_ = [str(bool(x)) for x in addr[k][1][1:count]]
+                print(f"  {v:<{buf}}: ", f"{', '.join(list_)}{more}")
+            else:
+                list_ = [str(x) for x in addr[k][1][1:count]]
+                print(f"  {v:<{buf}}:", f"[ {', '.join(list_)} ]{more}")
+        if "units" in addr:
+            units = sorted(set(addr["units"]) | {1})
+            print(f"\n  {'Unit IDs':<{buf}}:  {len(units)} ({units[0]}-{units[-1]})")
+        if addr.get("simulation"):
+            count = sum(len(g["kind"]) for g in simulation.groups)
+            print(f"  {'Simulation':<{buf}}:  {count} inputs at {simulation.rate:g} Hz")
+        print()
+
+        local_ip = get_local_ip() if host == remote_ip else host
+        print(f"  Listening on {local_ip}:{port} for {remote_ip}:*")
+        if metrics_port:
+            print(f"  Metrics at http://{metrics.metrics_host}:{metrics_port}/metrics")
+        if feed_port:
+            print(f"  Change feed on {changefeed.feed_host}:{feed_port}")
+        if watch is not None:
+            print(f"  Watching '{file}' for changes")
+        print(f"  Modbus daemon running ({mode})... ")
+
+    async def announce():
+        await asyncio.to_thread(banner)
+
+    if quiet:
+        print(f"  Serving {host}:{port} ({mode})")
+    else:
+        jobs.append(announce)
 
     # // Start the Modbus Server //
-    print(f"  Listening on {local_ip}:{port} for {remote_ip}:*")
-    print(f"  Initiating Modbus daemon... ")
-    StartTcpServer(context=context, identity=identity, address=(remote_ip, port))
+    try:
+        start_server(context, identity, (host, port), mode, backlog, jobs, handler)
+    finally:
+        if snapshot_file:
+            snapshots.save()
+            print(f"\n  Datastore saved to '{snapshot_file}'")
 
 
 if __name__ == "__main__":
-    if euid != 0:
+    args = args_parser()
+    if euid != 0 and args.port < privileged_ports:
         print("Running with Effective User ID (euid):", euid)
         sudo_switch()
-    err, dict_ = get_blockdata()
-    run_pymodbus_server(err, dict_)
+    restored = None
+    if args.snapshot and os.path.exists(args.snapshot):
+        print(f"Restoring datastore from '{args.snapshot}'")
+        restored = snapshot.load(args.snapshot)
+    if restored:
+        err, (context, dict_) = 0, restored
+    else:
+        context = None
+        err, dict_ = get_blockdata()
+    watch = None
+    if args.watch:
+        # // Diff edits against the file, also when restored from a snapshot //
+        watch = get_blockdata(verbose=False)[1] if restored else dict_
+    run_pymodbus_server(
+        err,
+        dict_,
+        args.mode,
+        args.port,
+        args.backlog,
+        context,
+        args.snapshot,
+        args.snapshot_interval,
+        args.metrics_port,
+        args.feed_port,
+        watch,
+        args.watch_interval,
+        args.host,
+        args.quiet,
+    )
 
-# // End //
-sys.exit()
+    # // End //
+    sys.exit()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+""" Process simulation for input registers and discrete inputs """
+
+# The 'simulation' entry of blockdata_init.yaml declares waveforms over
+# address ranges of the 'ir' and 'di' blocks:
+#
+#   simulation:
+#     rate: 10                  # ticks per second
+#     ir:
+#       - {start: 0, count: 4, wave: sine, amplitude: 100, offset: 500, period: 10}
+#       - {start: 4, count: 4, wave: ramp, low: 0, high: 1000, period: 60}
+#     di:
+#       - {start: 0, count: 2, wave: step, period: 5, duty: 0.5}
+#       - {start: 2, count: 2, wave: noise, unit: 1}
+#
+# sine : offset + amplitude * sin(2 pi cycle)
+# ramp : low + (high - low) * cycle
+# step : high for the first 'duty' of each cycle, low after
+# noise: offset + amplitude * uniform(-1, 1)
+#
+# where cycle = (t / period + phase + i * spread) % 1 for the i-th
+# address of the range. Discrete inputs are True when the value is
+# >= 0.5. Every tick all waveforms of a block are evaluated with NumPy
+# and written back one range at a time.
+
+import time
+import asyncio
+import numpy as np
+from array import array
+from pymodbus.exceptions import NoSuchSlaveException
+
+waves = ("sine", "ramp", "step", "noise")
+block_fc = {"ir": 4, "di": 2}
+
+# // Per-block parameter defaults, registers span 0..2000, bits 0..1 //
+defaults = {
+    "ir": {"amplitude": 1000.0, "offset": 1000.0, "low": 0.0, "high": 1000.0},
+    "di": {"amplitude": 0.5, "offset": 0.5, "low": 0.0, "high": 1.0},
+}
+
+# // Largest range written between two yields to the event loop //
+chunk_size = 2048
+
+
+class Simulation:
+    """Waveform engine writing to a ModbusServerContext"""
+
+    def __init__(self, context, spec, seed=None):
+        """Initialise the engine
+
+        :param context: The ModbusServerContext to drive
+        :param spec: The 'simulation' mapping from the YAML file
+        :param seed: Seed for the noise generator
+        """
+        self.context = context
+        self.rng = np.random.default_rng(seed)
+        self.ticks = 0
+        self.missed = 0
+        self.configure(spec)
+
+    def configure(self, spec):
+        """Replace the waveforms, the rate applies from the next tick"""
+
+        self.use(self.build(spec))
+
+    def build(self, spec, fits=None):
+        """Return the (groups, rate) of a spec without applying it
+
+        :param spec: The 'simulation' mapping from the YAML file
+        :param fits: Checks (unit, fc, start, count) ranges, self.fits by default
+        :raises ValueError: When the spec is invalid
+        """
+        rate = float(spec.get("rate", 1))
+        if rate <= 0:
+            raise ValueError(f"simulation.rate must be positive, not {rate:g}")
+        groups = [
+            self._build_group(block, spec[block], fits or self.fits)
+            for block in block_fc
+            if spec.get(block)
+        ]
+        return groups, rate
+
+    def use(self, built):
+        """Switch to the (groups, rate) returned by build()"""
+
+        self.groups, self.rate = built
+
+    def _build_group(self, block, entries, fits):
+        """Flatten a block's ranges into per-address parameter arrays"""
+
+        params = {k: [] for k in ("amplitude", "offset", "low", "high",
+                                  "period", "phase", "duty", "kind")}
+        ranges = []
+        position = 0
+        for entry in entries:
+            count = int(entry.get("count", 1))
+            wave = entry.get("wave", "sine")
+            if wave not in waves:
+                raise ValueError(f"Unknown waveform '{wave}' in simulation.{block}")
+            unit, start = int(entry.get("unit", 1)), int(entry.get("start", 0))
+            if not fits(unit, block_fc[block], start, count):
+                raise ValueError(
+                    f"simulation.{block} range {start}-{start + count - 1} "
+                    f"is outside the '{block}' block of unit {unit}"
+                )
+            for k, v in defaults[block].items():
+                params[k].append(np.full(count, float(entry.get(k, v))))
+            spread = float(entry.get("spread", 0.0))
+            params["phase"].append(
+                float(entry.get("phase", 0.0)) + spread * np.arange(count)
+            )
+            params["period"].append(np.full(count, float(entry.get("period", 10.0))))
+            params["duty"].append(np.full(count, float(entry.get("duty", 0.5))))
+            params["kind"].append(np.full(count, waves.index(wave)))
+            ranges.append((unit, start, position, count))
+            position += count
+
+        group = {k: np.concatenate(v) for k, v in params.items()}
+        group["block"] = block
+        group["ranges"] = ranges
+        group["index"] = [np.flatnonzero(group["kind"] == i) for i in range(len(waves))]
+        return group
+
+    def fits(self, unit, fc, start, count):
+        """Check a range lies inside its block of the datastore"""
+
+        try:
+            return count >= 0 and start >= 0 and self.context[unit].validate(fc, start, count)
+        except NoSuchSlaveException:
+            return False
+
+    def evaluate(self, group, t):
+        """Return the group's values at time t as one NumPy array"""
+
+        g = group
+        out = np.empty(len(g["kind"]))
+        sine, ramp, step, noise = g["index"]
+        if sine.size:
+            cycle = (t / g["period"][sine] + g["phase"][sine]) % 1.0
+            out[sine] = g["offset"][sine] + g["amplitude"][sine] * np.sin(2 * np.pi * cycle)
+        if ramp.size:
+            cycle = (t / g["period"][ramp] + g["phase"][ramp]) % 1.0
+            low = g["low"][ramp]
+            out[ramp] = low + (g["high"][ramp] - low) * cycle
+        if step.size:
+            cycle = (t / g["period"][step] + g["phase"][step]) % 1.0
+            out[step] = np.where(cycle < g["duty"][step], g["high"][step], g["low"][step])
+        if noise.size:
+            out[noise] = g["offset"][noise] + g["amplitude"][noise] * self.rng.uniform(
+                -1.0, 1.0, noise.size
+            )
+        if g["block"] == "di":
+            return out >= 0.5
+        return np.clip(np.rint(out), 0, 0xFFFF).astype(np.uint16)
+
+    def updates(self, t):
+        """Yield (unit, fc, address, values) writes for time t
+
+        Ranges are split in chunk_size pieces so a caller on the event
+        loop can yield between them.
+        """
+        for group in self.groups:
+            fc = block_fc[group["block"]]
+            values = self.evaluate(group, t)
+            for unit, start, position, count in group["ranges"]:
+                for offset in range(0, count, chunk_size):
+                    piece = values[position + offset : position + min(count, offset + chunk_size)]
+                    if fc == 2:
+                        piece = piece.tolist()
+                    else:
+                        piece = array("H", piece.tobytes())
+                    yield unit, fc, start + offset, piece
+
+    def tick(self, t):
+        """Evaluate and apply every waveform at time t"""
+
+        for unit, fc, address, values in self.updates(t):
+            self.context[unit].setValues(fc, address, values)
+        self.ticks += 1
+
+    async def run(self):
+        """Tick at the configured rate on the running event loop"""
+
+        start = time.monotonic()
+        deadline = start
+        while True:
+            period = 1.0 / self.rate
+            for unit, fc, address, values in self.updates(deadline - start):
+                self.context[unit].setValues(fc, address, values)
+                await asyncio.sleep(0)
+            self.ticks += 1
+            deadline += period
+            now = time.monotonic()
+            if now > deadline:
+                # // Behind schedule, drop the missed ticks //
+                skipped = int((now - deadline) / period) + 1
+                self.missed += skipped
+                deadline += skipped * period
+            await asyncio.sleep(deadline - now)
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+""" Memory-mapped datastore snapshots """
+
+# Snapshot file layout:
+#
+#   b"MBSNAP1\n" | u32 header length | JSON header | payload
+#
+# The JSON header lists, for every unit and block, the block size and
+# the payload (offset, length) of each stored range: one range for a
+# dense block, one per allocated page for a sparse block. Payloads are
+# the raw array('H') / bitset buffers in native byte order, 8-byte
+# aligned. On restore the file is mapped copy-on-write and the blocks
+# wrap slices of the mapping, so startup does not touch the data and
+# the OS pages it in on first access.
+
+import os
+import sys
+import json
+import mmap
+import struct
+import asyncio
+
+from pymodbus.datastore import ModbusServerContext
+
+from datablock import (
+    BitBlock,
+    RegisterBlock,
+    SparseBlock,
+    SparseBitBlock,
+    SparseRegisterBlock,
+)
+from context import LazyServerContext, ObservedSlaveContext
+
+magic = b"MBSNAP1\n"
+blocks = {"di": "d", "co": "c", "ir": "i", "hr": "h"}
+
+
+def describe_block(block, chunks, offset):
+    """Append the block's buffers to chunks, return (header, offset)"""
+
+    if isinstance(block, SparseBlock):
+        header = {"count": block.count, "sparse": True, "pages": []}
+        buffers = [
+            (page * block.page_size, data.values)
+            for page, data in sorted(block.pages.items())
+        ]
+    else:
+        count = getattr(block, "count", len(block.values))
+        header = {"count": count, "sparse": False, "pages": []}
+        buffers = [(0, block.values)]
+    for start, values in buffers:
+        data = bytes(values)
+        header["pages"].append([start, offset, len(data)])
+        chunks.append(data)
+        padding = -len(data) % 8
+        if padding:
+            chunks.append(bytes(padding))
+        offset += len(data) + padding
+    return header, offset
+
+
+def dump(context, extra=None):
+    """Copy the datastore into (header bytes, payload chunks)
+
+    Runs in one go so the snapshot is consistent when called on the
+    server's event loop; writing the chunks can happen elsewhere.
+    """
+    units = dict()
+    chunks = []
+    offset = 0
+    if isinstance(context, LazyServerContext):
+        slaves = [(unit, context.peek(unit)) for unit in context.slaves()]
+    else:
+        slaves = [(0, context[0])]
+    for unit, slave in slaves:
+        units[str(unit)] = unit_header = dict()
+        for k, fx in blocks.items():
+            unit_header[k], offset = describe_block(slave.store[fx], chunks, offset)
+    header = {
+        "byteorder": sys.byteorder,
+        "single": not isinstance(context, LazyServerContext),
+        "units": units,
+        "extra": extra or {},
+    }
+    return json.dumps(header).encode(), chunks
+
+
+def write(path, header, chunks):
+    """Write a snapshot atomically (temp file + rename)"""
+
+    start = len(magic) + 4 + len(header)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as fh:
+        fh.write(magic + struct.pack("<I", len(header)) + header)
+        fh.write(bytes(-start % 8))
+        for chunk in chunks:
+            fh.write(chunk)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, path)
+
+
+def save(path, context, extra=None):
+    """Snapshot the datastore to path"""
+
+    header, chunks = dump(context, extra)
+    write(path, header, chunks)
+
+
+def restore_block(view, k, spec):
+    """Build a block wrapping its payload in the mapped view"""
+
+    pages = [view[offset : offset + length] for _, offset, length in spec["pages"]]
+    if not spec["sparse"]:
+        if k[1] == "r":
+            return RegisterBlock.from_buffer(0, pages[0])
+        return BitBlock.from_buffer(0, pages[0], spec["count"])
+    if k[1] == "r":
+        block = SparseRegisterBlock(0, [], spec["count"])
+        for (start, _, _), data in zip(spec["pages"], pages):
+            block.pages[start // block.page_size] = RegisterBlock.from_buffer(0, data)
+    else:
+        block = SparseBitBlock(0, [], spec["count"])
+        for (start, _, _), data in zip(spec["pages"], pages):
+            block.pages[start // block.page_size] = BitBlock.from_buffer(
+                0, data, block.page_size
+            )
+    return block
+
+
+def load(path):
+    """Map a snapshot, return (context, addr) or None if unusable
+
+    addr carries the unit 1 block sizes and leading values for the
+    initial state printout, the unit IDs and the snapshot extras.
+    """
+    with open(path, "rb") as fh:
+        mapped = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_COPY)
+    if mapped[: len(magic)] != magic:
+        return None
+    size = struct.unpack("<I", mapped[len(magic) : len(magic) + 4])[0]
+    start = len(magic) + 4
+    header = json.loads(mapped[start : start + size])
+    if header["byteorder"] != sys.byteorder:
+        return None
+    start += size
+    view = memoryview(mapped)[start + (-start % 8) :]
+
+    def build(unit_header):
+        kwargs = {k: restore_block(view, k, spec) for k, spec in unit_header.items()}
+        return ObservedSlaveContext(**kwargs)
+
+    units = {int(unit): spec for unit, spec in header["units"].items()}
+    if header["single"]:
+        context = ModbusServerContext(slaves=build(units[0]), single=True)
+        first = context[0]
+    else:
+        context = LazyServerContext(units, build)
+        first = context[1] if 1 in units else None
+
+    addr = dict(header["extra"])
+    if not header["single"]:
+        addr["units"] = units
+    if first is not None:
+        for k, fx in blocks.items():
+            block = first.store[fx]
+            count = units[0 if header["single"] else 1][k]["count"]
+            addr[k] = (0, block.getValues(0, min(count, 9)), count)
+    return context, addr
+
+
+class Snapshot:
+    """Periodic snapshot job for the server"""
+
+    def __init__(self, path, context, interval, extra=None):
+        """Initialise the job
+
+        :param path: The snapshot file
+        :param context: The ModbusServerContext to save
+        :param interval: Seconds between snapshots
+        :param extra: JSON-able settings stored alongside the data
+        """
+        self.path = path
+        self.context = context
+        self.interval = interval
+        self.extra = extra
+
+    def save(self):
+        """Snapshot now"""
+
+        save(self.path, self.context, self.extra)
+
+    async def run(self):
+        """Snapshot every interval, writing off the event loop"""
+
+        while True:
+            await asyncio.sleep(self.interval)
+            header, chunks = dump(self.context, self.extra)
+            await asyncio.to_thread(write, self.path, header, chunks)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+""" Regression tests for the hot reload of blockdata_init.yaml """
+
+# ~$ python3 -m pytest test_hotreload.py
+
+import asyncio
+
+import pytest
+import yaml
+
+import modbus_server
+from hotreload import ConfigWatcher, apply_blocks
+from simulation import Simulation
+
+base = {"di": [0, 0, 0, 0], "co": [0, 0, 0, 0], "ir": [0, 0, 0, 0], "hr": [0, 0, 0, 0]}
+
+
+def load(tmp_path, data):
+    """Write data as the YAML file and return its (err, addr)"""
+
+    path = tmp_path / "blockdata.yaml"
+    path.write_text(yaml.safe_dump({**base, **data}))
+    return modbus_server.get_blockdata(str(path), verbose=False)
+
+
+def test_client_write_between_edits_survives(tmp_path):
+    _, old = load(tmp_path, {"hr": [3, 3, 3, 3, 0, 0, 0, 0]})
+    _, new = load(tmp_path, {"hr": [9, 3, 3, 3, 0, 0, 0, 5]})
+    context = modbus_server.build_context(old)
+    context[0].setValues(3, 4, [42])
+    apply_blocks(context[0], old, new)
+    assert context[0].getValues(3, 0, 8) == [9, 3, 3, 3, 42, 0, 0, 5]
+
+
+def test_bad_simulation_rejects_whole_reload(tmp_path):
+    _, old = load(tmp_path, {"hr": [3, 3, 3, 3], "ir": [0, 0, 0, 0]})
+    _, new = load(tmp_path, {
+        "hr": [7, 7, 7, 7],
+        "ir": [0, 0, 0, 0],
+        "simulation": {"ir": [{"start": 0, "count": 2, "wave": "bogus"}]},
+    })
+    context = modbus_server.build_context(old)
+    simulation = Simulation(context, {})
+    watcher = ConfigWatcher(str(tmp_path / "blockdata.yaml"), context, None, old, 0, simulation)
+    with pytest.raises(ValueError):
+        watcher.apply(new)
+    assert context[0].getValues(3, 0, 4) == [3, 3, 3, 3]
+    assert watcher.addr is old
+    assert simulation.groups == []
+
+
+def test_simulation_checked_against_new_block_size(tmp_path):
+    _, old = load(tmp_path, {"ir": [0, 0]})
+    _, new = load(tmp_path, {
+        "ir": [0, 0, 0, 0, 0, 0],
+        "simulation": {"ir": [{"start": 2, "count": 4}]},
+    })
+    context = modbus_server.build_context(old)
+    simulation = Simulation(context, {})
+    ConfigWatcher(str(tmp_path / "blockdata.yaml"), context, None, old, 0, simulation).apply(new)
+    assert len(simulation.groups) == 1
+
+
+def test_shrunk_block_rejects_unchanged_simulation(tmp_path):
+    simulated = {"ir": [{"start": 0, "count": 8}]}
+    _, old = load(tmp_path, {"ir": [0] * 8, "hr": [3, 3, 3, 3], "simulation": simulated})
+    _, new = load(tmp_path, {"ir": [0] * 4, "hr": [7, 7, 7, 7], "simulation": simulated})
+    context = modbus_server.build_context(old)
+    simulation = Simulation(context, simulated)
+    groups = simulation.groups
+    watcher = ConfigWatcher(str(tmp_path / "blockdata.yaml"), context, None, old, 0, simulation)
+    with pytest.raises(ValueError):
+        watcher.apply(new)
+    assert context[0].getValues(3, 0, 4) == [3, 3, 3, 3]
+    assert watcher.addr is old
+    assert simulation.groups is groups
+    simulation.tick(0.0)
+
+
+def test_watcher_survives_bad_edit(tmp_path):
+    path = tmp_path / "blockdata.yaml"
+    _, addr = load(tmp_path, {"hr": [1, 1, 1, 1]})
+    context = modbus_server.build_context(addr)
+    simulation = Simulation(context, {})
+    watcher = ConfigWatcher(
+        str(path), context,
+        lambda: modbus_server.get_blockdata(str(path), verbose=False),
+        addr, 0.01, simulation,
+    )
+
+    async def edit(data):
+        load(tmp_path, data)
+        # // Make sure the stamp differs even on coarse mtimes //
+        watcher.stamp = None
+        await asyncio.sleep(0.1)
+
+    async def scenario():
+        task = asyncio.create_task(watcher.run())
+        await edit({"hr": [1, 1, 1, 1], "simulation": {"ir": [{"wave": "bogus"}]}})
+        await edit({"hr": [2, 2, 2, 2]})
+        assert not task.done()
+        task.cancel()
+
+    asyncio.run(scenario())
+    assert context[0].getValues(3, 0, 4) == [2, 2, 2, 2]
+    assert watcher.reloads == 1